@@ -0,0 +1,218 @@
+"""
+Atualização incremental do ARIMA(1,1,1) por linha.
+
+O estado de cada linha (phi, theta, sigma2 e o estado final do filtro:
+último nível, última diferença e última inovação) fica salvo em Parquet.
+A cada execução, as horas novas de cada linha passam apenas pelo filtro
+recursivo das inovações, sem reestimar nada, e a previsão sai do estado
+atualizado. O ajuste completo (em lote, via `arima_lote`) só é refeito
+para linhas sem estado, com ajuste vencido ou cujo erro de previsão um
+passo à frente se afastou da variância do ajuste.
+"""
+
+from __future__ import annotations
+
+import os
+from datetime import datetime, timedelta
+from typing import Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from arima_lote import _alinhar, ajustar_arima_lote, previsao_ou_media, prever_passos
+
+
+BASE_PATH = os.path.dirname(os.path.dirname(__file__))
+ESTADO_ARIMA_PATH = os.path.join(BASE_PATH, "dados", "estado_arima.parquet")
+
+REAJUSTE_APOS = timedelta(hours=24)  # Ajuste completo no máximo uma vez por dia
+LIMITE_DERIVA = 4.0                  # Erro quadrático recente / sigma2 (RMSE ~2x o do ajuste)
+ALFA_ERRO = 0.1                      # Peso de cada nova inovação na média móvel do erro
+
+COLUNAS_ESTADO = [
+    "phi", "theta", "sigma2", "ultimo_y", "ultimo_d", "ultima_inovacao",
+    "erro_recente", "observacoes", "ultima_hora", "ajustado_em", "status",
+]
+
+
+def filtrar_inovacoes(
+    phi: np.ndarray,
+    theta: np.ndarray,
+    ultimo_y: np.ndarray,
+    ultimo_d: np.ndarray,
+    ultima_inovacao: np.ndarray,
+    erro_recente: np.ndarray,
+    novas: Sequence[np.ndarray],
+):
+    """
+    Incorpora as observações novas de cada série ao estado do filtro,
+    com os coeficientes fixos (loop nas horas novas, vetorizado entre séries).
+
+    Returns:
+        (ultimo_y, ultimo_d, ultima_inovacao, erro_recente) atualizados
+    """
+    y = ultimo_y.copy()
+    d = ultimo_d.copy()
+    eps = ultima_inovacao.copy()
+    erro = erro_recente.copy()
+
+    Y = _alinhar([np.asarray(v, dtype=np.float64) for v in novas])
+    for t in range(Y.shape[1]):
+        y_t = Y[:, t]
+        presente = np.isfinite(y_t)
+        d_t = y_t - y
+        novo_eps = d_t - phi * d - theta * eps
+        y = np.where(presente, y_t, y)
+        d = np.where(presente, d_t, d)
+        eps = np.where(presente, novo_eps, eps)
+        erro = np.where(presente, (1 - ALFA_ERRO) * erro + ALFA_ERRO * novo_eps ** 2, erro)
+    return y, d, eps, erro
+
+
+class EstadosArima:
+    """Estado do ARIMA por linha, persistido entre as execuções do treino."""
+
+    def __init__(self, caminho: Optional[str] = ESTADO_ARIMA_PATH):
+        self.caminho = caminho
+        self.tabela = self._carregar()
+
+    def _carregar(self) -> pd.DataFrame:
+        if self.caminho and os.path.exists(self.caminho):
+            try:
+                return pd.read_parquet(self.caminho).set_index("chave")
+            except (OSError, ValueError) as e:
+                print(f"⚠️ Estado do ARIMA ilegível, refazendo os ajustes: {e}")
+        return pd.DataFrame(columns=COLUNAS_ESTADO, index=pd.Index([], name="chave"))
+
+    def salvar(self) -> None:
+        """Grava o estado (atômico); sem caminho, o estado vive só em memória."""
+        if not self.caminho:
+            return
+        os.makedirs(os.path.dirname(self.caminho), exist_ok=True)
+        temporario = self.caminho + ".tmp"
+        self.tabela.reset_index().to_parquet(temporario, index=False)
+        os.replace(temporario, self.caminho)
+
+    def __len__(self) -> int:
+        return len(self.tabela)
+
+    def desde(self) -> Optional[datetime]:
+        """Hora mais antiga já incorporada (o que precisa ser lido do histórico)."""
+        if len(self.tabela) == 0:
+            return None
+        return pd.Timestamp(self.tabela["ultima_hora"].min()).to_pydatetime()
+
+    def atualizar(
+        self,
+        dados: pd.DataFrame,
+        coluna_chave: str = "linha",
+        coluna_hora: str = "timestamp",
+        coluna_valor: str = "demanda_passageiros",
+        passos: int = 3,
+        agora: Optional[datetime] = None,
+        forcar_reajuste: bool = False,
+    ) -> pd.DataFrame:
+        """
+        Atualiza o estado de cada série e retorna as previsões.
+
+        Args:
+            dados: Séries no formato longo (uma linha por chave e hora)
+            coluna_chave, coluna_hora, coluna_valor: Colunas de `dados`
+            passos: Horizonte da previsão
+            agora: Referência para o reajuste agendado (padrão: agora)
+            forcar_reajuste: Refaz o ajuste completo de todas as séries
+
+        Returns:
+            DataFrame por chave com `acao` ('filtro', 'sem_novidade' ou
+            'reajuste'), `motivo`, `status` e `previsao_1..passos`
+        """
+        agora = pd.Timestamp(agora or datetime.now())
+        dados = dados.sort_values([coluna_chave, coluna_hora], kind="stable")
+        chaves, inicios, tamanhos = np.unique(
+            dados[coluna_chave].astype(str).to_numpy(), return_index=True, return_counts=True)
+        horas = dados[coluna_hora].to_numpy("datetime64[ns]")
+        valores = dados[coluna_valor].to_numpy(np.float64)
+        fins = inicios + tamanhos
+        estado = self.tabela.reindex(chaves)
+
+        # Motivo do reajuste completo (vetorizado sobre o estado salvo)
+        motivos = pd.Series(None, index=estado.index, dtype=object)
+        if forcar_reajuste:
+            motivos[:] = "forcado"
+        else:
+            motivos[pd.to_datetime(estado["ajustado_em"]) <= agora - REAJUSTE_APOS] = "agendado"
+            motivos[estado["status"] == "falha"] = "falha_anterior"
+            motivos[estado["status"].isna()] = "sem_estado"
+        acoes = np.where(motivos.notna(), "reajuste", "sem_novidade").astype(object)
+
+        # 1) Horas novas das demais séries passam só pelo filtro
+        ultima_hora = pd.to_datetime(estado["ultima_hora"]).to_numpy("datetime64[ns]")
+        nova = (horas > np.repeat(ultima_hora, tamanhos)) & np.repeat(acoes == "sem_novidade", tamanhos)
+        contagem = np.add.reduceat(nova, inicios) if len(inicios) else np.zeros(0, dtype=np.int64)
+        posicoes = np.flatnonzero(contagem)
+
+        if len(posicoes):
+            rotulos = chaves[posicoes]
+            atual = estado.iloc[posicoes]
+            y, d, eps, erro = filtrar_inovacoes(
+                *(atual[col].to_numpy(np.float64) for col in
+                  ("phi", "theta", "ultimo_y", "ultimo_d", "ultima_inovacao", "erro_recente")),
+                np.split(valores[nova], np.cumsum(contagem[posicoes])[:-1]),
+            )
+            self.tabela.loc[rotulos, "ultimo_y"] = y
+            self.tabela.loc[rotulos, "ultimo_d"] = d
+            self.tabela.loc[rotulos, "ultima_inovacao"] = eps
+            self.tabela.loc[rotulos, "erro_recente"] = erro
+            self.tabela.loc[rotulos, "observacoes"] = atual["observacoes"].to_numpy(np.int64) + contagem[posicoes]
+            self.tabela.loc[rotulos, "ultima_hora"] = horas[fins[posicoes] - 1]
+            acoes[posicoes] = "filtro"
+
+            # Erro um passo à frente muito acima do ajuste -> reajuste completo
+            deriva = posicoes[erro > LIMITE_DERIVA * atual["sigma2"].to_numpy(np.float64)]
+            motivos.iloc[deriva] = "deriva"
+            acoes[deriva] = "reajuste"
+
+        # 2) Ajuste completo, em lote, apenas das séries que precisam
+        media = {}
+        indices = np.flatnonzero(acoes == "reajuste")
+        if len(indices):
+            series = {chaves[i]: valores[inicios[i]:fins[i]] for i in indices}
+            resultado = ajustar_arima_lote(series, passos=passos)
+            novo = pd.DataFrame({
+                "phi": resultado.phi,
+                "theta": resultado.theta,
+                "sigma2": resultado.sigma2,
+                "ultimo_y": resultado.ultimo_y,
+                "ultimo_d": resultado.ultimo_d,
+                "ultima_inovacao": resultado.ultima_inovacao,
+                "erro_recente": resultado.sigma2,
+                "observacoes": resultado.observacoes,
+                "ultima_hora": horas[fins[indices] - 1],
+                "ajustado_em": agora,
+                "status": resultado.status,
+            }, index=pd.Index(resultado.chaves, name="chave"))
+            mantidos = self.tabela.drop(index=resultado.chaves, errors="ignore")
+            self.tabela = pd.concat([mantidos, novo]) if len(mantidos) else novo
+            for chave, motivo in resultado.motivos.items():
+                motivos[chave] = f"{motivos[chave]}: {motivo}"
+            media = previsao_ou_media(resultado, series)
+
+        # 3) Previsões a partir do estado atual de cada série
+        estado = self.tabela.loc[chaves]
+        previsoes = prever_passos(
+            *(estado[col].to_numpy(np.float64) for col in
+              ("phi", "theta", "ultimo_y", "ultimo_d", "ultima_inovacao")),
+            passos,
+        )
+        saida = pd.DataFrame({
+            "acao": acoes,
+            "motivo": motivos.to_numpy(),
+            "status": estado["status"].to_numpy(),
+        }, index=pd.Index(chaves, name="chave"))
+        for passo in range(passos):
+            saida[f"previsao_{passo + 1}"] = previsoes[:, passo]
+
+        # Séries com falha (sempre reajustadas nesta execução) usam a média recente
+        for chave in saida.index[saida["status"] == "falha"]:
+            saida.loc[chave, [f"previsao_{p + 1}" for p in range(passos)]] = media[chave]
+        return saida
@@ -0,0 +1,256 @@
+"""
+Ajuste de ARIMA(1,1,1) para muitas séries ao mesmo tempo.
+
+Em vez de um `statsmodels.ARIMA` por linha, todas as séries são alinhadas
+pela última observação em uma matriz (séries x tempo, com máscara para os
+tamanhos diferentes) e estimadas juntas pelo método de Hannan-Rissanen:
+
+1. AR longo por mínimos quadrados (equações normais em lote) para
+   aproximar as inovações;
+2. regressão de d_t em d_{t-1} e na inovação estimada e_{t-1}, que dá
+   phi (AR) e theta (MA) de cada série;
+3. filtro recursivo das inovações, vetorizado entre as séries, para obter
+   o estado final usado na previsão de vários passos.
+
+Séries curtas, com valores não finitos, constantes ou com sistema singular
+são reportadas com o motivo em vez de cair silenciosamente em uma média.
+"""
+
+from __future__ import annotations
+
+import warnings
+from dataclasses import dataclass, field
+from typing import Dict, List, Mapping, Sequence
+
+import numpy as np
+import pandas as pd
+
+
+LIMITE_COEFICIENTE = 0.99  # |phi|, |theta| < 1 (estacionário e invertível)
+MIN_OBSERVACOES = 10
+
+
+@dataclass
+class ResultadoArimaLote:
+    """Parâmetros, estado final e previsões de um ajuste em lote."""
+
+    chaves: List[str]
+    previsoes: np.ndarray        # (séries, passos), NaN nas séries com falha
+    phi: np.ndarray
+    theta: np.ndarray
+    sigma2: np.ndarray
+    ultimo_y: np.ndarray         # Último nível observado
+    ultimo_d: np.ndarray         # Última diferença
+    ultima_inovacao: np.ndarray  # Última inovação filtrada
+    observacoes: np.ndarray
+    status: np.ndarray           # 'ok', 'ajustado' (coeficiente limitado) ou 'falha'
+    motivos: Dict[str, str] = field(default_factory=dict)
+
+    def __len__(self) -> int:
+        return len(self.chaves)
+
+    def indice(self, chave: str) -> int:
+        return self.chaves.index(chave)
+
+    def previsao(self, chave: str) -> np.ndarray:
+        return self.previsoes[self.indice(chave)]
+
+    def falhas(self) -> Dict[str, str]:
+        """Séries que não puderam ser ajustadas e o motivo."""
+        return {c: self.motivos[c] for c, s in zip(self.chaves, self.status) if s == "falha"}
+
+    def para_dataframe(self) -> pd.DataFrame:
+        df = pd.DataFrame({
+            "chave": self.chaves,
+            "phi": self.phi,
+            "theta": self.theta,
+            "sigma2": self.sigma2,
+            "observacoes": self.observacoes,
+            "status": self.status,
+            "motivo": [self.motivos.get(c) for c in self.chaves],
+        })
+        for passo in range(self.previsoes.shape[1]):
+            df[f"previsao_{passo + 1}"] = self.previsoes[:, passo]
+        return df
+
+
+def _alinhar(series: Sequence[np.ndarray]) -> np.ndarray:
+    """Matriz (séries x tempo) alinhada à direita; posições vazias são NaN."""
+    tamanho = max((len(s) for s in series), default=0)
+    matriz = np.full((len(series), tamanho), np.nan)
+    for i, serie in enumerate(series):
+        if len(serie):
+            matriz[i, tamanho - len(serie):] = serie
+    return matriz
+
+
+def _defasagens(matriz: np.ndarray, k: int) -> np.ndarray:
+    """matriz deslocada k posições no tempo (NaN no início)."""
+    saida = np.full_like(matriz, np.nan)
+    if k < matriz.shape[1]:
+        saida[:, k:] = matriz[:, : matriz.shape[1] - k]
+    return saida
+
+
+def _minimos_quadrados(regressores: List[np.ndarray], alvo: np.ndarray):
+    """
+    Resolve, para cada série, a regressão alvo ~ regressores usando apenas
+    os instantes em que todos os valores existem.
+
+    Returns:
+        (coeficientes (séries x k), equações válidas por série, determinante relativo)
+    """
+    validos = np.isfinite(alvo)
+    for regressor in regressores:
+        validos &= np.isfinite(regressor)
+
+    X = np.stack([np.where(validos, r, 0.0) for r in regressores], axis=2)  # (S, T, k)
+    y = np.where(validos, alvo, 0.0)
+    XtX = np.einsum("stk,stj->skj", X, X)
+    Xty = np.einsum("stk,st->sk", X, y)
+
+    # Determinante normalizado pela escala da diagonal detecta colinearidade
+    escala = np.prod(np.maximum(np.diagonal(XtX, axis1=1, axis2=2), 1e-300), axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):  # Séries com falha (tudo zero)
+        det_relativo = np.abs(np.linalg.det(XtX)) / escala
+
+    k = len(regressores)
+    regularizado = XtX + np.eye(k)[None] * 1e-10 * np.maximum(np.trace(XtX, axis1=1, axis2=2), 1.0)[:, None, None]
+    coeficientes = np.linalg.solve(regularizado, Xty[..., None])[..., 0]
+    return coeficientes, validos.sum(axis=1), det_relativo
+
+
+def ajustar_arima_lote(
+    series: Mapping[str, Sequence[float]],
+    passos: int = 3,
+    ordem_ar_longo: int = 4,
+    min_observacoes: int = MIN_OBSERVACOES,
+) -> ResultadoArimaLote:
+    """
+    Ajusta ARIMA(1,1,1) sem constante a todas as séries e prevê `passos` à frente.
+
+    Args:
+        series: chave (ex.: código da linha) -> valores em ordem temporal
+        passos: Horizonte da previsão
+        ordem_ar_longo: Ordem do AR usado para aproximar as inovações
+        min_observacoes: Séries menores são reportadas como falha
+    """
+    chaves = [str(c) for c in series]
+    valores = [np.asarray(series[c], dtype=np.float64) for c in series]
+    n = len(chaves)
+    motivos: Dict[str, str] = {}
+    falha = np.zeros(n, dtype=bool)
+
+    observacoes = np.array([len(v) for v in valores], dtype=np.int64)
+    for i, v in enumerate(valores):
+        if len(v) < min_observacoes:
+            falha[i], motivos[chaves[i]] = True, f"serie_curta ({len(v)} < {min_observacoes} observações)"
+        elif not np.isfinite(v).all():
+            falha[i], motivos[chaves[i]] = True, "valores_nao_finitos"
+
+    Y = _alinhar([v if not falha[i] else np.array([]) for i, v in enumerate(valores)])
+    if Y.shape[1] < 2:
+        Y = np.full((n, 2), np.nan)
+    D = np.diff(Y, axis=1)
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)  # Linhas só com NaN (séries com falha)
+        amplitude = np.nanmax(D, axis=1) - np.nanmin(D, axis=1)
+    constante = ~falha & (amplitude == 0)
+    for i in np.flatnonzero(constante):
+        falha[i], motivos[chaves[i]] = True, "serie_constante"
+    D[falha] = np.nan
+
+    # 1) AR longo -> inovações aproximadas
+    ordem = max(1, min(ordem_ar_longo, max(1, min_observacoes // 3)))
+    coef_ar, _, _ = _minimos_quadrados([_defasagens(D, k) for k in range(1, ordem + 1)], D)
+    previsto = sum(coef_ar[:, k - 1:k] * _defasagens(D, k) for k in range(1, ordem + 1))
+    inovacoes = D - previsto
+
+    # 2) d_t ~ phi d_{t-1} + theta e_{t-1}
+    coef, equacoes, det_relativo = _minimos_quadrados([_defasagens(D, 1), _defasagens(inovacoes, 1)], D)
+    phi, theta = coef[:, 0], coef[:, 1]
+
+    for i in np.flatnonzero(~falha & ((equacoes < 3) | (det_relativo < 1e-8) | ~np.isfinite(coef).all(axis=1))):
+        falha[i], motivos[chaves[i]] = True, "sistema_singular"
+
+    status = np.where(falha, "falha", "ok").astype(object)
+    fora = ~falha & ((np.abs(phi) >= LIMITE_COEFICIENTE) | (np.abs(theta) >= LIMITE_COEFICIENTE))
+    status[fora] = "ajustado"
+    for i in np.flatnonzero(fora):
+        motivos[chaves[i]] = f"coeficientes limitados (phi={phi[i]:.3f}, theta={theta[i]:.3f})"
+    phi = np.clip(phi, -LIMITE_COEFICIENTE, LIMITE_COEFICIENTE)
+    theta = np.clip(theta, -LIMITE_COEFICIENTE, LIMITE_COEFICIENTE)
+
+    # 3) Filtro das inovações (loop no tempo, vetorizado entre as séries)
+    eps = np.zeros(n)
+    d_anterior = np.zeros(n)
+    soma_quadrados = np.zeros(n)
+    contagem = np.zeros(n)
+    for t in range(D.shape[1]):
+        d_t = D[:, t]
+        presente = np.isfinite(d_t)
+        # Primeira diferença de cada série: sem passado, a inovação é d_t
+        inicio = presente & (contagem == 0)
+        novo_eps = np.where(inicio, d_t, d_t - phi * d_anterior - theta * eps)
+        eps = np.where(presente, novo_eps, eps)
+        d_anterior = np.where(presente, d_t, d_anterior)
+        soma_quadrados += np.where(presente, novo_eps ** 2, 0.0)
+        contagem += presente
+
+    sigma2 = np.where(contagem > 0, soma_quadrados / np.maximum(contagem, 1), np.nan)
+    ultimo_y = Y[:, -1]
+
+    previsoes = prever_passos(phi, theta, ultimo_y, d_anterior, eps, passos)
+    previsoes[falha] = np.nan
+    for vetor in (phi, theta, sigma2):
+        vetor[falha] = np.nan
+
+    return ResultadoArimaLote(
+        chaves=chaves,
+        previsoes=previsoes,
+        phi=phi,
+        theta=theta,
+        sigma2=sigma2,
+        ultimo_y=ultimo_y,
+        ultimo_d=d_anterior,
+        ultima_inovacao=eps,
+        observacoes=observacoes,
+        status=status,
+        motivos=motivos,
+    )
+
+
+def prever_passos(
+    phi: np.ndarray,
+    theta: np.ndarray,
+    ultimo_y: np.ndarray,
+    ultimo_d: np.ndarray,
+    ultima_inovacao: np.ndarray,
+    passos: int,
+) -> np.ndarray:
+    """Previsão de `passos` níveis à frente a partir do estado final de cada série."""
+    diferencas = np.empty((len(phi), passos))
+    d = phi * ultimo_d + theta * ultima_inovacao
+    for passo in range(passos):
+        diferencas[:, passo] = d
+        d = phi * d
+    return ultimo_y[:, None] + np.cumsum(diferencas, axis=1)
+
+
+def previsao_ou_media(
+    resultado: ResultadoArimaLote,
+    series: Mapping[str, Sequence[float]],
+    janela: int = 5,
+) -> Dict[str, np.ndarray]:
+    """Previsões por chave; séries com falha usam a média das últimas `janela` observações."""
+    saida = {}
+    for i, chave in enumerate(resultado.chaves):
+        if resultado.status[i] == "falha":
+            valores = np.asarray(series[chave], dtype=np.float64)
+            valores = valores[np.isfinite(valores)][-janela:]
+            media = valores.mean() if len(valores) else np.nan
+            saida[chave] = np.full(resultado.previsoes.shape[1], media)
+        else:
+            saida[chave] = resultado.previsoes[i]
+    return saida
@@ -0,0 +1,264 @@
+"""
+Backfill do histórico climático horário de São Paulo.
+
+Busca o clima observado (endpoint de arquivo do Open-Meteo) para longos
+intervalos de datas, dividindo o intervalo em blocos consultados em
+paralelo com limite de requisições por segundo. Cada bloco concluído é
+gravado como uma parte Parquet, então uma execução interrompida retoma
+apenas os blocos que faltam. Ao final as partes são consolidadas em um
+único arquivo colunar indexado por hora, lido pelo treino sem rede.
+
+Uso: python src/backfill_clima.py --inicio 2024-01-01 --fim 2024-12-31 [--url http://localhost:8000/v1/archive]
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date, datetime, timedelta
+from typing import List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from clima_openmeteo import COLUNAS_CLIMA, ClimaOpenMeteo, PrevisaoHoraria
+
+
+BASE_PATH = os.path.dirname(os.path.dirname(__file__))
+CLIMA_HISTORICO_PATH = os.path.join(BASE_PATH, "dados", "clima_historico.parquet")
+PARTES_PATH = os.path.join(BASE_PATH, "dados", "clima_historico_partes")
+
+ARCHIVE_URL = ClimaOpenMeteo.ARCHIVE_URL
+COMPRESSAO = "zstd"
+
+SCHEMA = pa.schema([
+    ("hora", pa.timestamp("us")),
+    ("temperatura", pa.float32()),
+    ("umidade", pa.float32()),
+    ("precipitacao", pa.float32()),
+    ("codigo_clima", pa.int16()),
+    ("velocidade_vento", pa.float32()),
+])
+
+
+class LimitadorTaxa:
+    """Espaça as requisições de todas as threads em no máximo N por segundo."""
+
+    def __init__(self, requisicoes_por_s: float):
+        self.intervalo = 1.0 / requisicoes_por_s if requisicoes_por_s > 0 else 0.0
+        self._proxima = time.monotonic()
+        self._lock = threading.Lock()
+
+    def aguardar(self) -> None:
+        with self._lock:
+            agora = time.monotonic()
+            espera = self._proxima - agora
+            self._proxima = max(agora, self._proxima) + self.intervalo
+        if espera > 0:
+            time.sleep(espera)
+
+
+def dividir_intervalo(inicio: date, fim: date, dias_por_bloco: int = 31) -> List[Tuple[date, date]]:
+    """Divide [inicio, fim] (inclusivo) em blocos de até `dias_por_bloco` dias."""
+    blocos = []
+    atual = inicio
+    while atual <= fim:
+        ultimo = min(atual + timedelta(days=dias_por_bloco - 1), fim)
+        blocos.append((atual, ultimo))
+        atual = ultimo + timedelta(days=1)
+    return blocos
+
+
+def _nome_parte(bloco: Tuple[date, date]) -> str:
+    return f"{bloco[0]:%Y-%m-%d}_{bloco[1]:%Y-%m-%d}.parquet"
+
+
+def _para_tabela(previsao: PrevisaoHoraria) -> pa.Table:
+    horas = (previsao.hora_inicial + np.arange(len(previsao))).astype("datetime64[h]")
+    colunas = {"hora": horas.astype("datetime64[us]")}
+    for coluna in COLUNAS_CLIMA:
+        colunas[coluna] = getattr(previsao, coluna)
+    df = pd.DataFrame(colunas)
+    df["codigo_clima"] = df["codigo_clima"].astype("Int16")
+    return pa.Table.from_pandas(df, schema=SCHEMA, preserve_index=False)
+
+
+def buscar_bloco(
+    cliente: ClimaOpenMeteo,
+    bloco: Tuple[date, date],
+    url: str = ARCHIVE_URL,
+    limitador: Optional[LimitadorTaxa] = None,
+    tentativas: int = 3,
+) -> Optional[pa.Table]:
+    """Consulta um bloco de datas; tenta de novo com espera crescente em caso de falha."""
+    for tentativa in range(tentativas):
+        if tentativa:
+            time.sleep(2 ** (tentativa - 1))
+        if limitador is not None:
+            limitador.aguardar()
+        previsao = cliente.obter_historico(bloco[0], bloco[1], url=url)
+        if previsao is not None:
+            return _para_tabela(previsao)
+    return None
+
+
+def consolidar(partes: str = PARTES_PATH, destino: str = CLIMA_HISTORICO_PATH) -> int:
+    """Junta as partes em um único arquivo ordenado por hora (uma linha por hora)."""
+    arquivos = sorted(
+        os.path.join(partes, nome) for nome in os.listdir(partes) if nome.endswith(".parquet")
+    ) if os.path.isdir(partes) else []
+    if os.path.exists(destino):
+        arquivos.insert(0, destino)
+    if not arquivos:
+        return 0
+
+    df = ds.dataset(arquivos, schema=SCHEMA, format="parquet").to_table().to_pandas()
+    # Partes mais novas prevalecem sobre o arquivo consolidado anterior
+    df = df.drop_duplicates(subset="hora", keep="last").sort_values("hora")
+
+    os.makedirs(os.path.dirname(destino), exist_ok=True)
+    temporario = destino + ".tmp"
+    pq.write_table(pa.Table.from_pandas(df, schema=SCHEMA, preserve_index=False),
+                   temporario, compression=COMPRESSAO)
+    os.replace(temporario, destino)
+    return len(df)
+
+
+def executar_backfill(
+    inicio: date,
+    fim: date,
+    url: str = ARCHIVE_URL,
+    workers: int = 4,
+    requisicoes_por_s: float = 5.0,
+    dias_por_bloco: int = 31,
+    partes: str = PARTES_PATH,
+    destino: str = CLIMA_HISTORICO_PATH,
+    tentativas: int = 3,
+) -> dict:
+    """
+    Executa (ou retoma) o backfill de [inicio, fim] e consolida o resultado.
+
+    Returns:
+        Dict com blocos totais, já existentes, baixados e com falha, e o
+        número de horas no arquivo consolidado
+    """
+    os.makedirs(partes, exist_ok=True)
+    blocos = dividir_intervalo(inicio, fim, dias_por_bloco)
+    pendentes = [b for b in blocos if not os.path.exists(os.path.join(partes, _nome_parte(b)))]
+    print(f"🌦️ Backfill climático {inicio} → {fim}: {len(blocos)} blocos, {len(pendentes)} pendentes")
+
+    cliente = ClimaOpenMeteo()
+    limitador = LimitadorTaxa(requisicoes_por_s)
+    falhas = []
+
+    def _baixar(bloco):
+        tabela = buscar_bloco(cliente, bloco, url, limitador, tentativas)
+        if tabela is None:
+            return False
+        arquivo = os.path.join(partes, _nome_parte(bloco))
+        pq.write_table(tabela, arquivo + ".tmp", compression=COMPRESSAO)
+        os.replace(arquivo + ".tmp", arquivo)
+        return True
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futuros = {executor.submit(_baixar, bloco): bloco for bloco in pendentes}
+        for futuro in as_completed(futuros):
+            bloco = futuros[futuro]
+            try:
+                ok = futuro.result()
+            except Exception as e:
+                print(f"   ⚠️ Bloco {bloco[0]} → {bloco[1]}: {e}")
+                ok = False
+            if ok:
+                print(f"   ✅ {bloco[0]} → {bloco[1]}")
+            else:
+                falhas.append(bloco)
+
+    horas = consolidar(partes, destino)
+    if falhas:
+        print(f"   ⚠️ {len(falhas)} blocos falharam; execute novamente para retomar")
+    print(f"💾 {horas} horas em {destino}")
+    return {
+        'blocos': len(blocos),
+        'existentes': len(blocos) - len(pendentes),
+        'baixados': len(pendentes) - len(falhas),
+        'falhas': len(falhas),
+        'horas': horas,
+    }
+
+
+def carregar_clima_historico(
+    inicio: Optional[datetime] = None,
+    fim: Optional[datetime] = None,
+    caminho: str = CLIMA_HISTORICO_PATH,
+) -> pd.DataFrame:
+    """
+    Lê o histórico climático local (sem rede) no formato de
+    ClimaOpenMeteo.tabela_horaria(): coluna `hora` + colunas climáticas.
+    """
+    if not os.path.exists(caminho):
+        return SCHEMA.empty_table().to_pandas()
+
+    filtro = None
+    if inicio is not None:
+        filtro = ds.field("hora") >= pa.scalar(pd.Timestamp(inicio).floor("h").to_pydatetime(), type=pa.timestamp("us"))
+    if fim is not None:
+        condicao = ds.field("hora") <= pa.scalar(pd.Timestamp(fim).to_pydatetime(), type=pa.timestamp("us"))
+        filtro = condicao if filtro is None else filtro & condicao
+
+    df = ds.dataset(caminho, schema=SCHEMA, format="parquet").to_table(filter=filtro).to_pandas()
+    df["hora"] = df["hora"].astype("datetime64[ns]")
+    return df
+
+
+def preencher_clima_historico(df: pd.DataFrame, caminho: str = CLIMA_HISTORICO_PATH) -> pd.DataFrame:
+    """
+    Completa as colunas climáticas ausentes de registros históricos com o
+    clima observado na hora de cada registro (arquivo local, sem rede).
+    """
+    from coleta_sptrans import derivar_features_climaticas, juntar_clima_por_hora
+
+    if len(df) == 0 or 'timestamp' not in df.columns or not os.path.exists(caminho):
+        return df
+
+    tempos = pd.to_datetime(df['timestamp'])
+    tabela = carregar_clima_historico(tempos.min(), tempos.max(), caminho)
+    if len(tabela) == 0:
+        return df
+
+    df = df.copy()
+    clima = juntar_clima_por_hora(tempos, tabela)
+    for coluna in COLUNAS_CLIMA:
+        df[coluna] = df[coluna].fillna(clima[coluna]) if coluna in df.columns else clima[coluna]
+
+    # Recalcula as derivadas apenas onde o clima passou a existir
+    faltantes = df[['temperatura', 'umidade', 'precipitacao']].notna().all(axis=1)
+    derivadas = derivar_features_climaticas(df.loc[faltantes, ['temperatura', 'umidade', 'precipitacao']].copy())
+    for coluna in ('tem_chuva', 'temperatura_categoria_codigo', 'umidade_alta'):
+        atual = df[coluna] if coluna in df.columns else pd.Series(np.nan, index=df.index)
+        df[coluna] = atual.fillna(derivadas[coluna])
+    return df
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Backfill do histórico climático horário (Open-Meteo)")
+    parser.add_argument("--inicio", type=date.fromisoformat, required=True, help="AAAA-MM-DD")
+    parser.add_argument("--fim", type=date.fromisoformat, default=date.today() - timedelta(days=1), help="AAAA-MM-DD")
+    parser.add_argument("--url", default=ARCHIVE_URL, help="Endpoint compatível com a API de arquivo")
+    parser.add_argument("--workers", type=int, default=4, help="Requisições simultâneas")
+    parser.add_argument("--taxa", type=float, default=5.0, help="Máximo de requisições por segundo")
+    parser.add_argument("--dias-por-bloco", type=int, default=31)
+    args = parser.parse_args(argv)
+
+    executar_backfill(args.inicio, args.fim, url=args.url, workers=args.workers,
+                      requisicoes_por_s=args.taxa, dias_por_bloco=args.dias_por_bloco)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+"""
+Backtest walk-forward dos modelos de demanda por linha.
+
+Para cada corte no tempo (janela de origem móvel), o RF e o ARIMA(1,1,1)
+de cada linha são treinados só com as horas anteriores ao corte e
+avaliados nas `horizonte` horas seguintes. As dobras e blocos de linhas
+rodam em um pool de processos; as features das dobras saem do feature
+store (calculadas uma vez para a janela toda). O resultado é um artefato
+de métricas por linha, horizonte e modelo, além do custo de treino, que
+alimenta o relatório de predição.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestRegressor
+
+from arima_lote import ajustar_arima_lote, previsao_ou_media
+from feature_store import features_em_cache
+
+
+BASE_PATH = os.path.dirname(os.path.dirname(__file__))
+BACKTEST_PATH = os.path.join(BASE_PATH, "dados", "backtest")
+METRICAS_ARQUIVO = "metricas.parquet"
+RESUMO_ARQUIVO = "resumo.json"
+
+N_DOBRAS = 4
+HORIZONTE = 3
+MIN_TREINO = 10      # Horas de treino exigidas por linha em cada dobra
+LINHAS_POR_TAREFA = 50
+PESO_RF = 0.7        # Mesma combinação do modelo em produção
+
+
+def cortes_walk_forward(timestamps: pd.Series, n_dobras: int = N_DOBRAS, horizonte: int = HORIZONTE) -> List[pd.Timestamp]:
+    """
+    Origens das dobras: horas distintas igualmente espaçadas na metade final
+    da janela, deixando `horizonte` horas de teste depois da última.
+    """
+    horas = np.sort(pd.to_datetime(timestamps).dt.floor("h").unique())
+    if len(horas) < 2 * horizonte + 2:
+        return []
+    posicoes = np.linspace(len(horas) // 2, len(horas) - horizonte, n_dobras).astype(int)
+    return [pd.Timestamp(horas[p]) for p in np.unique(posicoes)]
+
+
+def _metricas(real: np.ndarray, previsto: np.ndarray) -> Dict[str, float]:
+    erro = previsto - real
+    return {
+        "rmse": float(np.sqrt(np.mean(erro ** 2))),
+        "mae": float(np.mean(np.abs(erro))),
+        "mape": float(np.mean(np.abs(erro) / np.maximum(np.abs(real), 1)) * 100),
+    }
+
+
+def avaliar_bloco(df_bloco: pd.DataFrame, corte: pd.Timestamp, features: Sequence[str],
+                  horizonte: int = HORIZONTE) -> List[Dict]:
+    """
+    Treina e avalia todas as linhas do bloco em uma dobra (executado no pool).
+
+    Returns:
+        Registros (linha, dobra, horizonte, real, rf, arima, tempo de treino)
+    """
+    from modelo_arima_rf import semente_linha
+
+    registros = []
+    series_treino = {}
+    testes = {}
+    for linha, df_linha in df_bloco.groupby("linha", sort=True):
+        df_linha = df_linha.sort_values("timestamp")
+        treino = df_linha[df_linha["timestamp"] < corte]
+        teste = df_linha[df_linha["timestamp"] >= corte].head(horizonte)
+        if len(treino) < MIN_TREINO or len(teste) == 0:
+            continue
+
+        inicio = time.perf_counter()
+        modelo = RandomForestRegressor(n_estimators=50, random_state=semente_linha(linha))
+        modelo.fit(treino[list(features)], treino["demanda_passageiros"])
+        tempo_treino = time.perf_counter() - inicio
+        testes[linha] = (teste, modelo.predict(teste[list(features)]), tempo_treino)
+        series_treino[linha] = treino["demanda_passageiros"].to_numpy()
+
+    if not series_treino:
+        return registros
+
+    inicio = time.perf_counter()
+    arima = ajustar_arima_lote(series_treino, passos=horizonte)
+    previsoes_arima = previsao_ou_media(arima, series_treino)
+    tempo_arima = (time.perf_counter() - inicio) / len(series_treino)
+
+    for linha, (teste, previsto_rf, tempo_treino) in testes.items():
+        for passo, (real, rf) in enumerate(zip(teste["demanda_passageiros"].to_numpy(), previsto_rf)):
+            registros.append({
+                "linha": linha,
+                "corte": corte,
+                "horizonte": passo + 1,
+                "real": float(real),
+                "rf": float(rf),
+                "arima": float(previsoes_arima[linha][passo]),
+                "tempo_treino_s": tempo_treino + tempo_arima,
+            })
+    return registros
+
+
+def executar_backtest(
+    df: pd.DataFrame,
+    features: Sequence[str],
+    n_dobras: int = N_DOBRAS,
+    horizonte: int = HORIZONTE,
+    workers: Optional[int] = None,
+    diretorio: str = BACKTEST_PATH,
+    alvo: str = "simulado",
+) -> pd.DataFrame:
+    """
+    Roda todas as dobras e grava o artefato de métricas.
+
+    Args:
+        df: Séries horárias de todas as linhas, já com as features
+        features: Features do RF
+        n_dobras, horizonte: Cortes walk-forward e horas avaliadas após cada corte
+        workers: Processos do pool (None = número de CPUs; 1 = sem pool)
+        alvo: Origem de `demanda_passageiros` ('simulado' ou 'observado'), gravada no resumo
+
+    Returns:
+        Métricas por linha, horizonte e modelo
+    """
+    inicio = time.perf_counter()
+    cortes = cortes_walk_forward(df["timestamp"], n_dobras, horizonte)
+    if not cortes:
+        print("⚠️ Histórico curto demais para o backtest")
+        return pd.DataFrame()
+
+    linhas = sorted(df["linha"].unique())
+    blocos = [linhas[i:i + LINHAS_POR_TAREFA] for i in range(0, len(linhas), LINHAS_POR_TAREFA)]
+    colunas = ["linha", "timestamp", "demanda_passageiros", *features]
+    por_bloco = [df.loc[df["linha"].isin(bloco), colunas] for bloco in blocos]
+    tarefas = [(bloco, corte) for bloco in por_bloco for corte in cortes]
+    print(f"🔁 Backtest: {len(linhas)} linhas x {len(cortes)} dobras "
+          f"({len(tarefas)} tarefas, horizonte de {horizonte}h)")
+
+    registros: List[Dict] = []
+    if workers == 1 or len(tarefas) <= 1:
+        for bloco, corte in tarefas:
+            registros.extend(avaliar_bloco(bloco, corte, features, horizonte))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futuros = [executor.submit(avaliar_bloco, bloco, corte, features, horizonte)
+                       for bloco, corte in tarefas]
+            for futuro in as_completed(futuros):
+                try:
+                    registros.extend(futuro.result())
+                except Exception as e:
+                    print(f"❌ Falha em uma tarefa do backtest: {e}")
+
+    previsoes = pd.DataFrame(registros)
+    if len(previsoes) == 0:
+        print("⚠️ Nenhuma linha com histórico suficiente para o backtest")
+        return previsoes
+    previsoes["combinada"] = previsoes["rf"] * PESO_RF + previsoes["arima"] * (1 - PESO_RF)
+
+    metricas = []
+    for (linha, passo), grupo in previsoes.groupby(["linha", "horizonte"], sort=True):
+        real = grupo["real"].to_numpy()
+        for modelo in ("rf", "arima", "combinada"):
+            metricas.append({
+                "linha": linha,
+                "horizonte": int(passo),
+                "modelo": modelo,
+                "dobras": len(grupo),
+                **_metricas(real, grupo[modelo].to_numpy()),
+            })
+    # Custo de treino por linha: soma das dobras
+    custo = previsoes.drop_duplicates(["linha", "corte"]).groupby("linha")["tempo_treino_s"].sum()
+    metricas = pd.DataFrame(metricas)
+    metricas["tempo_treino_s"] = metricas["linha"].map(custo)
+
+    resumo = {
+        "gerado_em": datetime.now().isoformat(timespec="seconds"),
+        "linhas": int(previsoes["linha"].nunique()),
+        "dobras": [c.isoformat() for c in cortes],
+        "horizonte": horizonte,
+        "alvo": alvo,
+        "features": list(features),
+        "workers": workers or os.cpu_count(),
+        "tempo_total_s": time.perf_counter() - inicio,
+        "tempo_treino_total_s": float(custo.sum()),
+        "tempo_treino_medio_linha_s": float(custo.mean()),
+    }
+    salvar_artefato(metricas, resumo, diretorio)
+    print(f"✅ Backtest concluído em {resumo['tempo_total_s']:.1f}s "
+          f"({resumo['linhas']} linhas avaliadas, alvo {alvo})")
+    return metricas
+
+
+def salvar_artefato(metricas: pd.DataFrame, resumo: Dict, diretorio: str = BACKTEST_PATH) -> None:
+    os.makedirs(diretorio, exist_ok=True)
+    destino = os.path.join(diretorio, METRICAS_ARQUIVO)
+    metricas.to_parquet(destino + ".tmp", index=False)
+    os.replace(destino + ".tmp", destino)
+    destino = os.path.join(diretorio, RESUMO_ARQUIVO)
+    with open(destino + ".tmp", "w", encoding="utf-8") as arquivo:
+        json.dump(resumo, arquivo, ensure_ascii=False, indent=2)
+    os.replace(destino + ".tmp", destino)
+
+
+def carregar_artefato(diretorio: str = BACKTEST_PATH):
+    """Retorna (métricas, resumo) do último backtest, ou (None, None)."""
+    try:
+        metricas = pd.read_parquet(os.path.join(diretorio, METRICAS_ARQUIVO))
+        with open(os.path.join(diretorio, RESUMO_ARQUIVO), "r", encoding="utf-8") as arquivo:
+            resumo = json.load(arquivo)
+    except (OSError, ValueError):
+        return None, None
+    return metricas, resumo
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    from modelo_arima_rf import ALVO_DEMANDA, FEATURES_RF, carregar_series
+
+    parser = argparse.ArgumentParser(description="Backtest walk-forward dos modelos por linha")
+    parser.add_argument("--dobras", type=int, default=N_DOBRAS, help="Número de cortes no tempo")
+    parser.add_argument("--horizonte", type=int, default=HORIZONTE, help="Horas avaliadas após cada corte")
+    parser.add_argument("--workers", type=int, default=None, help="Processos em paralelo (padrão: CPUs)")
+    args = parser.parse_args(argv)
+
+    print("🧪 BACKTEST WALK-FORWARD - ARIMA + RANDOM FOREST")
+    print("=" * 50)
+    df = features_em_cache(carregar_series(), FEATURES_RF)
+    executar_backtest(df, FEATURES_RF, n_dobras=args.dobras, horizonte=args.horizonte, workers=args.workers,
+                      alvo=ALVO_DEMANDA)
+
+
+if __name__ == "__main__":
+    main()
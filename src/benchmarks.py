@@ -0,0 +1,445 @@
+"""
+Benchmarks de desempenho do sistema de transporte
+Mede os caminhos críticos em escala de frota (~15 mil veículos)
+
+Uso: python src/benchmarks.py [nome]
+"""
+
+import io
+import json
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from coleta_sptrans import calcular_velocidade_historico, haversine, validar_coordenadas_sp
+from arima_lote import ajustar_arima_lote
+from contexto_planejamento import ContextoPlanejamento
+from parser_posicao import ler_posicoes_stream, para_dataframe
+
+
+def _cronometrar(funcao, repeticoes=3):
+    """Executa a função N vezes e retorna (melhor tempo em s, último resultado)"""
+    melhor = float('inf')
+    resultado = None
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        resultado = funcao()
+        melhor = min(melhor, time.perf_counter() - inicio)
+    return melhor, resultado
+
+
+def criar_frota_sintetica(n_veiculos=15000, n_linhas=1300, seed=42):
+    """Gera dois snapshots consecutivos (anterior e atual) de uma frota sintética"""
+    rng = np.random.default_rng(seed)
+    agora = datetime.now()
+
+    linhas = np.array([f"{i:04d}-10" for i in range(n_linhas)])
+    anterior = pd.DataFrame({
+        'prefixo': np.arange(n_veiculos),
+        'linha': linhas[rng.integers(0, n_linhas, n_veiculos)],
+        'lat': rng.uniform(-23.75, -23.35, n_veiculos),
+        'lon': rng.uniform(-46.85, -46.35, n_veiculos),
+        'timestamp': agora - timedelta(seconds=30),
+    })
+
+    atual = anterior.copy()
+    atual['lat'] += rng.normal(0, 0.001, n_veiculos)
+    atual['lon'] += rng.normal(0, 0.001, n_veiculos)
+    atual['timestamp'] = agora
+    atual['velocidade'] = 0
+    return atual, anterior
+
+
+def _velocidade_referencia(df_atual, historico_anterior):
+    """Implementação escalar original (iterrows + filtro por linha), usada como referência"""
+    velocidades = []
+    for _, row in df_atual.iterrows():
+        veiculo_historico = historico_anterior[historico_anterior['linha'] == row['linha']]
+        if len(veiculo_historico) > 0:
+            ultimo = veiculo_historico.iloc[-1]
+            dist_km = haversine(ultimo['lon'], ultimo['lat'], row['lon'], row['lat'])
+            tempo_diff = (row['timestamp'] - ultimo['timestamp']).total_seconds() / 3600
+            if tempo_diff > 0 and dist_km > 0.001:
+                velocidades.append(min(max(dist_km / tempo_diff, 0), 100))
+            else:
+                velocidades.append(0)
+        else:
+            velocidades.append(0)
+    return np.array(velocidades, dtype=float)
+
+
+def benchmark_velocidade(n_veiculos=15000, n_referencia=1500):
+    """Compara o cálculo vetorizado de velocidade com a implementação escalar"""
+    print(f"\n🚀 Velocidade da frota ({n_veiculos} veículos)")
+
+    atual, anterior = criar_frota_sintetica(n_veiculos)
+    tempo_vet, resultado = _cronometrar(lambda: calcular_velocidade_historico(atual, anterior))
+    print(f"   ⚡ Vetorizado: {tempo_vet * 1000:.1f} ms")
+
+    # Referência escalar em uma amostra (a versão completa leva minutos)
+    amostra_atual = atual.drop(columns=['prefixo']).head(n_referencia)
+    amostra_anterior = anterior.drop(columns=['prefixo'])
+    tempo_ref, esperado = _cronometrar(
+        lambda: _velocidade_referencia(amostra_atual, amostra_anterior), repeticoes=1
+    )
+    obtido = calcular_velocidade_historico(amostra_atual, amostra_anterior)['velocidade'].to_numpy()
+    estimado = tempo_ref * n_veiculos / n_referencia
+    print(f"   🐢 Escalar (estimado p/ frota): {estimado:.1f} s")
+    print(f"   📈 Ganho: {estimado / tempo_vet:.0f}x")
+    print(f"   ✅ Resultados idênticos à referência: {np.allclose(obtido, esperado)}")
+    return {'vetorizado_s': tempo_vet, 'escalar_estimado_s': estimado}
+
+
+def criar_payload_posicao(n_veiculos=15000, n_linhas=1300, seed=42):
+    """Gera um payload /Posicao sintético (JSON em bytes) no formato da API Olho Vivo"""
+    rng = np.random.default_rng(seed)
+    por_linha = np.array_split(np.arange(n_veiculos), n_linhas)
+    linhas = []
+    for i, veiculos in enumerate(por_linha):
+        linhas.append({
+            'c': f"{i:04d}-10", 'cl': i, 'sl': 1, 'lt0': 'TERM. A', 'lt1': 'TERM. B',
+            'qv': len(veiculos),
+            'vs': [{
+                'p': int(p), 'a': True, 'ta': '2024-05-05T15:06:35Z',
+                # ~2% fora da região metropolitana
+                'py': float(rng.uniform(-23.75, -23.35)) if p % 50 else 0.0,
+                'px': float(rng.uniform(-46.85, -46.35)),
+            } for p in veiculos],
+        })
+    return json.dumps({'hr': '12:06', 'l': linhas}).encode()
+
+
+def _parser_referencia(conteudo):
+    """Caminho original: json completo + um dict e um datetime.now() por veículo"""
+    dados = json.loads(conteudo)
+    linhas = []
+    for linha in dados.get('l', []):
+        for veiculo in linha.get('vs', []):
+            lat, lon = veiculo.get('py', 0), veiculo.get('px', 0)
+            if not validar_coordenadas_sp(lat, lon):
+                continue
+            linhas.append({
+                'linha': str(linha.get('c', '')), 'prefixo': str(veiculo.get('p', '')),
+                'velocidade': 0, 'lat': lat, 'lon': lon,
+                'timestamp': datetime.now(), 'timestamp_api': veiculo.get('ta'),
+            })
+    return pd.DataFrame(linhas)
+
+
+def _pico_memoria(funcao):
+    tracemalloc.start()
+    resultado = funcao()
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return pico / 1024 ** 2, resultado
+
+
+def benchmark_parser(n_veiculos=15000):
+    """Compara o parser colunar em streaming com o caminho dict-por-veículo"""
+    print(f"\n📦 Parser do payload /Posicao ({n_veiculos} veículos)")
+    conteudo = criar_payload_posicao(n_veiculos)
+    print(f"   📄 Payload: {len(conteudo) / 1024 ** 2:.1f} MB")
+
+    tempo_ref, esperado = _cronometrar(lambda: _parser_referencia(conteudo))
+    tempo_col, obtido = _cronometrar(lambda: para_dataframe(ler_posicoes_stream(io.BytesIO(conteudo))))
+    memoria_ref, _ = _pico_memoria(lambda: _parser_referencia(conteudo))
+    memoria_col, _ = _pico_memoria(lambda: para_dataframe(ler_posicoes_stream(io.BytesIO(conteudo))))
+
+    print(f"   🐢 Dict por veículo: {tempo_ref * 1000:.0f} ms | pico {memoria_ref:.1f} MB")
+    print(f"   ⚡ Colunar/streaming: {tempo_col * 1000:.0f} ms | pico {memoria_col:.1f} MB")
+    iguais = (len(esperado) == len(obtido)
+              and np.allclose(esperado['lat'], obtido['lat'])
+              and (esperado['prefixo'].to_numpy() == obtido['prefixo'].to_numpy()).all())
+    print(f"   ✅ Mesmos veículos da referência: {iguais}")
+    return {'referencia_s': tempo_ref, 'colunar_s': tempo_col,
+            'referencia_mb': memoria_ref, 'colunar_mb': memoria_col}
+
+
+def _contexto_referencia(contexto, timestamps):
+    """Caminho original: resumo_diario linha a linha + lambdas de desempacotamento"""
+    resumos = timestamps.apply(lambda ts: contexto.resumo_diario(ts.to_pydatetime()))
+    df = pd.DataFrame(index=timestamps.index)
+    df['periodo_pico'] = resumos.apply(lambda r: r.get('periodo_pico'))
+    df['descricao_pico'] = resumos.apply(lambda r: r.get('descricao_pico'))
+    df['em_periodo_pico'] = df['periodo_pico'].notna().astype(int)
+    df['rodizio_ativo'] = resumos.apply(lambda r: r.get('rodizio_ativo', False)).astype(int)
+    for campo in ('nome', 'tipo', 'categoria'):
+        df[f'feriado_{campo}'] = resumos.apply(
+            lambda r: r['feriado'][campo] if r.get('feriado') else None
+        )
+    eventos = resumos.apply(lambda r: r.get('eventos', []))
+    df['tem_evento_relevante'] = eventos.apply(lambda e: int(bool(e)))
+    df['eventos'] = eventos.apply(lambda e: "; ".join(e) if e else None)
+    return df
+
+
+def benchmark_contexto(n_linhas=1_000_000, n_referencia=20_000, seed=42):
+    """Enriquecimento de contexto em lote vs. resumo_diario por linha"""
+    print(f"\n🏙️ Contexto de planejamento ({n_linhas} linhas)")
+    rng = np.random.default_rng(seed)
+    inicio = np.datetime64('2025-01-01T00:00:00')
+    segundos = rng.integers(0, 2 * 365 * 86400, n_linhas)
+    # Metade das amostras cai exatamente no minuto cheio (bordas dos intervalos)
+    segundos[::2] -= segundos[::2] % 60
+    timestamps = pd.Series(inicio + segundos.astype('timedelta64[s]'))
+
+    contexto = ContextoPlanejamento.obter()
+    tempo_lote, obtido = _cronometrar(lambda: contexto.contexto_em_lote(timestamps), repeticoes=1)
+    amostra = timestamps.head(n_referencia)
+    tempo_ref, esperado = _cronometrar(lambda: _contexto_referencia(contexto, amostra), repeticoes=1)
+    estimado = tempo_ref * n_linhas / n_referencia
+
+    print(f"   ⚡ Em lote: {tempo_lote:.2f} s")
+    print(f"   🐢 Por linha (estimado): {estimado:.0f} s")
+    iguais = obtido.head(n_referencia).astype(object).equals(esperado.astype(object))
+    print(f"   ✅ Resultados idênticos à referência: {iguais}")
+    return {'lote_s': tempo_lote, 'por_linha_estimado_s': estimado}
+
+
+def criar_series_demanda(n_series=2000, seed=42):
+    """Séries horárias ARIMA(1,1,1) sintéticas de tamanhos variados (1 a 7 dias)"""
+    rng = np.random.default_rng(seed)
+    series = {}
+    for i in range(n_series):
+        phi, theta = rng.uniform(-0.7, 0.7, 2)
+        ruido = rng.normal(0, 3, int(rng.integers(24, 169)) + 1)
+        d = np.empty(len(ruido) - 1)
+        anterior = 0.0
+        for t in range(len(d)):
+            anterior = phi * anterior + ruido[t + 1] + theta * ruido[t]
+            d[t] = anterior
+        series[f"{i:04d}-10"] = 50 + np.cumsum(d)
+    return series
+
+
+def benchmark_arima(n_series=2000, n_referencia=40):
+    """ARIMA(1,1,1) em lote vs. um statsmodels.ARIMA por linha"""
+    import warnings
+    from modelo_arima_rf import modelo_arima_previsao
+
+    print(f"\n📈 ARIMA(1,1,1) por linha ({n_series} séries)")
+    series = criar_series_demanda(n_series)
+    tempo_lote, resultado = _cronometrar(lambda: ajustar_arima_lote(series, passos=3))
+
+    amostra = list(series)[:n_referencia]
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        tempo_ref, esperado = _cronometrar(
+            lambda: [np.asarray(modelo_arima_previsao(series[c], steps=3)) for c in amostra], repeticoes=1
+        )
+    estimado = tempo_ref * n_series / n_referencia
+    diferenca = np.median([np.abs(resultado.previsao(c) - e).max() for c, e in zip(amostra, esperado)])
+
+    print(f"   ⚡ Em lote: {tempo_lote:.2f} s ({len(resultado.falhas())} falhas reportadas)")
+    print(f"   🐢 statsmodels por série (estimado): {estimado:.0f} s")
+    print(f"   📈 Ganho: {estimado / tempo_lote:.0f}x")
+    print(f"   📏 Diferença mediana das previsões vs. MLE: {diferenca:.2f} (ruído com desvio 3)")
+    return {'lote_s': tempo_lote, 'statsmodels_estimado_s': estimado, 'diferenca_mediana': diferenca}
+
+
+def criar_registro_sintetico(caminho, n_linhas=50, n_registros=2000, seed=42, formato="auto"):
+    """Registro com um RandomForest (50 árvores) por linha treinado em dados sintéticos"""
+    from sklearn.ensemble import RandomForestRegressor
+    from modelo_arima_rf import FEATURES_RF
+    from registro_modelos import RegistroModelos
+
+    rng = np.random.default_rng(seed)
+    registro = RegistroModelos(caminho)
+    for i in range(n_linhas):
+        X = pd.DataFrame({f: rng.integers(0, 2, n_registros) for f in FEATURES_RF})
+        X['hora'] = rng.integers(0, 24, n_registros)
+        X['dia_semana'] = rng.integers(0, 7, n_registros)
+        X['velocidade_media'] = rng.uniform(5, 50, n_registros)
+        y = 40 + 30 * X['em_periodo_pico'] - 0.3 * X['velocidade_media'] + rng.normal(0, 5, n_registros)
+        modelo = RandomForestRegressor(n_estimators=50, random_state=i).fit(X, y)
+        registro.salvar(f"{i:04d}-10", modelo, formato=formato, impressao=f"sintetico-{i}")
+    registro.salvar_manifesto(FEATURES_RF)
+    return registro
+
+
+def benchmark_cubo(n_linhas=50, n_consultas=15000, seed=42):
+    """Consulta ao cubo materializado vs. RandomForest ao vivo (previsões do dashboard)"""
+    import tempfile
+    from cubo_lotacao import VELOCIDADES_CUBO, ajustar_a_grade, construir_cubo
+    from previsao_lotacao import PrevisorLotacao
+
+    print(f"\n🧊 Lotação prevista: cubo vs. inferência ao vivo ({n_consultas} veículos, {n_linhas} linhas)")
+    with tempfile.TemporaryDirectory() as caminho:
+        registro = criar_registro_sintetico(caminho, n_linhas, seed=seed)
+        tempo_cubo_s, _ = _cronometrar(lambda: construir_cubo(registro), repeticoes=1)
+
+        rng = np.random.default_rng(seed)
+        linhas = rng.choice(registro.linhas(), n_consultas)
+        # Velocidade média por linha sobre a grade do cubo (fora dela a consulta vai ao vivo)
+        velocidades = pd.Series(rng.choice(VELOCIDADES_CUBO[1:11], n_linhas), index=registro.linhas())[linhas].to_numpy()
+        continuas = velocidades + rng.uniform(0.1, 4.9, n_linhas)[pd.factorize(linhas)[0]]
+        hora, dia = datetime.now().hour, datetime.now().weekday()
+
+        cubo = PrevisorLotacao(registro)
+        vivo = PrevisorLotacao(registro, usar_cubo=False)
+        vivo.prever(hora, dia, linhas, velocidades)  # Carrega os modelos no LRU
+        tempo_cubo, obtido = _cronometrar(lambda: cubo.prever(hora, dia, linhas, velocidades, ruido=False))
+        tempo_vivo, esperado = _cronometrar(lambda: vivo.prever(hora, dia, linhas, velocidades, ruido=False))
+        tempo_continuas, _ = _cronometrar(lambda: cubo.prever(hora, dia, linhas, continuas, ruido=False))
+        # Dashboard: velocidade contínua arredondada para a grade vs. ao vivo com a velocidade exata
+        ajustadas = cubo.prever(hora, dia, linhas, ajustar_a_grade(continuas), ruido=False)
+        exatas = vivo.prever(hora, dia, linhas, continuas, ruido=False)
+
+    diferenca = np.abs(obtido.lotacao - esperado.lotacao).max()
+    erro_grade = np.abs(ajustadas.lotacao - exatas.lotacao)
+    print(f"   🏗️ Materialização: {tempo_cubo_s:.1f} s ({n_linhas} linhas)")
+    print(f"   🐢 Ao vivo: {tempo_vivo * 1000:.1f} ms")
+    print(f"   ⚡ Cubo: {tempo_cubo * 1000:.1f} ms")
+    print(f"   📈 Ganho: {tempo_vivo / tempo_cubo:.1f}x")
+    print(f"   📏 Diferença máxima para o ao vivo: {diferenca:.3f} pontos de lotação (arredondamento float16)")
+    print(f"   🌊 Velocidades fora da grade (ao vivo): {tempo_continuas * 1000:.1f} ms")
+    print(f"   🎯 Velocidade arredondada para a grade: erro médio {erro_grade.mean():.2f}, "
+          f"p95 {np.percentile(erro_grade, 95):.2f}, máximo {erro_grade.max():.2f} pontos de lotação")
+    return {'cubo_s': tempo_cubo, 'vivo_s': tempo_vivo, 'continuas_s': tempo_continuas, 'diferenca_maxima': diferenca,
+            'erro_grade_medio': erro_grade.mean(), 'erro_grade_maximo': erro_grade.max()}
+
+
+def benchmark_arvores(n_registros=2000, tamanhos=(1, 100, 500, 5000, 100_000), seed=42):
+    """Latência do RandomForest do scikit-learn vs. floresta plana em NumPy"""
+    from sklearn.ensemble import RandomForestRegressor
+    from floresta_plana import FlorestaPlana
+    from modelo_arima_rf import FEATURES_RF
+
+    print("\n🌲 Inferência da floresta: scikit-learn vs. arrays planos (50 árvores)")
+    rng = np.random.default_rng(seed)
+
+    def entradas(n):
+        X = pd.DataFrame({f: rng.integers(0, 2, n) for f in FEATURES_RF})
+        X['hora'] = rng.integers(0, 24, n)
+        X['dia_semana'] = rng.integers(0, 7, n)
+        X['velocidade_media'] = rng.uniform(5, 50, n)
+        return X
+
+    X = entradas(n_registros)
+    y = 40 + 30 * X['em_periodo_pico'] - 0.3 * X['velocidade_media'] + rng.normal(0, 5, n_registros)
+    modelo = RandomForestRegressor(n_estimators=50, random_state=seed).fit(X, y)
+    plana = FlorestaPlana.do_modelo(modelo)
+
+    resultados = {}
+    for n in tamanhos:
+        consulta = entradas(n)
+        matriz = consulta.to_numpy(np.float32)
+        repeticoes = 20 if n <= 5000 else 1
+        tempo_sk, esperado = _cronometrar(lambda: modelo.predict(consulta), repeticoes)
+        tempo_df, obtido_df = _cronometrar(lambda: plana.predict(consulta), repeticoes)
+        tempo_np, obtido = _cronometrar(lambda: plana.prever_matriz(matriz), repeticoes)
+        identico = np.array_equal(esperado, obtido) and np.array_equal(esperado, obtido_df)
+        resultados[n] = {'sklearn_s': tempo_sk, 'plana_df_s': tempo_df, 'plana_s': tempo_np, 'identico': identico}
+        print(f"   {n:>7} linhas: scikit-learn {tempo_sk * 1000:8.2f} ms | plana (DataFrame) "
+              f"{tempo_df * 1000:8.2f} ms | plana (matriz) {tempo_np * 1000:8.2f} ms "
+              f"({tempo_sk / tempo_np:.1f}x) {'✅ idêntico' if identico else '❌ DIFERENTE'}")
+    return resultados
+
+
+def _memoria_processo():
+    """Rss, Pss (páginas compartilhadas divididas entre os processos) e privada, em MB (Linux)"""
+    campos = {'Rss': 'rss', 'Pss': 'pss', 'Private_Clean': 'privada', 'Private_Dirty': 'privada'}
+    memoria = {'rss': 0.0, 'pss': 0.0, 'privada': 0.0}
+    try:
+        with open('/proc/self/smaps_rollup', 'r') as arquivo:
+            for linha in arquivo:
+                nome, _, valor = linha.partition(':')
+                if nome in campos:
+                    memoria[campos[nome]] += int(valor.split()[0]) / 1024
+    except OSError:
+        return None
+    return memoria
+
+
+def _worker_carga(caminho, entradas, barreira, fila):
+    """Carrega todos os modelos do registro e mede a memória com os demais workers vivos"""
+    import sklearn.ensemble  # noqa: F401 (importado antes da medida, como no dashboard)
+    from registro_modelos import RegistroModelos
+
+    antes = _memoria_processo()
+    inicio = time.perf_counter()
+    registro = RegistroModelos(caminho, orcamento_mb=1e6)
+    for linha in registro.linhas():
+        registro.obter(linha).predict(entradas)
+    tempo = time.perf_counter() - inicio
+    barreira.wait()  # Todos os workers com os modelos em memória ao mesmo tempo
+    depois = _memoria_processo()
+    fila.put({'tempo_s': tempo, **({k: depois[k] - antes[k] for k in depois} if antes else {})})
+    barreira.wait()
+
+
+def benchmark_carga(n_linhas=50, n_workers=4, seed=42):
+    """Carga dos modelos: joblib vs. floresta plana com mmap (tempo e memória por worker)"""
+    import multiprocessing
+    import tempfile
+    from registro_modelos import RegistroModelos
+
+    print(f"\n💾 Carga dos modelos: joblib vs. floresta plana ({n_linhas} linhas, {n_workers} workers)")
+    rng = np.random.default_rng(seed)
+    resultados = {}
+    for formato in ('joblib', 'auto'):
+        with tempfile.TemporaryDirectory() as caminho:
+            registro = criar_registro_sintetico(caminho, n_linhas, seed=seed, formato=formato)
+            entradas = pd.DataFrame({f: rng.integers(0, 2, 1000) for f in registro.features})
+            entradas['hora'] = rng.integers(0, 24, 1000)
+
+            def carregar_tudo():
+                novo = RegistroModelos(caminho, orcamento_mb=1e6)
+                return [novo.obter(linha) for linha in novo.linhas()]
+            tempo_carga, _ = _cronometrar(carregar_tudo)
+
+            # Processos novos: nada herdado do processo que treinou os modelos
+            contexto = multiprocessing.get_context('spawn')
+            barreira, fila = contexto.Barrier(n_workers), contexto.Queue()
+            workers = [contexto.Process(target=_worker_carga, args=(caminho, entradas, barreira, fila))
+                       for _ in range(n_workers)]
+            for worker in workers:
+                worker.start()
+            medidas = [fila.get() for _ in workers]
+            for worker in workers:
+                worker.join()
+
+        nome = 'joblib' if formato == 'joblib' else 'floresta plana (mmap)'
+        media = {k: float(np.mean([m[k] for m in medidas if k in m])) for k in medidas[0]}
+        resultados[nome] = {'carga_s': tempo_carga, **media}
+        print(f"   {'🐢' if formato == 'joblib' else '⚡'} {nome}: carga de todas as linhas em "
+              f"{tempo_carga * 1000:.0f} ms")
+        if 'rss' in media:
+            print(f"      por worker: RSS +{media['rss']:.1f} MB, PSS +{media['pss']:.1f} MB, "
+                  f"privada +{media['privada']:.1f} MB")
+
+    antes, depois = resultados['joblib'], resultados['floresta plana (mmap)']
+    print(f"   📈 Carga {antes['carga_s'] / depois['carga_s']:.1f}x mais rápida"
+          + (f"; memória proporcional (PSS) por worker {antes['pss'] / max(depois['pss'], 0.1):.1f}x menor"
+             if 'pss' in antes else ""))
+    return resultados
+
+
+BENCHMARKS = {
+    'velocidade': benchmark_velocidade,
+    'parser': benchmark_parser,
+    'contexto': benchmark_contexto,
+    'arima': benchmark_arima,
+    'cubo': benchmark_cubo,
+    'carga': benchmark_carga,
+    'arvores': benchmark_arvores,
+}
+
+
+def main():
+    nomes = sys.argv[1:] or list(BENCHMARKS)
+    print("⏱️ BENCHMARKS DO SISTEMA DE TRANSPORTE")
+    print("=" * 60)
+    for nome in nomes:
+        if nome not in BENCHMARKS:
+            print(f"❌ Benchmark desconhecido: {nome} (opções: {', '.join(BENCHMARKS)})")
+            continue
+        BENCHMARKS[nome]()
+
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,8 @@ import joblib
 import pandas as pd
 from datetime import datetime
 import os
+from feature_store import VERSAO_SCHEMA, build_features, features_compativeis
+from floresta_plana import FlorestaPlana, exportavel
 from pln_processor import ProcessadorPLN
 
 def carregar_modelo():
@@ -9,6 +11,12 @@ def carregar_modelo():
     try:
         modelo = joblib.load('dados/modelo_lotacao.pkl')
         features = joblib.load('dados/features.pkl')
+        if not features_compativeis(features):
+            print(f"⚠️ Modelo treinado com features fora do schema v{VERSAO_SCHEMA}. Execute ml_simples.py novamente.")
+            return None, None
+        if exportavel(modelo):
+            # Previsões de uma linha sem o custo de validação do scikit-learn
+            modelo = FlorestaPlana.do_modelo(modelo)
         print("✅ Modelo de IA carregado com sucesso!")
         return modelo, features
     except FileNotFoundError:
@@ -33,13 +41,8 @@ def responder_pergunta(pergunta, modelo=None, features=None):
     
     if 'lotação' in pergunta or 'cheio' in pergunta or 'vazio' in pergunta:
         if modelo is not None:
-            # Previsão para agora
-            agora = datetime.now()
-            hora = agora.hour
-            dia_semana = agora.weekday()
-            
-            # Usar DataFrame para previsão
-            previsao_df = pd.DataFrame([[hora, dia_semana, 30]], columns=features)
+            # Previsão para agora (mesmas features do treino, via feature store)
+            previsao_df = build_features(pd.DataFrame({'timestamp': [datetime.now()]}), features)
             previsao = modelo.predict(previsao_df)[0]
             
             # Classificar status
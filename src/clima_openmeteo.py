@@ -4,11 +4,204 @@ Fornece dados climáticos de São Paulo para o sistema de transporte
 """
 
 import requests
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass
 from datetime import datetime, timedelta
-from typing import Dict, Optional, List
+from typing import Callable, Dict, Optional, List, Tuple
 import json
 import os
 
+import numpy as np
+import pandas as pd
+
+try:
+    from scipy.spatial import cKDTree
+    SCIPY_DISPONIVEL = True
+except ImportError:
+    SCIPY_DISPONIVEL = False
+
+
+BASE_PATH = os.path.dirname(os.path.dirname(__file__))
+CACHE_CLIMA_PATH = os.path.join(BASE_PATH, "dados", "cache_clima")
+
+VARIAVEIS_HORARIAS = 'temperature_2m,relative_humidity_2m,precipitation,weather_code,wind_speed_10m'
+# Grade padrão sobre a região metropolitana (mesmos limites do coletor)
+GRADE_LATITUDES = (-23.8, -23.3)
+GRADE_LONGITUDES = (-46.9, -46.3)
+GRADE_DIMENSOES = (4, 4)
+
+COLUNAS_CLIMA = ['temperatura', 'umidade', 'precipitacao', 'codigo_clima', 'velocidade_vento']
+
+
+def _horas_epoch(timestamps) -> np.ndarray:
+    """Converte datas/horas locais (naive) para horas desde 1970 (int64)"""
+    serie = pd.to_datetime(pd.Series(timestamps), errors='coerce', format='mixed')
+    if serie.dt.tz is not None:
+        serie = serie.dt.tz_convert('America/Sao_Paulo').dt.tz_localize(None)
+    # NaT vira o menor int64, que sempre cai fora da janela da previsão
+    return serie.to_numpy(dtype='datetime64[ns]').astype('datetime64[h]').astype(np.int64)
+
+
+@dataclass
+class PrevisaoHoraria:
+    """Série horária da previsão em arrays tipados, indexada por hora epoch"""
+    hora_inicial: int
+    temperatura: np.ndarray
+    umidade: np.ndarray
+    precipitacao: np.ndarray
+    codigo_clima: np.ndarray
+    velocidade_vento: np.ndarray
+    obtida_em: float
+
+    def __len__(self):
+        return len(self.temperatura)
+
+    @classmethod
+    def da_resposta(cls, horario: Dict, obtida_em: Optional[float] = None) -> 'PrevisaoHoraria':
+        horas = np.array(horario['time'], dtype='datetime64[h]').astype(np.int64)
+
+        def _serie(chave):
+            return np.array([np.nan if v is None else v for v in horario[chave]], dtype=np.float64)
+
+        return cls(
+            hora_inicial=int(horas[0]),
+            temperatura=_serie('temperature_2m'),
+            umidade=_serie('relative_humidity_2m'),
+            precipitacao=_serie('precipitation'),
+            codigo_clima=_serie('weather_code'),
+            velocidade_vento=_serie('wind_speed_10m'),
+            obtida_em=obtida_em if obtida_em is not None else time.time(),
+        )
+
+    def indices(self, horas: np.ndarray) -> np.ndarray:
+        """Posição de cada hora epoch na série (-1 quando fora da janela)"""
+        idx = horas - self.hora_inicial
+        return np.where((idx >= 0) & (idx < len(self)), idx, -1)
+
+    def registro(self, idx: int) -> Dict:
+        """Valores de uma hora no formato de obter_clima_atual"""
+        registro = {}
+        for coluna in COLUNAS_CLIMA:
+            valor = getattr(self, coluna)[idx]
+            registro[coluna] = None if np.isnan(valor) else (int(valor) if coluna == 'codigo_clima' else float(valor))
+        registro['timestamp'] = self.horario(idx)
+        return registro
+
+    def horario(self, idx: int) -> str:
+        return str(np.datetime64(self.hora_inicial + idx, 'h').astype('datetime64[m]'))
+
+
+@dataclass
+class GradeClima:
+    """
+    Previsão horária de vários pontos: cada variável é uma matriz
+    (células x horas) e a célula mais próxima de cada posição é
+    encontrada por uma KD-tree sobre as coordenadas dos pontos
+    """
+    latitudes: np.ndarray
+    longitudes: np.ndarray
+    hora_inicial: int
+    temperatura: np.ndarray
+    umidade: np.ndarray
+    precipitacao: np.ndarray
+    codigo_clima: np.ndarray
+    velocidade_vento: np.ndarray
+    obtida_em: float
+
+    def __post_init__(self):
+        # Projeção equirretangular local: graus de longitude encolhem com cos(lat)
+        self._escala_lon = np.cos(np.radians(np.mean(self.latitudes)))
+        pontos = np.column_stack([self.latitudes, self.longitudes * self._escala_lon])
+        self._pontos = pontos
+        self._arvore = cKDTree(pontos) if SCIPY_DISPONIVEL else None
+
+    @property
+    def n_horas(self) -> int:
+        return self.temperatura.shape[1]
+
+    @classmethod
+    def da_resposta(cls, dados: Dict, obtida_em: Optional[float] = None) -> 'GradeClima':
+        series = [PrevisaoHoraria.da_resposta(h, obtida_em) for h in dados['hourly']]
+        n_horas = min(len(serie) for serie in series)
+        hora_inicial = series[0].hora_inicial
+        return cls(
+            latitudes=np.asarray(dados['latitudes'], dtype=np.float64),
+            longitudes=np.asarray(dados['longitudes'], dtype=np.float64),
+            hora_inicial=hora_inicial,
+            obtida_em=series[0].obtida_em,
+            **{coluna: np.vstack([getattr(serie, coluna)[:n_horas] for serie in series])
+               for coluna in COLUNAS_CLIMA},
+        )
+
+    def celulas(self, lat, lon) -> np.ndarray:
+        """Índice da célula mais próxima de cada posição"""
+        consulta = np.column_stack([np.asarray(lat, dtype=np.float64),
+                                    np.asarray(lon, dtype=np.float64) * self._escala_lon])
+        if self._arvore is not None:
+            return self._arvore.query(consulta)[1].astype(np.int64)
+
+        # Sem scipy: força bruta (a grade tem poucas dezenas de pontos)
+        distancias = ((consulta[:, None, :] - self._pontos[None, :, :]) ** 2).sum(axis=2)
+        return distancias.argmin(axis=1)
+
+
+class CacheClimaDisco:
+    """
+    Cache em disco compartilhado entre processos (dashboard, coletor, main.py)
+
+    Cada entrada é um JSON `{obtido_em, dados}` gravado de forma atômica
+    (arquivo temporário + rename). Um arquivo `.lock` criado com O_EXCL
+    funciona como concessão: só o processo que o detém consulta a API;
+    concessões mais antigas que `concessao_s` são consideradas abandonadas.
+    """
+
+    def __init__(self, diretorio: str = CACHE_CLIMA_PATH, concessao_s: float = 60.0):
+        self.diretorio = diretorio
+        self.concessao_s = concessao_s
+
+    def _caminho(self, nome: str) -> str:
+        return os.path.join(self.diretorio, f"{nome}.json")
+
+    def ler(self, nome: str) -> Optional[Tuple[float, Dict]]:
+        try:
+            with open(self._caminho(nome), 'r', encoding='utf-8') as arquivo:
+                entrada = json.load(arquivo)
+            return float(entrada['obtido_em']), entrada['dados']
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def gravar(self, nome: str, obtido_em: float, dados: Dict) -> None:
+        os.makedirs(self.diretorio, exist_ok=True)
+        temporario = f"{self._caminho(nome)}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporario, 'w', encoding='utf-8') as arquivo:
+            json.dump({'obtido_em': obtido_em, 'dados': dados}, arquivo)
+        os.replace(temporario, self._caminho(nome))
+
+    def adquirir(self, nome: str) -> bool:
+        """Tenta obter a concessão de atualização da entrada"""
+        os.makedirs(self.diretorio, exist_ok=True)
+        trava = self._caminho(nome) + '.lock'
+        for _ in range(2):
+            try:
+                os.close(os.open(trava, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                return True
+            except FileExistsError:
+                try:
+                    if time.time() - os.path.getmtime(trava) < self.concessao_s:
+                        return False
+                    os.remove(trava)  # Concessão abandonada (processo encerrado)
+                except OSError:
+                    pass
+        return False
+
+    def liberar(self, nome: str) -> None:
+        try:
+            os.remove(self._caminho(nome) + '.lock')
+        except OSError:
+            pass
+
 
 class ClimaOpenMeteo:
     """Classe singleton para buscar dados climáticos via Open-Meteo API"""
@@ -21,12 +214,25 @@ class ClimaOpenMeteo:
     
     # URL base da API
     BASE_URL = "https://api.open-meteo.com/v1/forecast"
+    ARCHIVE_URL = "https://archive-api.open-meteo.com/v1/archive"
     
-    def __init__(self):
+    def __init__(self, cache_disco: Optional[CacheClimaDisco] = None):
         """Inicializa o cliente Open-Meteo"""
-        self.cache = {}
-        self.cache_timestamp = None
+        self.cache: Dict[str, Tuple[float, Dict]] = {}  # nome -> (obtido_em, dados)
         self.cache_ttl = 3600  # Cache por 1 hora
+        self.cache_disco = cache_disco or CacheClimaDisco()
+        self.espera_concessao_s = 12.0  # Um pouco mais que o timeout da requisição
+        self.previsao: Optional[PrevisaoHoraria] = None
+        self.previsao_ttl = 3600
+        self.grades: Dict[str, GradeClima] = {}
+        self._em_andamento: Dict[str, Future] = {}  # Requisições em voo (single-flight)
+        self._fontes: Dict[str, Tuple[float, Callable[[], Optional[Dict]]]] = {
+            'atual': (self.cache_ttl, self._buscar_clima_atual),
+            'previsao': (self.previsao_ttl, self._buscar_previsao),
+        }
+        self._lock = threading.Lock()
+        self._parar_atualizacao = threading.Event()
+        self._thread_atualizacao: Optional[threading.Thread] = None
     
     @classmethod
     def obter(cls):
@@ -35,10 +241,10 @@ class ClimaOpenMeteo:
             cls._instancia = cls()
         return cls._instancia
     
-    def _fazer_requisicao(self, params: Dict) -> Optional[Dict]:
-        """Faz requisição à API Open-Meteo"""
+    def _fazer_requisicao(self, params: Dict, url: Optional[str] = None) -> Optional[Dict]:
+        """Faz requisição à API Open-Meteo (por padrão, ao endpoint de previsão)"""
         try:
-            response = requests.get(self.BASE_URL, params=params, timeout=10)
+            response = requests.get(url or self.BASE_URL, params=params, timeout=10)
             if response.status_code == 200:
                 return response.json()
             else:
@@ -48,20 +254,139 @@ class ClimaOpenMeteo:
             print(f"⚠️ Erro ao buscar dados climáticos: {e}")
             return None
     
-    def obter_clima_atual(self) -> Optional[Dict]:
+    def _entrada(self, nome: str, ttl: float, buscar: Callable[[], Optional[Dict]]) -> Optional[Tuple[float, Dict]]:
         """
-        Obtém dados climáticos atuais de São Paulo
-        
-        Returns:
-            Dict com temperatura, umidade, precipitação, etc.
+        Cache stale-while-revalidate: memória -> disco -> API
+
+        Uma entrada expirada é devolvida imediatamente enquanto uma thread
+        de fundo a atualiza. Sem nenhuma entrada (primeira execução), a
+        chamada espera pela requisição compartilhada; com a atualização
+        periódica ativa, nem isso: devolve None e a busca segue em fundo.
         """
-        # Verificar cache
-        agora = datetime.now()
-        if (self.cache_timestamp and 
-            (agora - self.cache_timestamp).total_seconds() < self.cache_ttl and
-            'atual' in self.cache):
-            return self.cache['atual']
-        
+        self._fontes.setdefault(nome, (ttl, buscar))
+        entrada = self.cache.get(nome)
+        if entrada is None or time.time() - entrada[0] >= ttl:
+            do_disco = self.cache_disco.ler(nome)
+            if do_disco and (entrada is None or do_disco[0] > entrada[0]):
+                entrada = do_disco
+                self.cache[nome] = entrada
+
+        if entrada is None:
+            if self.atualizacao_periodica_ativa:
+                self._atualizar_em_segundo_plano(nome, buscar)
+                return None
+            return self._atualizar_compartilhado(nome, buscar)
+
+        if time.time() - entrada[0] >= ttl:
+            self._atualizar_em_segundo_plano(nome, buscar)
+        return entrada
+
+    def _atualizar(self, nome: str, buscar: Callable[[], Optional[Dict]]) -> Optional[Tuple[float, Dict]]:
+        """Consulta a API (se este processo obtiver a concessão) e grava o resultado"""
+        if not self.cache_disco.adquirir(nome):
+            if self.cache.get(nome) is not None:
+                return self.cache.get(nome)
+            # Primeira execução com outro processo buscando: espera o resultado dele no disco
+            return self._aguardar_disco(nome, buscar)
+        try:
+            dados = buscar()
+            if dados is None:
+                return self.cache.get(nome)
+            entrada = (time.time(), dados)
+            self.cache_disco.gravar(nome, *entrada)
+            self.cache[nome] = entrada
+            return entrada
+        finally:
+            self.cache_disco.liberar(nome)
+
+    def _aguardar_disco(self, nome: str, buscar: Callable[[], Optional[Dict]]) -> Optional[Tuple[float, Dict]]:
+        """
+        Lê o disco até a entrada aparecer (no máximo `espera_concessao_s`);
+        se o outro processo não gravar a tempo, consulta a API sem a concessão.
+        """
+        limite = time.monotonic() + self.espera_concessao_s
+        while time.monotonic() < limite:
+            entrada = self.cache_disco.ler(nome)
+            if entrada is not None:
+                self.cache[nome] = entrada
+                return entrada
+            time.sleep(0.2)
+
+        dados = buscar()
+        if dados is None:
+            return None
+        entrada = (time.time(), dados)
+        self.cache_disco.gravar(nome, *entrada)
+        self.cache[nome] = entrada
+        return entrada
+
+    def _iniciar_voo(self, nome: str) -> Tuple[Future, bool]:
+        """Retorna a requisição em voo da entrada e se quem chamou é o responsável por ela"""
+        with self._lock:
+            futuro = self._em_andamento.get(nome)
+            if futuro is not None:
+                return futuro, False
+            futuro = Future()
+            self._em_andamento[nome] = futuro
+            return futuro, True
+
+    def _executar_voo(self, nome: str, buscar: Callable[[], Optional[Dict]], futuro: Future) -> None:
+        try:
+            futuro.set_result(self._atualizar(nome, buscar))
+        except Exception as e:
+            print(f"⚠️ Erro ao atualizar cache climático ({nome}): {e}")
+            futuro.set_result(self.cache.get(nome))
+        finally:
+            with self._lock:
+                self._em_andamento.pop(nome, None)
+
+    def _atualizar_compartilhado(self, nome: str, buscar: Callable[[], Optional[Dict]]) -> Optional[Tuple[float, Dict]]:
+        """Single-flight: chamadas simultâneas aguardam a mesma requisição"""
+        futuro, responsavel = self._iniciar_voo(nome)
+        if responsavel:
+            self._executar_voo(nome, buscar, futuro)
+        return futuro.result()
+
+    def _atualizar_em_segundo_plano(self, nome: str, buscar: Callable[[], Optional[Dict]]) -> None:
+        futuro, responsavel = self._iniciar_voo(nome)
+        if responsavel:
+            threading.Thread(target=self._executar_voo, args=(nome, buscar, futuro),
+                             name=f'clima-{nome}', daemon=True).start()
+
+    @property
+    def atualizacao_periodica_ativa(self) -> bool:
+        return self._thread_atualizacao is not None and self._thread_atualizacao.is_alive()
+
+    def iniciar_atualizacao_periodica(self, verificacao_s: float = 60.0, antecedencia_s: float = 300.0) -> None:
+        """
+        Renova as entradas usadas (clima atual, previsão, grades) antes de o
+        TTL expirar, para que as chamadas do dashboard nunca esperem pela rede
+
+        Args:
+            verificacao_s: Intervalo entre verificações
+            antecedencia_s: Quanto antes da expiração a entrada é renovada
+        """
+        if self.atualizacao_periodica_ativa:
+            return
+        self._parar_atualizacao.clear()
+
+        def _loop():
+            while True:
+                for nome, (ttl, buscar) in list(self._fontes.items()):
+                    entradas = [e for e in (self.cache.get(nome), self.cache_disco.ler(nome)) if e]
+                    entrada = max(entradas, key=lambda e: e[0]) if entradas else None
+                    if entrada is None or time.time() - entrada[0] >= ttl - antecedencia_s:
+                        self._atualizar_compartilhado(nome, buscar)
+                if self._parar_atualizacao.wait(verificacao_s):
+                    return
+
+        self._thread_atualizacao = threading.Thread(target=_loop, name='clima-atualizacao', daemon=True)
+        self._thread_atualizacao.start()
+
+    def parar_atualizacao_periodica(self) -> None:
+        self._parar_atualizacao.set()
+
+    def _buscar_clima_atual(self) -> Optional[Dict]:
         params = {
             'latitude': self.LATITUDE_SP,
             'longitude': self.LONGITUDE_SP,
@@ -72,7 +397,7 @@ class ClimaOpenMeteo:
         
         dados = self._fazer_requisicao(params)
         if dados and 'current' in dados:
-            resultado = {
+            return {
                 'temperatura': dados['current'].get('temperature_2m', None),
                 'umidade': dados['current'].get('relative_humidity_2m', None),
                 'precipitacao': dados['current'].get('precipitation', None),
@@ -80,18 +405,140 @@ class ClimaOpenMeteo:
                 'velocidade_vento': dados['current'].get('wind_speed_10m', None),
                 'timestamp': dados['current'].get('time', None)
             }
-            
-            # Atualizar cache
-            self.cache['atual'] = resultado
-            self.cache_timestamp = agora
-            
+        return None
+
+    def _buscar_previsao(self) -> Optional[Dict]:
+        params = {
+            'latitude': self.LATITUDE_SP,
+            'longitude': self.LONGITUDE_SP,
+            'hourly': VARIAVEIS_HORARIAS,
+            'timezone': 'America/Sao_Paulo',
+            'past_days': 1,
+            'forecast_days': 7
+        }
+
+        dados = self._fazer_requisicao(params)
+        if dados and dados.get('hourly', {}).get('time'):
+            return dados['hourly']
+        return None
+
+    def _buscar_grade(self, latitudes: np.ndarray, longitudes: np.ndarray) -> Optional[Dict]:
+        """Uma única requisição com todos os pontos da grade"""
+        params = {
+            'latitude': ','.join(f'{v:.4f}' for v in latitudes),
+            'longitude': ','.join(f'{v:.4f}' for v in longitudes),
+            'hourly': VARIAVEIS_HORARIAS,
+            'timezone': 'America/Sao_Paulo',
+            'past_days': 1,
+            'forecast_days': 7
+        }
+
+        dados = self._fazer_requisicao(params)
+        # Com várias coordenadas a API devolve uma lista (uma entrada por ponto)
+        pontos = dados if isinstance(dados, list) else [dados] if dados else []
+        if len(pontos) != len(latitudes) or not all(p.get('hourly', {}).get('time') for p in pontos):
+            return None
+        return {
+            'latitudes': [float(v) for v in latitudes],
+            'longitudes': [float(v) for v in longitudes],
+            'hourly': [p['hourly'] for p in pontos]
+        }
+
+    def obter_historico(self, inicio, fim, url: Optional[str] = None) -> Optional[PrevisaoHoraria]:
+        """
+        Clima horário observado de [inicio, fim] (datas, inclusivo) pelo
+        endpoint de arquivo, sem cache. None se a API falhar.
+        """
+        params = {
+            'latitude': self.LATITUDE_SP,
+            'longitude': self.LONGITUDE_SP,
+            'start_date': f"{inicio:%Y-%m-%d}",
+            'end_date': f"{fim:%Y-%m-%d}",
+            'hourly': VARIAVEIS_HORARIAS,
+            'timezone': 'America/Sao_Paulo',
+        }
+
+        dados = self._fazer_requisicao(params, url=url or self.ARCHIVE_URL)
+        if dados and dados.get('hourly', {}).get('time'):
+            return PrevisaoHoraria.da_resposta(dados['hourly'])
+        return None
+
+    def obter_grade(self, dimensoes: Tuple[int, int] = GRADE_DIMENSOES) -> Optional[GradeClima]:
+        """
+        Previsão horária de uma grade (linhas x colunas) de pontos sobre a
+        região metropolitana, com o mesmo cache em memória/disco da previsão
+        """
+        linhas, colunas = dimensoes
+        lat, lon = np.meshgrid(np.linspace(*GRADE_LATITUDES, linhas),
+                               np.linspace(*GRADE_LONGITUDES, colunas), indexing='ij')
+        nome = f'grade_{linhas}x{colunas}'
+        entrada = self._entrada(nome, self.previsao_ttl, lambda: self._buscar_grade(lat.ravel(), lon.ravel()))
+        if entrada is None:
+            return None
+
+        obtida_em, dados = entrada
+        grade = self.grades.get(nome)
+        if grade is None or grade.obtida_em != obtida_em:
+            grade = GradeClima.da_resposta(dados, obtida_em)
+            self.grades[nome] = grade
+        return grade
+
+    def clima_por_posicao(self, lat, lon, timestamps, dimensoes: Tuple[int, int] = GRADE_DIMENSOES) -> pd.DataFrame:
+        """
+        Clima da célula mais próxima de cada posição, na hora de cada registro
+
+        Todas as linhas são resolvidas de uma vez (KD-tree + índice de hora);
+        posições fora da janela da previsão ficam com NaN.
+        """
+        indice = timestamps.index if isinstance(timestamps, pd.Series) else None
+        horas = _horas_epoch(timestamps)
+        resultado = pd.DataFrame(
+            {coluna: np.full(len(horas), np.nan) for coluna in COLUNAS_CLIMA},
+            index=indice,
+        )
+
+        grade = self.obter_grade(dimensoes)
+        if grade is None or len(horas) == 0:
             return resultado
+
+        idx_hora = horas - grade.hora_inicial
+        validos = (idx_hora >= 0) & (idx_hora < grade.n_horas)
+        celulas = grade.celulas(np.asarray(lat)[validos], np.asarray(lon)[validos])
+        for coluna in COLUNAS_CLIMA:
+            valores = resultado[coluna].to_numpy()
+            valores[validos] = getattr(grade, coluna)[celulas, idx_hora[validos]]
+            resultado[coluna] = valores
+        return resultado
+
+    def obter_clima_atual(self) -> Optional[Dict]:
+        """
+        Obtém dados climáticos atuais de São Paulo
         
-        return None
+        Returns:
+            Dict com temperatura, umidade, precipitação, etc.
+        """
+        entrada = self._entrada('atual', self.cache_ttl, self._buscar_clima_atual)
+        return entrada[1] if entrada else None
     
+    def obter_previsao(self) -> Optional[PrevisaoHoraria]:
+        """
+        Retorna a série horária de 7 dias (mais o dia anterior) a partir do
+        cache em memória/disco, atualizado em segundo plano quando expira
+        """
+        entrada = self._entrada('previsao', self.previsao_ttl, self._buscar_previsao)
+        if entrada is None:
+            return None
+
+        obtida_em, horario = entrada
+        previsao = self.previsao
+        if previsao is None or previsao.obtida_em != obtida_em:
+            previsao = PrevisaoHoraria.da_resposta(horario, obtida_em)
+            self.previsao = previsao
+        return previsao
+
     def obter_previsao_horaria(self, horas: int = 24) -> Optional[Dict]:
         """
-        Obtém previsão horária para as próximas N horas
+        Obtém previsão horária para as próximas N horas (a partir da meia-noite de hoje)
         
         Args:
             horas: Número de horas para prever (máximo 168)
@@ -99,80 +546,88 @@ class ClimaOpenMeteo:
         Returns:
             Dict com arrays de dados horários
         """
-        params = {
-            'latitude': self.LATITUDE_SP,
-            'longitude': self.LONGITUDE_SP,
-            'hourly': 'temperature_2m,relative_humidity_2m,precipitation,weather_code,wind_speed_10m',
-            'timezone': 'America/Sao_Paulo',
-            'forecast_days': min(7, (horas // 24) + 1)
+        previsao = self.obter_previsao()
+        if previsao is None:
+            return None
+
+        hoje = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        inicio = max(int(_horas_epoch([hoje])[0]) - previsao.hora_inicial, 0)
+        fatia = slice(inicio, min(inicio + horas, len(previsao)))
+        registros = [previsao.registro(i) for i in range(fatia.start, fatia.stop)]
+        return {
+            'horarios': [r['timestamp'] for r in registros],
+            'temperaturas': [r['temperatura'] for r in registros],
+            'umidades': [r['umidade'] for r in registros],
+            'precipitacoes': [r['precipitacao'] for r in registros],
+            'codigos_clima': [r['codigo_clima'] for r in registros],
+            'velocidades_vento': [r['velocidade_vento'] for r in registros]
         }
-        
-        dados = self._fazer_requisicao(params)
-        if dados and 'hourly' in dados:
-            # Limitar ao número de horas solicitado
-            resultado = {
-                'horarios': dados['hourly']['time'][:horas],
-                'temperaturas': dados['hourly']['temperature_2m'][:horas],
-                'umidades': dados['hourly']['relative_humidity_2m'][:horas],
-                'precipitacoes': dados['hourly']['precipitation'][:horas],
-                'codigos_clima': dados['hourly']['weather_code'][:horas],
-                'velocidades_vento': dados['hourly']['wind_speed_10m'][:horas]
-            }
-            return resultado
-        
-        return None
     
     def obter_clima_para_timestamp(self, timestamp: datetime) -> Optional[Dict]:
         """
         Obtém dados climáticos para um timestamp específico
-        Usa previsão horária e encontra o horário mais próximo
+        Usa a previsão horária em cache (índice direto pela hora)
         
         Args:
             timestamp: Data/hora desejada
         
         Returns:
-            Dict com dados climáticos do horário mais próximo
+            Dict com dados climáticos da hora correspondente
         """
-        # Se for no passado ou muito distante, usar dados atuais
-        agora = datetime.now()
-        diferenca = (timestamp - agora).total_seconds()
-        
-        if diferenca < -3600:  # Mais de 1 hora no passado
-            return self.obter_clima_atual()
-        
-        if diferenca > 168 * 3600:  # Mais de 7 dias no futuro
-            return self.obter_clima_atual()
-        
-        # Buscar previsão horária
-        horas_futuro = int(diferenca / 3600) + 1
-        previsao = self.obter_previsao_horaria(horas=min(168, horas_futuro + 1))
-        
-        if previsao and previsao['horarios']:
-            # Encontrar horário mais próximo
-            timestamp_str = timestamp.strftime('%Y-%m-%dT%H:00')
-            
-            try:
-                idx = previsao['horarios'].index(timestamp_str)
-                return {
-                    'temperatura': previsao['temperaturas'][idx],
-                    'umidade': previsao['umidades'][idx],
-                    'precipitacao': previsao['precipitacoes'][idx],
-                    'codigo_clima': previsao['codigos_clima'][idx],
-                    'velocidade_vento': previsao['velocidades_vento'][idx],
-                    'timestamp': timestamp_str
-                }
-            except ValueError:
-                # Se não encontrar exato, usar o primeiro disponível
-                return {
-                    'temperatura': previsao['temperaturas'][0],
-                    'umidade': previsao['umidades'][0],
-                    'precipitacao': previsao['precipitacoes'][0],
-                    'codigo_clima': previsao['codigos_clima'][0],
-                    'velocidade_vento': previsao['velocidades_vento'][0],
-                    'timestamp': previsao['horarios'][0]
-                }
-        
+        previsao = self.obter_previsao()
+        if previsao is not None:
+            idx = int(previsao.indices(_horas_epoch([timestamp]))[0])
+            if idx >= 0:
+                return previsao.registro(idx)
+
+        # Fora da janela da previsão: usar dados atuais
         return self.obter_clima_atual()
+
+    def clima_para_timestamps(self, timestamps) -> pd.DataFrame:
+        """
+        Versão em lote de obter_clima_para_timestamp
+
+        Args:
+            timestamps: Série/array de datas e horas locais
+
+        Returns:
+            DataFrame (mesmo índice quando recebe uma Series) com as colunas
+            climáticas; linhas fora da janela da previsão ficam com NaN
+        """
+        indice = timestamps.index if isinstance(timestamps, pd.Series) else None
+        horas = _horas_epoch(timestamps)
+        resultado = pd.DataFrame(
+            {coluna: np.full(len(horas), np.nan) for coluna in COLUNAS_CLIMA},
+            index=indice,
+        )
+
+        previsao = self.obter_previsao()
+        if previsao is None or len(horas) == 0:
+            return resultado
+
+        idx = previsao.indices(horas)
+        validos = idx >= 0
+        for coluna in COLUNAS_CLIMA:
+            valores = resultado[coluna].to_numpy()
+            valores[validos] = getattr(previsao, coluna)[idx[validos]]
+            resultado[coluna] = valores
+        return resultado
+    
+    def tabela_horaria(self) -> pd.DataFrame:
+        """
+        Série horária em cache como tabela ordenada por `hora`
+        (pronta para junções as-of com os registros coletados)
+        """
+        previsao = self.obter_previsao()
+        if previsao is None:
+            return pd.DataFrame({'hora': pd.Series(dtype='datetime64[ns]'),
+                                 **{c: pd.Series(dtype=float) for c in COLUNAS_CLIMA}})
+
+        horas = (previsao.hora_inicial + np.arange(len(previsao))).astype('datetime64[h]')
+        return pd.DataFrame({
+            'hora': horas.astype('datetime64[ns]'),
+            **{coluna: getattr(previsao, coluna) for coluna in COLUNAS_CLIMA}
+        })
     
     def interpretar_codigo_clima(self, codigo: int) -> Dict[str, str]:
         """
@@ -2,12 +2,30 @@ import requests
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
-import os
-import pickle
 from math import radians, cos, sin, asin, sqrt
+from typing import Optional
+from urllib3.exceptions import HTTPError as ErroUrllib3
 
 from contexto_planejamento import ContextoPlanejamento
-from clima_openmeteo import ClimaOpenMeteo
+from clima_openmeteo import COLUNAS_CLIMA, ClimaOpenMeteo
+from estado_veiculos import EstadoVeiculos
+from feature_store import LIMITES_TEMPERATURA
+from historico_posicoes import HistoricoPosicoes
+from parser_posicao import ERROS_JSON, ler_posicoes_dict, ler_posicoes_stream, para_dataframe
+
+URL_API = "http://api.olhovivo.sptrans.com.br/v2.1"
+TOKEN_SPTRANS = "2a80206e20b1d3be63305d9e703cf2bcc761384f8826975b4c6b55deb70425e9"
+TIMEOUT_API = 30  # segundos
+
+# Clima usado quando não há dado para a hora do registro
+CLIMA_PADRAO = {
+    'temperatura': 22.0,
+    'umidade': 65.0,
+    'precipitacao': 0.0,
+    'velocidade_vento': 10.0,
+    'codigo_clima': 0
+}
+USAR_GRADE_CLIMA = True  # Clima da célula da grade mais próxima de cada veículo
 
 def validar_coordenadas_sp(lat, lon):
     """
@@ -26,51 +44,88 @@ def haversine(lon1, lat1, lon2, lat2):
     km = 6371 * c
     return km
 
-def calcular_velocidade_historico(df_atual, historico_anterior):
-    """Calcula velocidade baseado em posições anteriores"""
+def haversine_vetorizado(lon1, lat1, lon2, lat2):
+    """Versão NumPy de `haversine`: recebe arrays e devolve distâncias em km"""
+    lon1, lat1, lon2, lat2 = (np.radians(np.asarray(v, dtype=np.float64))
+                              for v in (lon1, lat1, lon2, lat2))
+    dlon = lon2 - lon1
+    dlat = lat2 - lat1
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    c = 2 * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+    return 6371 * c
+
+def calcular_velocidade_historico(df_atual, historico_anterior, coluna_tempo='timestamp'):
+    """
+    Calcula velocidade baseado em posições anteriores
+
+    Faz um único join entre a posição atual e a última posição conhecida
+    (por veículo quando há `prefixo`, senão por linha), aplica Haversine
+    sobre arrays e limita o resultado a 0-100 km/h.
+    """
     if historico_anterior is None or len(historico_anterior) == 0:
         return df_atual
-    
+
     df_resultado = df_atual.copy()
-    velocidades_calculadas = []
+
+    # Chave do join: prefixo do veículo quando disponível nos dois lados
+    chave = 'prefixo' if ('prefixo' in df_resultado.columns
+                          and 'prefixo' in historico_anterior.columns) else 'linha'
+
+    # Posição mais recente de cada chave no histórico
+    ultimos = (historico_anterior[[chave, 'lat', 'lon', coluna_tempo]]
+               .drop_duplicates(subset=chave, keep='last')
+               .set_index(chave))
+    posicao = ultimos.index.get_indexer(df_resultado[chave])
+    encontrado = posicao >= 0
+    posicao = np.where(encontrado, posicao, 0)
+
+    lat_ant = ultimos['lat'].to_numpy(dtype=np.float64)[posicao]
+    lon_ant = ultimos['lon'].to_numpy(dtype=np.float64)[posicao]
+    ts_ant = pd.to_datetime(ultimos[coluna_tempo]).to_numpy(dtype='datetime64[ns]')[posicao]
+    ts_atual = pd.to_datetime(df_resultado[coluna_tempo]).to_numpy(dtype='datetime64[ns]')
+
+    # Distância percorrida (km) e tempo decorrido (horas)
+    dist_km = haversine_vetorizado(lon_ant, lat_ant,
+                                   df_resultado['lon'].to_numpy(dtype=np.float64),
+                                   df_resultado['lat'].to_numpy(dtype=np.float64))
+    tempo_diff = (ts_atual - ts_ant) / np.timedelta64(1, 'h')
+
+    # Velocidade (km/h) apenas com deslocamento mínimo de 1 metro
+    valido = encontrado & (tempo_diff > 0) & (dist_km > 0.001)
+    velocidade = np.zeros(len(df_resultado), dtype=np.float64)
+    np.divide(dist_km, tempo_diff, out=velocidade, where=valido)
+
+    # Limitar velocidade a valores realísticos (0-100 km/h)
+    df_resultado['velocidade'] = np.clip(velocidade, 0, 100)
+    return df_resultado
+
+def atualizar_estado_veiculos(df, estado):
+    """Calcula velocidades contra o estado anterior e registra o ciclo atual no estado"""
+    coluna_tempo = 'timestamp_api' if 'timestamp_api' in df.columns else 'timestamp'
+
+    # Sem prefixo não há como seguir o veículo: todos cairiam no mesmo slot do
+    # estado e no mesmo par do join, gerando velocidades sem sentido
+    sem_prefixo = df['prefixo'].isna() | (df['prefixo'].astype(str) == '')
+    if sem_prefixo.any():
+        print(f"   ⚠️ {int(sem_prefixo.sum())} veículos sem prefixo descartados")
+        df = df[~sem_prefixo].reset_index(drop=True)
     
-    for idx, row in df_resultado.iterrows():
-        # Buscar veículo no histórico (mesmo na mesma linha)
-        veiculo_historico = historico_anterior[
-            (historico_anterior['linha'] == row['linha'])
-        ]
-        
-        if len(veiculo_historico) > 0:
-            # Pegar posição mais recente deste veículo
-            ultimo = veiculo_historico.iloc[-1]
-            
-            # Calcular distância percorrida
-            dist_km = haversine(ultimo['lon'], ultimo['lat'], row['lon'], row['lat'])
-            
-            # Calcular tempo decorrido (em horas)
-            tempo_diff = (row['timestamp'] - ultimo['timestamp']).total_seconds() / 3600
-            
-            # Calcular velocidade (km/h)
-            if tempo_diff > 0 and dist_km > 0.001:  # Mínimo 1 metro
-                velocidade = dist_km / tempo_diff
-                # Limitar velocidade a valores realísticos (0-100 km/h)
-                velocidade = min(max(velocidade, 0), 100)
-            else:
-                velocidade = 0
-            
-            velocidades_calculadas.append(velocidade)
-        else:
-            velocidades_calculadas.append(0)
+    if len(estado) > 0:
+        print("   🧮 Calculando velocidades baseadas em mudanças de posição...")
+        anteriores = estado.ultimas_posicoes().rename(columns={'timestamp': coluna_tempo})
+        df = calcular_velocidade_historico(df, anteriores, coluna_tempo=coluna_tempo)
+        velocidades_nao_zero = (df['velocidade'] > 0).sum()
+        print(f"   ✅ {velocidades_nao_zero} veículos com velocidade calculada")
     
-    df_resultado['velocidade'] = velocidades_calculadas
-    return df_resultado
+    estado.atualizar(df, coluna_tempo=coluna_tempo)
+    return df
 
-def autenticar_sptrans(token):
-    """Tenta autenticar na API da SPTrans"""
-    url = f"http://api.olhovivo.sptrans.com.br/v2.1/Login/Autenticar?token={token}"
+def autenticar_sptrans(token, session=None):
+    """Tenta autenticar na API da SPTrans (reaproveita a sessão se informada)"""
+    url = f"{URL_API}/Login/Autenticar?token={token}"
 
-    session = requests.Session()
-    response = session.post(url)
+    session = session or requests.Session()
+    response = session.post(url, timeout=TIMEOUT_API)
 
     if response.status_code == 200:
         print("✅ Autenticado com sucesso na SPTrans!")
@@ -79,66 +134,63 @@ def autenticar_sptrans(token):
         print(f"❌ Falha na autenticação: {response.status_code}")
         return None
 
+def _dataframe_veiculos(colunas):
+    """Aplica o filtro geográfico e reporta o resultado (None se não houver veículos)"""
+    print(f"   📊 Linhas encontradas na API: {colunas.total_linhas}")
+    df = para_dataframe(colunas)
+    
+    if len(df) == 0:
+        print("   ⚠️ API não retornou nenhum veículo ativo ou todos com coordenadas inválidas")
+        return None
+    
+    print(f"   ✅ {len(df)} veículos coletados da API")
+    return df
+
+def extrair_veiculos(dados):
+    """Converte o payload de /Posicao (já carregado) em DataFrame"""
+    if not dados or not isinstance(dados, dict):
+        print("   ⚠️ API retornou resposta vazia")
+        return None
+    return _dataframe_veiculos(ler_posicoes_dict(dados))
+
+def buscar_posicoes(session):
+    """
+    Consulta /Posicao com uma sessão já autenticada
+    
+    O corpo da resposta é lido em streaming direto para arrays colunares.
+    
+    Returns:
+        Tupla (status_code, DataFrame ou None)
+    
+    Raises:
+        requests.RequestException: também quando o corpo chega truncado ou a
+            conexão cai no meio da leitura
+    """
+    with session.get(f"{URL_API}/Posicao", timeout=TIMEOUT_API, stream=True) as response:
+        if response.status_code != 200:
+            return response.status_code, None
+        response.raw.decode_content = True
+        try:
+            colunas = ler_posicoes_stream(response.raw)
+        except (*ERROS_JSON, ErroUrllib3) as e:
+            # Lendo response.raw direto, o requests não converte esses erros
+            raise requests.RequestException(f"Resposta /Posicao incompleta: {e}") from e
+    return response.status_code, _dataframe_veiculos(colunas)
+
 def buscar_dados_reais(token):
     """Busca dados reais da SPTrans"""
     session = autenticar_sptrans(token)
     
     if session:
         try:
-            url = "http://api.olhovivo.sptrans.com.br/v2.1/Posicao"
-            response = session.get(url)
+            status, df = buscar_posicoes(session)
             
-            if response.status_code == 200:
-                dados = response.json()
-                
-                if not dados or not isinstance(dados, dict):
-                    print("   ⚠️ API retornou resposta vazia")
-                    return None
-                
-                linhas_api = dados.get('l', [])
-                print(f"   📊 Linhas encontradas na API: {len(linhas_api)}")
-                
-                linhas = []
-                for linha in linhas_api:
-                    if not linha:
-                        continue
-                    veiculos = linha.get('vs', [])
-                    codigo_linha = linha.get('c', '')
-                    
-                    for veiculo in veiculos:
-                        if not veiculo:
-                            continue
-                        
-                        # Extrair coordenadas
-                        lat = veiculo.get('py', 0)
-                        lon = veiculo.get('px', 0)
-                        
-                        # Validar coordenadas antes de adicionar
-                        if not validar_coordenadas_sp(lat, lon):
-                            continue  # Pular veículos com coordenadas inválidas
-                        
-                        # Velocidade inicial = 0 (será calculada depois baseada em histórico)
-                        velocidade = 0
-                        
-                        linhas.append({
-                            'linha': str(codigo_linha),
-                            'velocidade': velocidade,
-                            'lat': lat,
-                            'lon': lon,
-                            'timestamp': datetime.now()
-                        })
-                
-                if len(linhas) == 0:
-                    print("   ⚠️ API não retornou nenhum veículo ativo ou todos com coordenadas inválidas")
+            if status == 200:
+                if df is None:
                     print("   💡 Usando dados de exemplo em seu lugar")
-                    return None
-                
-                df = pd.DataFrame(linhas)
-                df['fonte_dados'] = 'real'  # Flag indicando dados reais da API
-                print(f"   ✅ {len(df)} veículos coletados da API")
                 return df
             else:
-                print(f"   ⚠️ Status code: {response.status_code}")
+                print(f"   ⚠️ Status code: {status}")
                 
         except Exception as e:
             print(f"❌ Erro na coleta real: {e}")
@@ -182,104 +234,136 @@ def adicionar_contexto_planejamento(df: pd.DataFrame) -> pd.DataFrame:
     df['timestamp'] = pd.to_datetime(df['timestamp'])
     contexto = ContextoPlanejamento.obter()
 
-    resumos = df['timestamp'].apply(lambda ts: contexto.resumo_diario(ts.to_pydatetime()))
+    colunas_contexto = contexto.contexto_em_lote(df['timestamp'])
+    for coluna in colunas_contexto.columns:
+        df[coluna] = colunas_contexto[coluna]
 
-    df['periodo_pico'] = resumos.apply(lambda r: r.get('periodo_pico'))
-    df['descricao_pico'] = resumos.apply(lambda r: r.get('descricao_pico'))
-    df['em_periodo_pico'] = df['periodo_pico'].notna().astype(int)
-    df['rodizio_ativo'] = resumos.apply(lambda r: r.get('rodizio_ativo', False)).astype(int)
+    return df
 
-    df['feriado_nome'] = resumos.apply(
-        lambda r: r.get('feriado', {}).get('nome') if r.get('feriado') else None
-    )
-    df['feriado_tipo'] = resumos.apply(
-        lambda r: r.get('feriado', {}).get('tipo') if r.get('feriado') else None
-    )
-    df['feriado_categoria'] = resumos.apply(
-        lambda r: r.get('feriado', {}).get('categoria') if r.get('feriado') else None
+
+def derivar_features_climaticas(df: pd.DataFrame) -> pd.DataFrame:
+    """Calcula tem_chuva, categoria de temperatura e umidade_alta (operações vetorizadas)"""
+    df['tem_chuva'] = (df['precipitacao'].to_numpy() > 0).astype(int)
+    # <15: 0, 15-20: 1, 20-25: 2, 25-30: 3, >=30: 4
+    df['temperatura_categoria_codigo'] = np.digitize(df['temperatura'].to_numpy(), LIMITES_TEMPERATURA)
+    df['umidade_alta'] = (df['umidade'].to_numpy() > 70).astype(int)
+    return df
+
+
+def juntar_clima_por_hora(
+    timestamps: pd.Series,
+    tabela_clima: pd.DataFrame,
+    tolerancia: pd.Timedelta = pd.Timedelta(hours=1),
+) -> pd.DataFrame:
+    """
+    Alinha cada registro ao clima da sua própria hora (junção as-of ordenada)
+
+    Args:
+        timestamps: Série de datas/horas locais
+        tabela_clima: Tabela horária com a coluna `hora` e as colunas climáticas
+        tolerancia: Distância máxima entre o registro e a hora de referência
+
+    Returns:
+        DataFrame com as colunas climáticas no mesmo índice/ordem de `timestamps`
+        (NaN onde não há hora de referência dentro da tolerância)
+    """
+    tempos = pd.to_datetime(timestamps).to_numpy(dtype='datetime64[ns]')
+    resultado = pd.DataFrame(
+        {coluna: np.full(len(tempos), np.nan) for coluna in COLUNAS_CLIMA},
+        index=timestamps.index,
     )
 
-    df['eventos_list'] = resumos.apply(lambda r: r.get('eventos', []))
-    df['tem_evento_relevante'] = df['eventos_list'].apply(lambda eventos: int(bool(eventos)))
-    df['eventos'] = df['eventos_list'].apply(lambda eventos: "; ".join(eventos) if eventos else None)
-    df = df.drop(columns=['eventos_list'])
+    validos = np.flatnonzero(~np.isnat(tempos))
+    if len(validos) == 0 or len(tabela_clima) == 0:
+        return resultado
 
-    return df
+    ordem = validos[np.argsort(tempos[validos], kind='stable')]
+    tabela = tabela_clima.sort_values('hora')
+    unido = pd.merge_asof(
+        pd.DataFrame({'timestamp': tempos[ordem]}),
+        tabela.assign(hora=pd.to_datetime(tabela['hora']).astype('datetime64[ns]')),
+        left_on='timestamp',
+        right_on='hora',
+        direction='backward',
+        tolerance=tolerancia,
+    )
+    for coluna in COLUNAS_CLIMA:
+        valores = resultado[coluna].to_numpy()
+        valores[ordem] = unido[coluna].to_numpy(dtype=float)
+        resultado[coluna] = valores
+    return resultado
 
 
-def adicionar_dados_climaticos(df: pd.DataFrame) -> pd.DataFrame:
-    """Enriquece o DataFrame com dados climáticos de São Paulo"""
+def adicionar_dados_climaticos(
+    df: pd.DataFrame,
+    tabela_clima: Optional[pd.DataFrame] = None,
+    usar_grade: bool = USAR_GRADE_CLIMA,
+) -> pd.DataFrame:
+    """
+    Enriquece o DataFrame com o clima de São Paulo na hora de cada registro
+
+    Args:
+        df: Registros com a coluna `timestamp` (e `lat`/`lon` para a grade)
+        tabela_clima: Tabela horária (coluna `hora` + colunas climáticas);
+            por padrão, a série em cache do Open-Meteo
+        usar_grade: Sem tabela informada, usa a grade de pontos e atribui
+            a cada veículo o clima da célula mais próxima
+    """
     if 'timestamp' not in df.columns:
         return df
     
     df = df.copy()
     df['timestamp'] = pd.to_datetime(df['timestamp'])
     
-    print("   📡 Buscando dados climáticos...")
-    clima = ClimaOpenMeteo.obter()
-    
-    # Obter clima atual uma vez
-    clima_atual = clima.obter_clima_atual()
-    
-    # Valores padrão se API falhar
-    if not clima_atual:
-        clima_atual = {
-            'temperatura': 22.0,
-            'umidade': 65.0,
-            'precipitacao': 0.0,
-            'velocidade_vento': 10.0,
-            'codigo_clima': 0
-        }
+    clima = None
+    if tabela_clima is None:
+        print("   📡 Buscando dados climáticos...")
+        cliente = ClimaOpenMeteo.obter()
+        if usar_grade and {'lat', 'lon'}.issubset(df.columns):
+            clima = cliente.clima_por_posicao(df['lat'], df['lon'], df['timestamp'])
+        tabela_clima = cliente.tabela_horaria()
+
+    # Linhas sem célula da grade caem para a série de ponto único
+    ponto_unico = juntar_clima_por_hora(df['timestamp'], tabela_clima)
+    clima = ponto_unico if clima is None else clima.fillna(ponto_unico)
+
+    sem_clima = clima['temperatura'].isna()
+    if sem_clima.all():
         print("   ⚠️ Usando valores padrão de clima")
     else:
-        print(f"   ✅ Clima: {clima_atual.get('temperatura')}°C")
-    
-    # Aplicar dados climáticos
-    df['temperatura'] = clima_atual.get('temperatura', 22.0)
-    df['umidade'] = clima_atual.get('umidade', 65.0)
-    df['precipitacao'] = clima_atual.get('precipitacao', 0.0)
-    df['velocidade_vento'] = clima_atual.get('velocidade_vento', 10.0)
-    df['codigo_clima'] = clima_atual.get('codigo_clima', 0)
-    
-    # Features derivadas
-    df['tem_chuva'] = (df['precipitacao'] > 0).astype(int)
-    
-    # Categoria de temperatura
-    temp = clima_atual.get('temperatura', 22.0)
-    if temp < 15:
-        codigo = 0
-    elif temp < 20:
-        codigo = 1
-    elif temp < 25:
-        codigo = 2
-    elif temp < 30:
-        codigo = 3
-    else:
-        codigo = 4
-    df['temperatura_categoria_codigo'] = codigo
+        print(f"   ✅ Clima alinhado por hora: {int((~sem_clima).sum())} de {len(df)} registros")
+
+    # Valores padrão para horas sem dados
+    for coluna in COLUNAS_CLIMA:
+        df[coluna] = clima[coluna].fillna(CLIMA_PADRAO[coluna]).to_numpy()
+    df['codigo_clima'] = df['codigo_clima'].astype(int)
+
+    return derivar_features_climaticas(df)
+
+def enriquecer_e_salvar(df):
+    """Adiciona contexto urbano e clima ao snapshot e grava em disco"""
+    df = adicionar_contexto_planejamento(df)
     
-    df['umidade_alta'] = (df['umidade'] > 70).astype(int)
+    # Adicionar dados climáticos
+    print("🌤️ Coletando dados climáticos...")
+    df = adicionar_dados_climaticos(df)
+    print("✅ Dados climáticos adicionados")
     
+    # Anexar snapshot ao histórico colunar (particionado por data/hora).
+    # Lotes simulados não são gravados; a compactação roda só no daemon.
+    HistoricoPosicoes().anexar(df)
     return df
 
 def main():
     """Função principal"""
-    token = "2a80206e20b1d3be63305d9e703cf2bcc761384f8826975b4c6b55deb70425e9"
-    
     print("🚌 Iniciando coleta de dados de transporte público...")
 
-    historico_path = 'dados/historico_posicoes.pkl'
-    historico_anterior = None
-    if os.path.exists(historico_path):
-        try:
-            with open(historico_path, 'rb') as f:
-                historico_anterior = pickle.load(f)
-            print("   📂 Histórico anterior carregado")
-        except:
-            pass
+    estado = EstadoVeiculos.carregar()
+    if len(estado) > 0:
+        print(f"   📂 Estado anterior carregado: {len(estado)} veículos")
     
     # Tentar dados reais primeiro
-    df = buscar_dados_reais(token)
+    df = buscar_dados_reais(TOKEN_SPTRANS)
     
     # Se falhar ou retornar poucos dados, usar dados de exemplo
     if df is None or len(df) == 0:
@@ -287,28 +371,13 @@ def main():
         print("📊 Dados de exemplo criados (fonte: simulado)")
     else:
         print(f"📊 Dados reais coletados da SPTrans: {len(df)} veículos (fonte: real)")
-        
-        if historico_anterior is not None:
-            print("   🧮 Calculando velocidades baseadas em mudanças de posição...")
-            df = calcular_velocidade_historico(df, historico_anterior)
-            velocidades_nao_zero = (df['velocidade'] > 0).sum()
-            print(f"   ✅ {velocidades_nao_zero} veículos com velocidade calculada")
-  
+        df = atualizar_estado_veiculos(df, estado)
         try:
-            with open(historico_path, 'wb') as f:
-                pickle.dump(df[['linha', 'lat', 'lon', 'timestamp']], f)
-        except:
-            pass
+            estado.salvar()
+        except OSError as e:
+            print(f"   ⚠️ Não foi possível salvar o estado dos veículos: {e}")
     
-    df = adicionar_contexto_planejamento(df)
-    
-    # Adicionar dados climáticos
-    print("🌤️ Coletando dados climáticos...")
-    df = adicionar_dados_climaticos(df)
-    print("✅ Dados climáticos adicionados")
-    
-    # Garantir que a pasta dados existe
-    os.makedirs('dados', exist_ok=True)
+    df = enriquecer_e_salvar(df)
     
     # Diagnóstico
     print(f"\n📊 Diagnóstico dos dados:")
@@ -318,9 +387,10 @@ def main():
     if 'lat' in df.columns and 'lon' in df.columns:
         print(df[['linha', 'lat', 'lon', 'velocidade']].head())
     
-    # Salvar dados
-    df.to_csv('dados/dados_onibus.csv', index=False)
-    print(f"\n💾 Dados salvos: {len(df)} registros")
+    if (df['fonte_dados'] == 'simulado').all():
+        print("\n⚠️ Dados simulados não foram gravados no histórico")
+    else:
+        print(f"\n💾 Dados salvos: {len(df)} registros")
     print(f"📋 Linhas: {', '.join(df['linha'].unique())}")
 
 if __name__ == "__main__":
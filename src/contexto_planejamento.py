@@ -5,17 +5,24 @@ e oferecer utilitários para enriquecer os dados coletados pelo sistema.
 
 from __future__ import annotations
 
+import hashlib
 import json
 import os
+import threading
+from bisect import bisect_right
 from dataclasses import dataclass
 from datetime import date, datetime, time
-from functools import lru_cache
 from typing import Dict, List, Optional
 
+import numpy as np
+import pandas as pd
+
 
 BASE_PATH = os.path.dirname(os.path.dirname(__file__))
 JSON_PATH = os.path.join(BASE_PATH, "dados", "contexto_planejamento.json")
 
+MINUTOS_SEMANA = 7 * 24 * 60
+
 DIAS_SEMANA = ["Segunda", "Terça", "Quarta", "Quinta", "Sexta", "Sábado", "Domingo"]
 MESES = [
     "Janeiro",
@@ -59,14 +66,37 @@ class ResultadoFeriado:
     categoria: str
 
 
+@dataclass
+class _EventoCompilado:
+    ordem: int
+    nome: str
+    mascara_dias: int
+    mascara_meses: int
+
+
+def _mascara(valores: List[str], referencia: List[str]) -> int:
+    """Converte nomes (dias/meses) em bitmask; lista vazia significa 'todos'."""
+    if not valores:
+        return (1 << len(referencia)) - 1
+    mascara = 0
+    for valor in valores:
+        if valor in referencia:
+            mascara |= 1 << referencia.index(valor)
+    return mascara
+
+
 class ContextoPlanejamento:
     """
     Carrega o JSON de contexto e oferece métodos de consulta
     para diferentes componentes do sistema.
+
+    Uma instância é imutável depois de construída; recarregar o JSON gera
+    uma nova instância com `versao` incrementada (ver `ProvedorContexto`).
     """
 
-    def __init__(self):
-        self._dados = self._carregar_json()
+    def __init__(self, dados: Optional[Dict] = None, versao: int = 0):
+        self._dados = dados if dados is not None else self._carregar_json()
+        self.versao = versao
         self._periodos_pico = [
             {
                 **periodo,
@@ -83,6 +113,59 @@ class ContextoPlanejamento:
             )
             for intervalo in self._rodizio.get("restricted_times", [])
         ]
+        self._tabela_minutos: Optional[Dict[str, np.ndarray]] = None
+        self._feriados_por_data = self._indexar_feriados()
+        self._indexar_eventos()
+
+    def _indexar_feriados(self) -> Dict[date, ResultadoFeriado]:
+        """Mapa data -> feriado (a primeira ocorrência no JSON prevalece)."""
+        indice: Dict[date, ResultadoFeriado] = {}
+        for categoria, itens in self._dados.get("holidays", {}).items():
+            for feriado in itens:
+                try:
+                    dia = date.fromisoformat(feriado["date"])
+                except ValueError:
+                    continue
+                indice.setdefault(
+                    dia,
+                    ResultadoFeriado(nome=feriado["name"], tipo=feriado["type"], categoria=categoria),
+                )
+        return indice
+
+    def _indexar_eventos(self) -> None:
+        """
+        Compila os eventos recorrentes uma única vez.
+
+        Dias da semana e meses viram bitmasks. Eventos com intervalo de datas
+        entram em um índice de segmentos ordenados: `_limites` guarda as
+        fronteiras e `_ativos_por_segmento[i]` os eventos válidos entre
+        `_limites[i-1]` e `_limites[i]`, consultado com busca binária.
+        """
+        self._eventos_sem_intervalo: List[_EventoCompilado] = []
+        intervalos: List[tuple[int, int, _EventoCompilado]] = []
+
+        recorrentes = self._dados.get("recurring_events", {}).get("events", [])
+        for ordem, evento in enumerate(recorrentes):
+            compilado = _EventoCompilado(
+                ordem=ordem,
+                nome=evento["name"],
+                mascara_dias=_mascara(evento.get("days", []), DIAS_SEMANA),
+                mascara_meses=_mascara(evento.get("typical_months", []), MESES),
+            )
+            intervalo = evento.get("dates") or evento.get("next_dates")
+            faixa = _extrair_datas_intervalo(intervalo) if intervalo else None
+            if faixa:
+                intervalos.append((faixa[0].toordinal(), faixa[1].toordinal() + 1, compilado))
+            else:
+                self._eventos_sem_intervalo.append(compilado)
+
+        self._limites = sorted({p for inicio, fim, _ in intervalos for p in (inicio, fim)})
+        self._ativos_por_segmento: List[List[_EventoCompilado]] = [[]]
+        for i in range(len(self._limites)):
+            inicio_segmento = self._limites[i]
+            self._ativos_por_segmento.append(
+                [ev for inicio, fim, ev in intervalos if inicio <= inicio_segmento < fim]
+            )
 
     @staticmethod
     def _carregar_json() -> Dict:
@@ -95,10 +178,15 @@ class ContextoPlanejamento:
             return json.load(arquivo)
 
     @classmethod
-    @lru_cache(maxsize=1)
     def obter(cls) -> "ContextoPlanejamento":
-        """Retorna instância singleton."""
-        return cls()
+        """Retorna a instância vigente (recarregada quando o JSON muda)."""
+        return _PROVEDOR.atual()
+
+    def preparar(self) -> "ContextoPlanejamento":
+        """Constrói as tabelas preguiçosas antes de a instância ser publicada."""
+        if self._tabela_minutos is None:
+            self._tabela_minutos = self._construir_tabela_minutos()
+        return self
 
     def periodo_pico(self, momento: datetime) -> Optional[Dict]:
         """Retorna o período de pico correspondente ao horário informado."""
@@ -123,46 +211,24 @@ class ContextoPlanejamento:
 
     def feriado_no_dia(self, momento: datetime) -> Optional[ResultadoFeriado]:
         """Retorna informações de feriado/ponto facultativo."""
-        data_iso = momento.date().isoformat()
-        feriados = self._dados.get("holidays", {})
-
-        for categoria, itens in feriados.items():
-            for feriado in itens:
-                if feriado["date"] == data_iso:
-                    return ResultadoFeriado(
-                        nome=feriado["name"],
-                        tipo=feriado["type"],
-                        categoria=categoria,
-                    )
-        return None
+        return self._feriados_por_data.get(momento.date())
 
     def eventos_do_dia(self, momento: datetime) -> List[str]:
         """Lista eventos relevantes previstos para o dia."""
-        eventos: List[str] = []
-        recorrentes = self._dados.get("recurring_events", {}).get("events", [])
-        dia_semana_nome = DIAS_SEMANA[momento.weekday()]
-        data_iso = momento.date().isoformat()
-        mes_nome = MESES[momento.month - 1]
-
-        for evento in recorrentes:
-            dias = evento.get("days", [])
-            meses = evento.get("typical_months", [])
-
-            if dias and dia_semana_nome not in dias:
-                continue
-
-            if meses and mes_nome not in meses:
-                continue
-
-            intervalo = evento.get("dates") or evento.get("next_dates")
-            if intervalo:
-                faixa = _extrair_datas_intervalo(intervalo)
-                if faixa and not (faixa[0] <= momento.date() <= faixa[1]):
-                    continue
-
-            eventos.append(evento["name"])
-
-        return eventos
+        dia = momento.date()
+        bit_dia = 1 << dia.weekday()
+        bit_mes = 1 << (dia.month - 1)
+
+        segmento = bisect_right(self._limites, dia.toordinal())
+        candidatos = self._eventos_sem_intervalo + self._ativos_por_segmento[segmento]
+        if self._ativos_por_segmento[segmento] and self._eventos_sem_intervalo:
+            candidatos.sort(key=lambda ev: ev.ordem)
+
+        return [
+            ev.nome
+            for ev in candidatos
+            if ev.mascara_dias & bit_dia and ev.mascara_meses & bit_mes
+        ]
 
     def resumo_diario(self, momento: datetime) -> Dict:
         """Retorna um resumo consolidado para uso no dashboard/chat."""
@@ -185,6 +251,189 @@ class ContextoPlanejamento:
         }
 
 
+    def _construir_tabela_minutos(self) -> Dict[str, np.ndarray]:
+        """
+        Pré-calcula pico e rodízio para cada minuto da semana.
+
+        Cada minuto tem duas entradas: o instante exato hh:mm:00 (posição par)
+        e o intervalo aberto entre hh:mm e hh:mm+1 (posição ímpar), o que
+        reproduz as comparações inclusivas de `periodo_pico`/`rodizio_ativo`.
+        """
+        minutos = np.arange(MINUTOS_SEMANA)
+        dia = minutos // 1440
+        minuto_dia = minutos % 1440
+
+        def _minutos(hora: time) -> int:
+            return hora.hour * 60 + hora.minute
+
+        def _dentro(inicio: time, fim: time) -> np.ndarray:
+            exato = (minuto_dia >= _minutos(inicio)) & (minuto_dia <= _minutos(fim))
+            intervalo = (minuto_dia >= _minutos(inicio)) & (minuto_dia < _minutos(fim))
+            return np.stack([exato, intervalo], axis=1).ravel()
+
+        pico_idx = np.full(MINUTOS_SEMANA * 2, -1, dtype=np.int16)
+        for i, periodo in reversed(list(enumerate(self._periodos_pico))):
+            # Ordem reversa: o primeiro período que casa prevalece
+            pico_idx[_dentro(periodo["start_time"], periodo["end_time"])] = i
+
+        dias_validos = [DIAS_SEMANA.index(d) for d in self._rodizio.get("days", []) if d in DIAS_SEMANA]
+        dia_valido = np.repeat(np.isin(dia, dias_validos), 2)
+        rodizio = np.zeros(MINUTOS_SEMANA * 2, dtype=bool)
+        for inicio, fim in self._rodizio_horarios:
+            rodizio |= _dentro(inicio, fim)
+
+        return {"pico_idx": pico_idx, "rodizio": rodizio & dia_valido}
+
+    def contexto_em_lote(self, timestamps: pd.Series) -> pd.DataFrame:
+        """
+        Versão vetorizada de `resumo_diario` para uma Series de timestamps.
+
+        Pico e rodízio vêm de uma tabela por minuto da semana; feriados e
+        eventos são calculados uma vez por dia distinto e unidos por código.
+        Retorna um DataFrame com o mesmo índice de `timestamps`.
+        """
+        if self._tabela_minutos is None:
+            self._tabela_minutos = self._construir_tabela_minutos()
+        tabela = self._tabela_minutos
+
+        ts = pd.to_datetime(timestamps)
+        segundos_extras = (ts.dt.second.to_numpy() > 0) | (ts.dt.microsecond.to_numpy() > 0) | (
+            ts.dt.nanosecond.to_numpy() > 0
+        )
+        minuto_semana = (
+            ts.dt.dayofweek.to_numpy() * 1440 + ts.dt.hour.to_numpy() * 60 + ts.dt.minute.to_numpy()
+        )
+        chave_minuto = minuto_semana * 2 + segundos_extras
+
+        pico_idx = tabela["pico_idx"][chave_minuto]
+        nomes_pico = np.array([p["period"] for p in self._periodos_pico] + [None], dtype=object)
+        descricoes_pico = np.array([p["description"] for p in self._periodos_pico] + [None], dtype=object)
+
+        # Feriados e eventos: uma consulta por dia distinto
+        codigos_dia, dias = pd.factorize(ts.dt.normalize())
+        feriados = [self.feriado_no_dia(dia.to_pydatetime()) for dia in dias]
+        eventos = [self.eventos_do_dia(dia.to_pydatetime()) for dia in dias]
+
+        def _por_dia(valores: List, padrao=None) -> np.ndarray:
+            return np.array(valores + [padrao], dtype=object)[codigos_dia]
+
+        return pd.DataFrame(
+            {
+                "periodo_pico": nomes_pico[pico_idx],
+                "descricao_pico": descricoes_pico[pico_idx],
+                "em_periodo_pico": (pico_idx >= 0).astype(int),
+                "rodizio_ativo": tabela["rodizio"][chave_minuto].astype(int),
+                "feriado_nome": _por_dia([f.nome if f else None for f in feriados]),
+                "feriado_tipo": _por_dia([f.tipo if f else None for f in feriados]),
+                "feriado_categoria": _por_dia([f.categoria if f else None for f in feriados]),
+                "tem_evento_relevante": _por_dia([int(bool(e)) for e in eventos], 0).astype(int),
+                "eventos": _por_dia(["; ".join(e) if e else None for e in eventos]),
+            },
+            index=timestamps.index,
+        )
+
+
+class ProvedorContexto:
+    """
+    Mantém a instância vigente de `ContextoPlanejamento` e a reconstrói
+    quando o JSON muda (mtime/tamanho e, em seguida, hash do conteúdo).
+
+    A nova instância é montada por completo fora do caminho dos leitores e
+    publicada com uma única troca de referência: quem chama `atual()` nunca
+    espera pela reconstrução nem vê um estado parcial. Um JSON inválido é
+    ignorado e a versão anterior continua valendo.
+    """
+
+    def __init__(self, caminho: str = JSON_PATH, intervalo_s: float = 5.0):
+        self.caminho = caminho
+        self.intervalo_s = intervalo_s
+        self._atual: Optional[ContextoPlanejamento] = None
+        self._assinatura: Optional[tuple[int, int]] = None
+        self._hash: Optional[str] = None
+        self._lock = threading.Lock()
+        self._parar = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def versao(self) -> int:
+        return self.atual().versao
+
+    def atual(self) -> ContextoPlanejamento:
+        contexto = self._atual
+        if contexto is None:
+            self.recarregar()
+            contexto = self._atual
+        return contexto
+
+    def recarregar(self) -> bool:
+        """Reconstrói o contexto se o arquivo mudou. Retorna True se houve troca."""
+        with self._lock:
+            primeira_carga = self._atual is None
+            try:
+                estado = os.stat(self.caminho)
+            except OSError:
+                if primeira_carga:
+                    raise FileNotFoundError(
+                        f"Arquivo de contexto não encontrado em '{self.caminho}'."
+                    )
+                return False
+
+            assinatura = (estado.st_mtime_ns, estado.st_size)
+            if assinatura == self._assinatura:
+                return False
+
+            with open(self.caminho, "rb") as arquivo:
+                conteudo = arquivo.read()
+            hash_conteudo = hashlib.sha256(conteudo).hexdigest()
+            if hash_conteudo == self._hash:
+                self._assinatura = assinatura
+                return False
+
+            try:
+                versao = 1 if primeira_carga else self._atual.versao + 1
+                novo = ContextoPlanejamento(json.loads(conteudo), versao=versao).preparar()
+            except Exception as e:
+                if primeira_carga:
+                    raise
+                print(f"⚠️ Contexto de planejamento inválido, mantendo versão {self._atual.versao}: {e}")
+                self._assinatura = assinatura  # Só tenta de novo quando o arquivo mudar
+                return False
+
+            self._atual = novo
+            self._assinatura = assinatura
+            self._hash = hash_conteudo
+
+        if not primeira_carga:
+            print(f"🔄 Contexto de planejamento recarregado (versão {novo.versao})")
+        return True
+
+    def iniciar(self) -> None:
+        """Inicia (uma única vez) a thread que monitora o arquivo."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self.atual()
+        self._parar.clear()
+        self._thread = threading.Thread(target=self._monitorar, name="contexto-planejamento", daemon=True)
+        self._thread.start()
+
+    def parar(self) -> None:
+        self._parar.set()
+
+    def _monitorar(self) -> None:
+        while not self._parar.wait(self.intervalo_s):
+            try:
+                self.recarregar()
+            except Exception as e:
+                print(f"⚠️ Erro ao monitorar contexto de planejamento: {e}")
+
+
+_PROVEDOR = ProvedorContexto()
+
+
+def provedor_contexto() -> ProvedorContexto:
+    return _PROVEDOR
+
+
 def obter_resumo_contexto(momento: Optional[datetime] = None) -> Dict:
     instante = momento or datetime.now()
     return ContextoPlanejamento.obter().resumo_diario(instante)
@@ -0,0 +1,199 @@
+"""
+Cubo de previsões de lotação materializado após o treino.
+
+As features do modelo por linha são discretas (hora, dia da semana, pico,
+rodízio, feriado e evento), exceto a velocidade média, que é amostrada em
+faixas de 5 km/h: só velocidades exatamente na grade são respondidas pelo
+cubo, as demais continuam na inferência ao vivo. O cubo é um array
+float16 (linha x dia x hora x feriado x evento x velocidade) gravado em
+`.npy` ao lado do manifesto e aberto com mmap, identificado pela versão
+do registro que o gerou. Pico, rodízio e código do período vêm da tabela
+semanal do contexto de planejamento (guardada nos metadados); se ela
+mudar, as consultas dessas horas voltam para a inferência ao vivo.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import time
+from datetime import datetime
+from typing import Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+from feature_store import FEATURES_LINHA, build_features
+from registro_modelos import RegistroModelos
+
+
+CUBO_ARQUIVO = "cubo_lotacao.npy"
+CUBO_METADADOS = "cubo_lotacao.json"
+
+VELOCIDADES_CUBO = np.arange(0.0, 65.0, 5.0)  # km/h; fora da grade usa a inferência ao vivo
+DIMENSOES = (7, 24, 2, 2, len(VELOCIDADES_CUBO))  # dia, hora, feriado, evento, velocidade
+
+# Features que o cubo sabe gerar; modelos com outras (ex.: clima) usam inferência ao vivo
+FEATURES_CUBO = set(FEATURES_LINHA)
+
+
+def ajustar_a_grade(velocidades) -> np.ndarray:
+    """
+    Arredonda velocidades médias para o ponto mais próximo de VELOCIDADES_CUBO
+    (passos de 5 km/h, limitados a 0-60), para que a consulta caia no cubo.
+    O erro frente à inferência ao vivo com a velocidade exata é medido em
+    `benchmarks.py cubo`.
+    """
+    passo = VELOCIDADES_CUBO[1] - VELOCIDADES_CUBO[0]
+    grade = np.round(np.asarray(velocidades, dtype=np.float64) / passo) * passo
+    return np.clip(grade, VELOCIDADES_CUBO[0], VELOCIDADES_CUBO[-1])
+
+
+def tabela_semanal() -> pd.DataFrame:
+    """Pico, código do período e rodízio de cada (dia da semana, hora)."""
+    segunda = pd.Timestamp("2024-01-01")  # Uma segunda-feira qualquer
+    momentos = segunda + pd.to_timedelta(np.arange(7 * 24), unit="h")
+    return build_features(pd.DataFrame({"timestamp": momentos}),
+                          ["em_periodo_pico", "periodo_pico_codigo", "rodizio_ativo"])
+
+
+def grade_entradas(features, semana: Optional[pd.DataFrame] = None) -> pd.DataFrame:
+    """Todas as combinações do cubo como entradas do modelo (na ordem do array)."""
+    semana = tabela_semanal() if semana is None else semana
+    dia, hora, feriado, evento, vel = np.meshgrid(
+        np.arange(7), np.arange(24), [0, 1], [0, 1], VELOCIDADES_CUBO, indexing="ij"
+    )
+    dia, hora = dia.ravel(), hora.ravel()
+    slot = dia * 24 + hora
+    valores = {
+        "hora": hora,
+        "dia_semana": dia,
+        "fim_de_semana": (dia >= 5).astype(np.int64),
+        "velocidade_media": vel.ravel(),
+        "em_periodo_pico": semana["em_periodo_pico"].to_numpy()[slot],
+        "periodo_pico_codigo": semana["periodo_pico_codigo"].to_numpy()[slot],
+        "rodizio_ativo": semana["rodizio_ativo"].to_numpy()[slot],
+        "feriado_flag": feriado.ravel(),
+        "tem_evento_relevante": evento.ravel(),
+    }
+    return pd.DataFrame({f: valores[f] for f in features}, columns=list(features))
+
+
+def construir_cubo(registro: RegistroModelos, modelos: Optional[Dict] = None) -> Optional[str]:
+    """
+    Materializa as previsões de todas as linhas do registro.
+
+    Linhas cujo artefato não mudou desde o cubo anterior (mesma impressão
+    dos dados) são copiadas dele em vez de previstas de novo. `modelos`
+    (linha -> regressor recém-treinado, ainda em memória) evita avaliar a
+    grade inteira pela floresta plana, feita para lotes pequenos; as
+    previsões são as mesmas.
+    Retorna o caminho do cubo, ou None se as features não forem discretas.
+    """
+    features = registro.features
+    if not set(features) <= FEATURES_CUBO:
+        print(f"⚠️ Cubo de lotação não gerado: features contínuas {sorted(set(features) - FEATURES_CUBO)}")
+        return None
+
+    inicio = time.perf_counter()
+    semana = tabela_semanal()
+    entradas = grade_entradas(features, semana)
+    linhas = registro.linhas()
+    anterior = CuboLotacao.carregar(registro.caminho)
+    reaproveitar = (
+        anterior is not None
+        and anterior.metadados.get("features") == list(features)
+        and anterior.semana.equals(semana)
+    )
+
+    cubo = np.empty((len(linhas),) + DIMENSOES, dtype=np.float16)
+    impressoes: Dict[str, Optional[str]] = {}
+    previstas = sem_modelo = 0
+    for i, linha in enumerate(linhas):
+        impressao = (registro.metadados(linha) or {}).get("impressao")
+        impressoes[linha] = impressao
+        if reaproveitar and impressao and anterior.metadados["impressoes"].get(linha) == impressao:
+            cubo[i] = anterior.cubo[anterior.indice[linha]]
+            continue
+        modelo = (modelos or {}).get(linha) or registro.obter(linha)
+        if modelo is None:
+            cubo[i] = np.nan
+            sem_modelo += 1
+            continue
+        cubo[i] = modelo.predict(entradas).reshape(DIMENSOES)
+        previstas += 1
+
+    destino = os.path.join(registro.caminho, CUBO_ARQUIVO)
+    temporario = destino + ".tmp.npy"
+    np.save(temporario, cubo)
+    os.replace(temporario, destino)
+
+    metadados = {
+        "versao": registro.versao,
+        "features": list(features),
+        "linhas": linhas,
+        "impressoes": impressoes,
+        "velocidades": VELOCIDADES_CUBO.tolist(),
+        "semana": semana.to_dict(orient="list"),
+        "gerado_em": datetime.now().isoformat(timespec="seconds"),
+    }
+    caminho_meta = os.path.join(registro.caminho, CUBO_METADADOS)
+    with open(caminho_meta + ".tmp", "w", encoding="utf-8") as arquivo:
+        json.dump(metadados, arquivo, ensure_ascii=False, indent=2)
+    os.replace(caminho_meta + ".tmp", caminho_meta)
+
+    print(f"🧊 Cubo de lotação: {len(linhas)} linhas ({previstas} previstas, "
+          f"{len(linhas) - previstas - sem_modelo} reaproveitadas, {sem_modelo} sem modelo), "
+          f"{cubo.nbytes / 1024 ** 2:.1f} MB "
+          f"em {time.perf_counter() - inicio:.1f}s")
+    return destino
+
+
+class CuboLotacao:
+    """Cubo aberto com mmap e a consulta vetorizada."""
+
+    def __init__(self, cubo: np.ndarray, metadados: Dict):
+        self.cubo = cubo
+        self.metadados = metadados
+        self.versao = int(metadados.get("versao", -1))
+        self.indice = {linha: i for i, linha in enumerate(metadados["linhas"])}
+        # Tabela semanal (pico, código do período, rodízio) usada ao gerar o cubo
+        self.semana = pd.DataFrame(metadados.get("semana", {}), dtype=np.int64)
+
+    @classmethod
+    def carregar(cls, caminho: str) -> Optional["CuboLotacao"]:
+        try:
+            with open(os.path.join(caminho, CUBO_METADADOS), "r", encoding="utf-8") as arquivo:
+                metadados = json.load(arquivo)
+            cubo = np.load(os.path.join(caminho, CUBO_ARQUIVO), mmap_mode="r")
+        except (OSError, ValueError):
+            return None
+        linhas = len(metadados.get("linhas", []))
+        if cubo.shape != (linhas,) + DIMENSOES or len(metadados.get("semana", {}).get("rodizio_ativo", [])) != 7 * 24:
+            return None
+        return cls(cubo, metadados)
+
+    def contexto_valido(self, dias, horas, entradas: pd.DataFrame) -> np.ndarray:
+        """Pico/rodízio das entradas ainda batem com a tabela usada no cubo?"""
+        slot = np.asarray(dias) * 24 + np.asarray(horas)
+        colunas = [c for c in self.semana.columns if c in entradas.columns]
+        return (self.semana[colunas].to_numpy()[slot] == entradas[colunas].to_numpy()).all(axis=1)
+
+    def consultar(self, linhas, dias, horas, feriados, eventos, velocidades) -> np.ndarray:
+        """
+        Lotação para cada posição: NaN onde a linha não está no cubo (ou não
+        tinha artefato ao gerá-lo) e onde a velocidade cai fora da grade.
+        """
+        idx = np.array([self.indice.get(l, -1) for l in linhas], dtype=np.int64)
+        velocidades = np.broadcast_to(np.asarray(velocidades, dtype=np.float64), idx.shape)
+        faixa = np.searchsorted(VELOCIDADES_CUBO, velocidades)
+        faixa = np.minimum(faixa, len(VELOCIDADES_CUBO) - 1)
+        saida = np.full(len(idx), np.nan)
+        ok = (idx >= 0) & (VELOCIDADES_CUBO[faixa] == velocidades)
+        if not ok.any():
+            return saida
+
+        chave = (idx[ok], np.asarray(dias)[ok], np.asarray(horas)[ok],
+                 np.broadcast_to(feriados, idx.shape)[ok], np.broadcast_to(eventos, idx.shape)[ok], faixa[ok])
+        saida[ok] = self.cubo[chave].astype(np.float64)
+        return saida
@@ -0,0 +1,238 @@
+"""
+Modo daemon do coletor SPTrans.
+
+Mantém uma única sessão autenticada durante toda a execução (novo login
+apenas quando a API responde 401) e consulta /Posicao em intervalos
+configuráveis com jitter. Os ciclos nunca se sobrepõem: o próximo só é
+agendado depois que o anterior termina.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import random
+import time
+from collections import deque
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta
+from typing import Deque, List, Optional
+
+import requests
+
+from coleta_sptrans import (
+    TOKEN_SPTRANS,
+    atualizar_estado_veiculos,
+    autenticar_sptrans,
+    buscar_posicoes,
+    enriquecer_e_salvar,
+)
+from contexto_planejamento import provedor_contexto
+from estado_veiculos import EstadoVeiculos
+from historico_posicoes import HistoricoPosicoes
+
+
+@dataclass
+class TempoCiclo:
+    """Métricas de um ciclo de coleta (tempos em segundos)."""
+
+    ciclo: int
+    inicio: datetime
+    login_s: float
+    requisicao_s: float
+    processamento_s: float
+    total_s: float
+    veiculos: int
+    status: str
+
+
+class DaemonColeta:
+    """Coletor contínuo baseado em asyncio."""
+
+    def __init__(
+        self,
+        token: str = TOKEN_SPTRANS,
+        intervalo_s: float = 20.0,
+        jitter_s: float = 2.0,
+        salvar_estado_a_cada: int = 5,
+        max_tempos: int = 500,
+        atualizar_arima: bool = False,
+    ):
+        if jitter_s >= intervalo_s:
+            raise ValueError("O jitter precisa ser menor que o intervalo de coleta.")
+
+        self.token = token
+        self.intervalo_s = intervalo_s
+        self.jitter_s = jitter_s
+        self.salvar_estado_a_cada = salvar_estado_a_cada
+        self.atualizar_arima = atualizar_arima
+        self._hora_arima: Optional[datetime] = None
+        self._hora_compactacao: Optional[datetime] = None
+        self.session: Optional[requests.Session] = None
+        self.estado = EstadoVeiculos.carregar()
+        self.tempos: Deque[TempoCiclo] = deque(maxlen=max_tempos)
+        self._ciclo = 0
+        self._parar: Optional[asyncio.Event] = None
+
+    async def _autenticar(self) -> float:
+        """Autentica (reaproveitando a sessão HTTP) e retorna o tempo gasto."""
+        inicio = time.perf_counter()
+        self.session = await asyncio.to_thread(autenticar_sptrans, self.token, self.session)
+        return time.perf_counter() - inicio
+
+    async def _buscar(self):
+        """Consulta /Posicao; em caso de 401 refaz o login e tenta uma vez mais."""
+        login_s = 0.0
+        if self.session is None:
+            login_s += await self._autenticar()
+            if self.session is None:
+                return login_s, 0.0, "falha_login", None
+
+        inicio = time.perf_counter()
+        status, df = await asyncio.to_thread(buscar_posicoes, self.session)
+        relogin_s = 0.0
+
+        if status == 401:
+            print("   🔑 Sessão expirada, autenticando novamente...")
+            relogin_s = await self._autenticar()
+            if self.session is None:
+                return login_s + relogin_s, time.perf_counter() - inicio - relogin_s, "falha_login", None
+            status, df = await asyncio.to_thread(buscar_posicoes, self.session)
+
+        requisicao_s = time.perf_counter() - inicio - relogin_s
+        return login_s + relogin_s, requisicao_s, "ok" if status == 200 else f"http_{status}", df
+
+    def _processar(self, df) -> None:
+        df = atualizar_estado_veiculos(df, self.estado)
+        if self._ciclo % self.salvar_estado_a_cada == 0:
+            self.estado.salvar()
+        enriquecer_e_salvar(df)
+        self._compactar_historico()
+        if self.atualizar_arima:
+            self._atualizar_previsoes_arima()
+
+    def _compactar_historico(self) -> None:
+        """A cada hora nova, compacta as partições fora da janela dos leitores."""
+        hora = datetime.now().replace(minute=0, second=0, microsecond=0)
+        if hora == self._hora_compactacao:
+            return
+        try:
+            compactadas = HistoricoPosicoes().compactar(desde=hora - timedelta(days=1))
+            if compactadas:
+                print(f"   🗜️ {compactadas} partições do histórico compactadas")
+        except OSError as e:
+            print(f"   ⚠️ Falha ao compactar o histórico: {e}")
+        self._hora_compactacao = hora
+
+    def _atualizar_previsoes_arima(self) -> None:
+        """A cada hora nova, passa as horas coletadas pelo filtro do ARIMA."""
+        hora = datetime.now().replace(minute=0, second=0, microsecond=0)
+        if hora == self._hora_arima:
+            return
+        from modelo_arima_rf import atualizar_previsoes_arima
+
+        try:
+            atualizar_previsoes_arima()
+        except Exception as e:
+            print(f"   ⚠️ Falha ao atualizar as previsões ARIMA: {e}")
+        self._hora_arima = hora
+
+    async def executar_ciclo(self) -> TempoCiclo:
+        """Executa um ciclo completo: consulta, estado dos veículos e gravação."""
+        self._ciclo += 1
+        inicio_ciclo = datetime.now()
+        inicio = time.perf_counter()
+
+        try:
+            login_s, requisicao_s, status, df = await self._buscar()
+        except (requests.RequestException, ValueError) as e:
+            print(f"   ⚠️ Erro na consulta: {e}")
+            login_s, requisicao_s, status, df = 0.0, time.perf_counter() - inicio, "erro_rede", None
+
+        processamento_s = 0.0
+        veiculos = 0
+        if df is not None and len(df) > 0:
+            inicio_proc = time.perf_counter()
+            try:
+                await asyncio.to_thread(self._processar, df)
+                veiculos = len(df)
+            except Exception as e:
+                print(f"   ❌ Erro ao processar ciclo: {e}")
+                status = "erro_processamento"
+            processamento_s = time.perf_counter() - inicio_proc
+
+        tempo = TempoCiclo(
+            ciclo=self._ciclo,
+            inicio=inicio_ciclo,
+            login_s=login_s,
+            requisicao_s=requisicao_s,
+            processamento_s=processamento_s,
+            total_s=time.perf_counter() - inicio,
+            veiculos=veiculos,
+            status=status,
+        )
+        self.tempos.append(tempo)
+        print(
+            f"🔁 Ciclo {tempo.ciclo}: {tempo.status} | {tempo.veiculos} veículos | "
+            f"login {tempo.login_s:.2f}s, requisição {tempo.requisicao_s:.2f}s, "
+            f"processamento {tempo.processamento_s:.2f}s, total {tempo.total_s:.2f}s"
+        )
+        return tempo
+
+    def _proximo_intervalo(self) -> float:
+        return self.intervalo_s + random.uniform(-self.jitter_s, self.jitter_s)
+
+    async def executar(self, max_ciclos: Optional[int] = None) -> None:
+        """Loop principal; termina após `max_ciclos` ou quando `parar()` é chamado."""
+        self._parar = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        provedor_contexto().iniciar()
+
+        while not self._parar.is_set():
+            proximo = loop.time() + self._proximo_intervalo()
+            await self.executar_ciclo()
+
+            if max_ciclos is not None and self._ciclo >= max_ciclos:
+                break
+
+            # Se o ciclo passou do intervalo, o próximo começa imediatamente
+            espera = max(0.0, proximo - loop.time())
+            try:
+                await asyncio.wait_for(self._parar.wait(), timeout=espera)
+            except asyncio.TimeoutError:
+                pass
+
+        self.estado.salvar()
+
+    def parar(self) -> None:
+        if self._parar is not None:
+            self._parar.set()
+
+    def resumo_tempos(self) -> List[dict]:
+        """Retorna as métricas dos últimos ciclos como lista de dicts."""
+        return [asdict(tempo) for tempo in self.tempos]
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Coletor contínuo da API SPTrans")
+    parser.add_argument("--intervalo", type=float, default=20.0, help="Segundos entre ciclos")
+    parser.add_argument("--jitter", type=float, default=2.0, help="Variação aleatória (±s)")
+    parser.add_argument("--ciclos", type=int, default=None, help="Encerrar após N ciclos")
+    parser.add_argument("--atualizar-arima", action="store_true",
+                        help="Atualizar as previsões ARIMA (filtro incremental) a cada hora")
+    args = parser.parse_args(argv)
+
+    print("🚌 Iniciando coletor contínuo SPTrans...")
+    print(f"   ⏱️ Intervalo: {args.intervalo:.0f}s ± {args.jitter:.0f}s")
+
+    daemon = DaemonColeta(intervalo_s=args.intervalo, jitter_s=args.jitter,
+                          atualizar_arima=args.atualizar_arima)
+    try:
+        asyncio.run(daemon.executar(max_ciclos=args.ciclos))
+    except KeyboardInterrupt:
+        daemon.estado.salvar()
+        print("\n🛑 Coletor encerrado")
+
+
+if __name__ == "__main__":
+    main()
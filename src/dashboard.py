@@ -4,19 +4,23 @@ import plotly.graph_objects as go
 import pandas as pd
 import numpy as np
 import os
-import joblib
 from datetime import datetime, timedelta
 
+from cubo_lotacao import ajustar_a_grade
+from historico_posicoes import HistoricoPosicoes
+from previsao_lotacao import PrevisorLotacao
+from registro_modelos import RegistroModelos
+
 # Importações de contexto e clima
 try:
-    from contexto_planejamento import obter_resumo_contexto
+    from contexto_planejamento import obter_resumo_contexto, provedor_contexto
     CONTEXTO_DISPONIVEL = True
 except ImportError:
     CONTEXTO_DISPONIVEL = False
     print("⚠️ Módulo contexto_planejamento não encontrado")
 
 try:
-    from clima_openmeteo import obter_resumo_clima
+    from clima_openmeteo import ClimaOpenMeteo, obter_resumo_clima
     CLIMA_DISPONIVEL = True
 except ImportError:
     CLIMA_DISPONIVEL = False
@@ -30,13 +34,15 @@ except ImportError:
     print("⚠️ Módulo NLP não encontrado. Usando chat básico.")
     NLP_DISPONIVEL = False
 
-# Carregar dados
+# Carregar dados (apenas o snapshot mais recente do histórico)
+COLUNAS_DASHBOARD = ['linha', 'velocidade', 'lat', 'lon', 'timestamp']
 try:
-    df = pd.read_csv('dados/dados_onibus.csv')
-    df['timestamp'] = pd.to_datetime(df['timestamp'])
-    print("✅ Dados carregados do CSV")
+    df = HistoricoPosicoes().ultimo_snapshot(colunas=COLUNAS_DASHBOARD)
+    if len(df) == 0:
+        raise ValueError("histórico vazio")
+    print("✅ Dados carregados do histórico")
 except Exception as e:
-    print(f"⚠️ Erro ao carregar CSV: {e}")
+    print(f"⚠️ Erro ao carregar histórico: {e}")
     # Dados de exemplo se falhar
     np.random.seed(42)
     df = pd.DataFrame({
@@ -48,21 +54,18 @@ except Exception as e:
     })
     print("⚠️ Usando dados de exemplo")
 
-# Carregar modelo ML
-try:
-    modelo = joblib.load('dados/modelo_final.pkl')
-    features = joblib.load('dados/features_finais.pkl')
-    print("✅ Modelo ML carregado")
-    ML_DISPONIVEL = True
-except:
-    modelo = None
-    features = None
-    ML_DISPONIVEL = False
+# Registro de modelos por linha (carregados sob demanda, não na inicialização)
+registro_modelos = RegistroModelos()
+ML_DISPONIVEL = len(registro_modelos) > 0
+if ML_DISPONIVEL:
+    print(f"✅ Registro de modelos: {len(registro_modelos)} linhas (versão {registro_modelos.versao})")
+else:
     print("⚠️ Modelo ML não disponível")
+previsor_lotacao = PrevisorLotacao(registro_modelos)
 
 # Inicializar chatbot NLP
 if NLP_DISPONIVEL and ML_DISPONIVEL:
-    chatbot = ChatbotNLP(modelo_ml=modelo, features=features, df_onibus=df)
+    chatbot = ChatbotNLP(registro=registro_modelos, df_onibus=df)
 else:
     chatbot = None
     
@@ -83,59 +86,28 @@ LOCAIS_SP = {
 }
 
 # Funções auxiliares
-def calcular_lotacao_prevista(hora, dia_semana=None, linha=None):
+def prever_lotacao_lote(horas, dias_semana=None, linhas=None):
     """
-    Calcula previsão de lotação baseada em padrões históricos
+    Previsão de lotação em lote (uma chamada ao modelo de cada linha)
     NOTA: API SPTrans não fornece dados de ocupação em tempo real
     """
-    if modelo and features:
-        try:
-            if dia_semana is None:
-                dia_semana = datetime.now().weekday()
-            
-            # Calcular velocidade média baseada na linha, se fornecida
-            if linha and linha in df['linha'].values:
-                vel_media = df[df['linha'] == linha]['velocidade'].mean()
-            else:
-                vel_media = 30
-            
-            previsao_df = pd.DataFrame([[hora, dia_semana, vel_media]], columns=features)
-            previsao = modelo.predict(previsao_df)[0]
-            variacao = np.random.normal(0, 3)
-            return max(10, min(100, previsao + variacao))
-        except Exception as e:
-            pass
-    
-    # Predição baseada em padrões conhecidos de SP (fallback)
-    if dia_semana is None:
-        dia_semana = datetime.now().weekday()
-    
-    # Fim de semana tem menos lotação
-    fator_fds = 0.7 if dia_semana >= 5 else 1.0
-    
-    # Horários de pico
-    if 7 <= hora <= 9:
-        return int(85 * fator_fds)
-    elif 17 <= hora <= 19:
-        return int(80 * fator_fds)
-    elif 12 <= hora <= 14:
-        return int(65 * fator_fds)
-    elif 5 <= hora <= 7:
-        return int(60 * fator_fds)
-    elif 20 <= hora <= 22:
-        return int(55 * fator_fds)
-    else:
-        return int(40 * fator_fds)
+    velocidades = 30.0
+    if linhas is not None:
+        # Velocidade média atual de cada linha, arredondada para a grade do cubo
+        # (erro frente ao ao vivo: médio ~1.2, máximo ~4.5 pontos de lotação)
+        velocidades = ajustar_a_grade(pd.Series(np.asarray(linhas, dtype=object)).map(
+            df.groupby('linha')['velocidade'].mean()).fillna(30).to_numpy())
+    return previsor_lotacao.prever(horas, dias_semana, linhas, velocidades)
 
 def gerar_previsao_diaria():
     """Gera previsão de lotação para o dia inteiro"""
     horas = list(range(6, 24))
     dia_semana = datetime.now().weekday()
     
+    lotacoes = np.clip(prever_lotacao_lote(horas, dia_semana).lotacao, 10, 100)
+    
     previsoes = []
-    for h in horas:
-        lotacao = calcular_lotacao_prevista(h, dia_semana)
-        lotacao = max(10, min(100, lotacao))
+    for h, lotacao in zip(horas, lotacoes):
         
         if lotacao > 85:
             status = 'Lotado'
@@ -167,10 +139,11 @@ def calcular_lotacao_por_linha(hora_atual):
         '501U-10': {'multiplicador': 1.1, 'base': 3}
     }
     
+    lotacoes_base = prever_lotacao_lote(hora_atual, dia_semana, linhas).lotacao
+    
     ocupacao_data = []
-    for linha in linhas:
+    for linha, lotacao_base in zip(linhas, lotacoes_base):
         perfil = perfis_linha.get(linha, {'multiplicador': 1.0, 'base': 0})
-        lotacao_base = calcular_lotacao_prevista(hora_atual, dia_semana, linha)
         lotacao = lotacao_base * perfil['multiplicador'] + perfil['base']
         lotacao = max(15, min(100, lotacao))
         
@@ -189,16 +162,15 @@ def otimizar_rota_por_local(origem_nome, destino_nome):
     origem_lat, origem_lon = LOCAIS_SP[origem_nome]
     destino_lat, destino_lon = LOCAIS_SP[destino_nome]
     
-    linhas = df['linha'].unique()
+    velocidades = df.groupby('linha')['velocidade'].mean()
     hora_atual = datetime.now().hour
+    # Lotação geral da hora (sem modelo de linha), a mesma para todas as rotas
+    lotacao = float(prever_lotacao_lote([hora_atual]).lotacao[0])
     
     resultados = []
-    for linha in linhas:
-        df_linha = df[df['linha'] == linha]
-        vel_media = df_linha['velocidade'].mean()
+    for linha, vel_media in velocidades.items():
         distancia = np.sqrt((destino_lat - origem_lat)**2 + (destino_lon - origem_lon)**2) * 111
         tempo_base = (distancia / vel_media) * 60 if vel_media > 0 else 999
-        lotacao = calcular_lotacao_prevista(hora_atual)
         fator_lotacao = 1.0 + (lotacao - 50) / 200
         tempo_estimado = tempo_base * fator_lotacao
         
@@ -383,16 +355,17 @@ def atualizar_mapa_e_stats(contador):
     hora_atual = datetime.now().hour
     dia_semana = datetime.now().weekday()
     
-    # Calcular lotação base por linha
-    df_map['lotacao_base'] = df_map['linha'].apply(
-        lambda linha: calcular_lotacao_prevista(hora_atual, dia_semana, linha)
-    )
+    # Calcular lotação base por linha (todos os veículos em lote)
+    previsao = prever_lotacao_lote(hora_atual, dia_semana, df_map['linha'].to_numpy())
+    df_map['lotacao_base'] = previsao.lotacao
+    df_map['estimativa'] = previsao.heuristica
     
     # Adicionar variação individual por veículo baseada em velocidade
     # Veículos mais lentos tendem a estar mais cheios
     velocidade_media = df_map['velocidade'].mean()
-    df_map['fator_velocidade'] = df_map['velocidade'].apply(
-        lambda v: -10 if v < velocidade_media * 0.7 else 10 if v > velocidade_media * 1.3 else 0
+    df_map['fator_velocidade'] = np.select(
+        [df_map['velocidade'] < velocidade_media * 0.7, df_map['velocidade'] > velocidade_media * 1.3],
+        [-10, 10], default=0
     )
     
     # Adicionar variação aleatória pequena para simular realismo
@@ -436,7 +409,7 @@ def atualizar_mapa_e_stats(contador):
                     opacity=0.7,
                     sizemode='diameter'
                 ),
-                text=df_cor.apply(lambda row: f"Linha: {row['linha']}<br>Lotação: {row['lotacao']:.0f}%<br>Velocidade: {row['velocidade']:.1f} km/h", axis=1),
+                text=df_cor.apply(lambda row: f"Linha: {row['linha']}<br>Lotação: {row['lotacao']:.0f}%{' (estimativa por horário)' if row['estimativa'] else ''}<br>Velocidade: {row['velocidade']:.1f} km/h", axis=1),
                 hoverinfo='text',
                 name=label,
                 showlegend=True
@@ -573,9 +546,7 @@ def atualizar_velocidade_eficiencia(n):
         )
         
         # Calcular lotação individual por linha
-        df_vel['lotacao'] = df_vel['linha'].apply(
-            lambda linha: calcular_lotacao_prevista(hora_atual, dia_semana, linha)
-        )
+        df_vel['lotacao'] = prever_lotacao_lote(hora_atual, dia_semana, df_vel['linha'].to_numpy()).lotacao
         
     except Exception as e:
         print(f"❌ Erro no gráfico de velocidade: {e}")
@@ -673,10 +644,11 @@ def atualizar_ocupacao(n):
     
     ocupacao_data = []
     
+    # Lotação base de cada linha, em lote
+    lotacoes_base = prever_lotacao_lote(hora_atual, dia_semana, linhas_top).lotacao
+    
     # Calcular lotação individual para cada linha
-    for linha in linhas_top:
-        # Lotação base por linha
-        lotacao_base = calcular_lotacao_prevista(hora_atual, dia_semana, linha)
+    for linha, lotacao_base in zip(linhas_top, lotacoes_base):
         
         # Adicionar pequena variação
         variacao = np.random.randint(-3, 3)
@@ -1017,4 +989,9 @@ if __name__ == '__main__':
     print("🌤️ Clima:", "Ativo ✅" if CLIMA_DISPONIVEL else "Desativado ⚠️")
     print("="*60)
     
+    if CONTEXTO_DISPONIVEL:
+        provedor_contexto().iniciar()  # Recarrega o JSON de contexto sem reiniciar
+    if CLIMA_DISPONIVEL:
+        ClimaOpenMeteo.obter().iniciar_atualizacao_periodica()  # Callbacks nunca esperam pela API
+    
     app.run(debug=True, port=8050)
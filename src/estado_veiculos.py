@@ -0,0 +1,198 @@
+"""
+Armazenamento em memória do estado recente de cada veículo.
+
+Cada veículo (identificado pelo prefixo `p` da API Olho Vivo) guarda suas
+últimas K posições em um buffer circular pré-alocado. A atualização de um
+ciclo de coleta custa O(veículos) e a memória fica limitada pelo tamanho da
+frota ativa, pois veículos sem sinal há muito tempo são descartados.
+"""
+
+from __future__ import annotations
+
+import os
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+
+BASE_PATH = os.path.dirname(os.path.dirname(__file__))
+ESTADO_PATH = os.path.join(BASE_PATH, "dados", "estado_veiculos.npz")
+
+NS_POR_SEGUNDO = 1_000_000_000
+
+
+class EstadoVeiculos:
+    """
+    Buffer circular de posições por veículo.
+
+    Os dados ficam em matrizes (capacidade x K); cada veículo ocupa uma
+    linha (slot) e `_cabeca` aponta para a próxima posição de escrita.
+    """
+
+    def __init__(
+        self,
+        k: int = 8,
+        capacidade_inicial: int = 1024,
+        max_inativo_s: float = 6 * 3600,
+    ):
+        if k < 2:
+            raise ValueError("O buffer precisa guardar ao menos 2 posições por veículo.")
+
+        self.k = k
+        self.max_inativo_s = max_inativo_s
+        self._indice: Dict[str, int] = {}
+        self._alocar(capacidade_inicial)
+        self._livres: List[int] = list(range(capacidade_inicial - 1, -1, -1))
+
+    def _alocar(self, capacidade: int) -> None:
+        self._capacidade = capacidade
+        self._prefixos = np.full(capacidade, "", dtype=object)
+        self._linhas = np.full(capacidade, "", dtype=object)
+        self._lat = np.full((capacidade, self.k), np.nan)
+        self._lon = np.full((capacidade, self.k), np.nan)
+        self._ts = np.zeros((capacidade, self.k), dtype=np.int64)
+        self._cabeca = np.zeros(capacidade, dtype=np.int64)
+        self._contagem = np.zeros(capacidade, dtype=np.int64)
+
+    def _crescer(self, minimo: int) -> None:
+        """Dobra a capacidade das matrizes preservando os slots existentes."""
+        antiga = self._capacidade
+        nova = max(antiga * 2, minimo)
+        arrays = {
+            nome: getattr(self, nome)
+            for nome in ("_prefixos", "_linhas", "_lat", "_lon", "_ts", "_cabeca", "_contagem")
+        }
+        self._alocar(nova)
+        for nome, valores in arrays.items():
+            getattr(self, nome)[:antiga] = valores
+        self._livres.extend(range(nova - 1, antiga - 1, -1))
+
+    def __len__(self) -> int:
+        return len(self._indice)
+
+    def _slots_para(self, prefixos: np.ndarray) -> np.ndarray:
+        """Resolve (ou aloca) o slot de cada prefixo."""
+        novos = [p for p in prefixos if p not in self._indice]
+        if len(novos) > len(self._livres):
+            self._crescer(len(self._indice) + len(novos))
+
+        for prefixo in novos:
+            slot = self._livres.pop()
+            self._indice[prefixo] = slot
+            self._prefixos[slot] = prefixo
+            self._contagem[slot] = 0
+            self._cabeca[slot] = 0
+
+        return np.fromiter((self._indice[p] for p in prefixos), dtype=np.int64, count=len(prefixos))
+
+    def atualizar(self, df: pd.DataFrame, coluna_tempo: str = "timestamp") -> None:
+        """
+        Registra as posições de um ciclo de coleta.
+
+        Espera as colunas `prefixo`, `linha`, `lat`, `lon` e a coluna de tempo.
+        """
+        if df is None or len(df) == 0:
+            return
+
+        df = df.drop_duplicates(subset="prefixo", keep="last")
+        prefixos = df["prefixo"].astype(str).to_numpy()
+        slots = self._slots_para(prefixos)
+
+        tempos = pd.to_datetime(df[coluna_tempo]).to_numpy(dtype="datetime64[ns]").view(np.int64)
+        pos = self._cabeca[slots]
+
+        self._lat[slots, pos] = df["lat"].to_numpy(dtype=np.float64)
+        self._lon[slots, pos] = df["lon"].to_numpy(dtype=np.float64)
+        self._ts[slots, pos] = tempos
+        self._linhas[slots] = df["linha"].astype(str).to_numpy()
+        self._cabeca[slots] = (pos + 1) % self.k
+        self._contagem[slots] = np.minimum(self._contagem[slots] + 1, self.k)
+
+        self._descartar_inativos(int(tempos.max()))
+
+    def _descartar_inativos(self, referencia_ns: int) -> None:
+        """Libera os slots de veículos sem atualização há mais de `max_inativo_s`."""
+        ultimos = self._ts[np.arange(self._capacidade), (self._cabeca - 1) % self.k]
+        limite = referencia_ns - int(self.max_inativo_s * NS_POR_SEGUNDO)
+        inativos = np.flatnonzero((self._contagem > 0) & (ultimos < limite))
+
+        for slot in inativos:
+            del self._indice[self._prefixos[slot]]
+            self._prefixos[slot] = ""
+            self._contagem[slot] = 0
+            self._livres.append(int(slot))
+
+    def ultimas_posicoes(self) -> pd.DataFrame:
+        """Retorna a posição mais recente de cada veículo ativo."""
+        slots = np.flatnonzero(self._contagem > 0)
+        pos = (self._cabeca[slots] - 1) % self.k
+        return pd.DataFrame({
+            "prefixo": self._prefixos[slots].astype(str),
+            "linha": self._linhas[slots].astype(str),
+            "lat": self._lat[slots, pos],
+            "lon": self._lon[slots, pos],
+            "timestamp": self._ts[slots, pos].astype("datetime64[ns]"),
+        })
+
+    def historico(self, prefixo: str) -> Optional[pd.DataFrame]:
+        """Retorna as posições guardadas de um veículo, da mais antiga à mais recente."""
+        slot = self._indice.get(str(prefixo))
+        if slot is None:
+            return None
+
+        n = self._contagem[slot]
+        ordem = (self._cabeca[slot] - n + np.arange(n)) % self.k
+        return pd.DataFrame({
+            "lat": self._lat[slot, ordem],
+            "lon": self._lon[slot, ordem],
+            "timestamp": self._ts[slot, ordem].astype("datetime64[ns]"),
+        })
+
+    def salvar(self, caminho: str = ESTADO_PATH) -> None:
+        """Grava um snapshot compacto (apenas slots ativos) em formato .npz."""
+        slots = np.flatnonzero(self._contagem > 0)
+        # Reordena cada buffer para que a posição 0 seja a mais antiga
+        ordem = (self._cabeca[slots, None] - self._contagem[slots, None]
+                 + np.arange(self.k)) % self.k
+
+        os.makedirs(os.path.dirname(caminho), exist_ok=True)
+        temporario = caminho + ".tmp.npz"
+        np.savez(
+            temporario,
+            k=self.k,
+            max_inativo_s=self.max_inativo_s,
+            prefixos=self._prefixos[slots].astype(str),
+            linhas=self._linhas[slots].astype(str),
+            lat=np.take_along_axis(self._lat[slots], ordem, axis=1),
+            lon=np.take_along_axis(self._lon[slots], ordem, axis=1),
+            ts=np.take_along_axis(self._ts[slots], ordem, axis=1),
+            contagem=self._contagem[slots],
+        )
+        os.replace(temporario, caminho)
+
+    @classmethod
+    def carregar(cls, caminho: str = ESTADO_PATH, k: Optional[int] = None) -> "EstadoVeiculos":
+        """Restaura um snapshot; retorna um estado vazio se o arquivo não existir."""
+        if not os.path.exists(caminho):
+            return cls(k=k or 8)
+
+        with np.load(caminho) as dados:
+            k_arquivo = int(dados["k"])
+            estado = cls(
+                k=k_arquivo,
+                capacidade_inicial=max(1024, len(dados["prefixos"])),
+                max_inativo_s=float(dados["max_inativo_s"]),
+            )
+            n = len(dados["prefixos"])
+            estado._livres = list(range(estado._capacidade - 1, n - 1, -1))
+            estado._prefixos[:n] = dados["prefixos"].astype(object)
+            estado._linhas[:n] = dados["linhas"].astype(object)
+            estado._lat[:n] = dados["lat"]
+            estado._lon[:n] = dados["lon"]
+            estado._ts[:n] = dados["ts"]
+            estado._contagem[:n] = dados["contagem"]
+            estado._cabeca[:n] = dados["contagem"] % k_arquivo
+            estado._indice = {p: i for i, p in enumerate(estado._prefixos[:n])}
+
+        return estado
@@ -0,0 +1,234 @@
+"""
+Feature store compartilhado entre treino e serviço.
+
+`build_features(frame)` é o único ponto de entrada para montar as entradas
+dos modelos: calendário, contexto de planejamento, velocidade e clima são
+calculados de forma vetorizada a partir do `timestamp` (e das colunas de
+velocidade/clima, quando existirem) e devolvidos sempre com as mesmas
+colunas e tipos, na ordem pedida. As tabelas de features de treino são
+persistidas em Parquet com a versão do schema nos metadados, e um arquivo
+de outra versão é ignorado em vez de ser lido com colunas incompatíveis.
+"""
+
+from __future__ import annotations
+
+import os
+import zlib
+from typing import Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from contexto_planejamento import ContextoPlanejamento
+
+
+BASE_PATH = os.path.dirname(os.path.dirname(__file__))
+FEATURES_PATH = os.path.join(BASE_PATH, "dados", "features")
+
+CACHE_MAXIMO = 4  # Tabelas de features mantidas em cache (as mais recentes)
+
+# v2: periodo_pico_codigo mapeia os nomes do contexto ('manhã', ...) e a
+# velocidade passa a se chamar sempre velocidade_media
+VERSAO_SCHEMA = 2
+
+# Nomes dos períodos de pico no contexto (e os nomes antigos em inglês)
+MAPA_PERIODOS = {
+    "manhã": 1, "meio dia": 2, "tarde": 3,
+    "morning": 1, "midday": 2, "afternoon": 3,
+}
+
+VELOCIDADE_PADRAO = 30.0  # km/h quando não há velocidade observada
+PADROES_CLIMA = {
+    "temperatura": 22.0,
+    "umidade": 65.0,
+    "precipitacao": 0.0,
+}
+LIMITES_TEMPERATURA = [15, 20, 25, 30]
+
+FEATURES_CALENDARIO = ["hora", "dia_semana", "fim_de_semana"]
+FEATURES_CONTEXTO = [
+    "em_periodo_pico", "periodo_pico_codigo", "rodizio_ativo", "feriado_flag", "tem_evento_relevante",
+]
+FEATURES_VELOCIDADE = ["velocidade_media"]
+FEATURES_CLIMA = [
+    "temperatura", "umidade", "precipitacao", "tem_chuva", "temperatura_categoria_codigo", "umidade_alta",
+]
+
+# Tipo de cada feature no schema (inteiros para flags/códigos, float para medidas)
+SCHEMA: Dict[str, str] = {
+    **{f: "int64" for f in FEATURES_CALENDARIO + FEATURES_CONTEXTO},
+    "velocidade_media": "float64",
+    "temperatura": "float64",
+    "umidade": "float64",
+    "precipitacao": "float64",
+    "tem_chuva": "int64",
+    "temperatura_categoria_codigo": "int64",
+    "umidade_alta": "int64",
+}
+
+# Features usadas pelo modelo por linha (modelo_arima_rf) e pelo modelo geral (ml_simples)
+FEATURES_LINHA = FEATURES_CALENDARIO + FEATURES_VELOCIDADE + FEATURES_CONTEXTO
+FEATURES_GERAL = FEATURES_LINHA + FEATURES_CLIMA
+
+
+def build_features(frame: pd.DataFrame, features: Optional[Sequence[str]] = None) -> pd.DataFrame:
+    """
+    Monta as features pedidas para cada linha de `frame`.
+
+    Args:
+        frame: Precisa de `timestamp`; usa `velocidade_media` (ou `velocidade`)
+            e as colunas de clima quando existirem, senão os valores padrão
+        features: Colunas desejadas, na ordem do modelo (padrão: todas)
+
+    Returns:
+        DataFrame com exatamente `features`, tipos do schema e o índice de `frame`
+    """
+    features = list(features) if features is not None else list(SCHEMA)
+    desconhecidas = [f for f in features if f not in SCHEMA]
+    if desconhecidas:
+        raise KeyError(f"Features fora do schema v{VERSAO_SCHEMA}: {desconhecidas}")
+
+    pedidas = set(features)
+    ts = pd.to_datetime(frame["timestamp"])
+    saida: Dict[str, np.ndarray] = {}
+
+    if pedidas & set(FEATURES_CALENDARIO):
+        dia_semana = ts.dt.dayofweek.to_numpy()
+        saida["hora"] = ts.dt.hour.to_numpy()
+        saida["dia_semana"] = dia_semana
+        saida["fim_de_semana"] = (dia_semana >= 5).astype(np.int64)
+
+    if pedidas & set(FEATURES_CONTEXTO):
+        # Contexto calculado uma vez por minuto distinto (snapshots repetem o mesmo horário)
+        codigos, distintos = pd.factorize(ts.dt.floor("min"))
+        contexto = ContextoPlanejamento.obter().contexto_em_lote(pd.Series(distintos))
+        saida["em_periodo_pico"] = contexto["em_periodo_pico"].to_numpy()[codigos]
+        saida["periodo_pico_codigo"] = contexto["periodo_pico"].map(MAPA_PERIODOS).fillna(0).to_numpy()[codigos]
+        saida["rodizio_ativo"] = contexto["rodizio_ativo"].to_numpy()[codigos]
+        saida["feriado_flag"] = contexto["feriado_nome"].notna().to_numpy()[codigos]
+        saida["tem_evento_relevante"] = contexto["tem_evento_relevante"].to_numpy()[codigos]
+
+    if "velocidade_media" in pedidas:
+        coluna = "velocidade_media" if "velocidade_media" in frame else "velocidade" if "velocidade" in frame else None
+        velocidade = frame[coluna].to_numpy(np.float64) if coluna else np.full(len(frame), VELOCIDADE_PADRAO)
+        saida["velocidade_media"] = np.where(np.isfinite(velocidade), velocidade, VELOCIDADE_PADRAO)
+
+    if pedidas & set(FEATURES_CLIMA):
+        for coluna, padrao in PADROES_CLIMA.items():
+            valores = frame[coluna].to_numpy(np.float64) if coluna in frame else np.full(len(frame), padrao)
+            saida[coluna] = np.where(np.isnan(valores), padrao, valores)
+        saida["tem_chuva"] = saida["precipitacao"] > 0
+        # <15: 0, 15-20: 1, 20-25: 2, 25-30: 3, >=30: 4
+        saida["temperatura_categoria_codigo"] = np.digitize(saida["temperatura"], LIMITES_TEMPERATURA)
+        saida["umidade_alta"] = saida["umidade"] > 70
+
+    return pd.DataFrame(
+        {f: np.asarray(saida[f]).astype(SCHEMA[f]) for f in features},
+        index=frame.index,
+        columns=features,
+    )
+
+
+def entradas_por_horario(
+    features: Sequence[str],
+    horas: Iterable[int],
+    dias_semana: Iterable[int],
+    velocidades=VELOCIDADE_PADRAO,
+    referencia: Optional[pd.Timestamp] = None,
+) -> pd.DataFrame:
+    """
+    Entradas de serviço para pares hora/dia da semana: cada par vira o
+    próximo instante com esse dia da semana a partir de `referencia` (hoje).
+    """
+    hoje = (referencia or pd.Timestamp.now()).normalize()
+    horas, dias, velocidades = np.broadcast_arrays(
+        np.asarray(horas, dtype=np.int64).reshape(-1),
+        np.asarray(dias_semana, dtype=np.int64),
+        np.asarray(velocidades, dtype=np.float64),
+    )
+    momentos = hoje + pd.to_timedelta((dias - hoje.weekday()) % 7, unit="D") + pd.to_timedelta(horas, unit="h")
+    return build_features(pd.DataFrame({"timestamp": momentos, "velocidade_media": velocidades}), features)
+
+
+# ----------------------------------------------------------------------
+# Persistência
+# ----------------------------------------------------------------------
+def salvar_features(tabela: pd.DataFrame, caminho: str) -> None:
+    """Grava a tabela de features com a versão do schema nos metadados."""
+    os.makedirs(os.path.dirname(caminho), exist_ok=True)
+    arrow = pa.Table.from_pandas(tabela, preserve_index=False)
+    arrow = arrow.replace_schema_metadata({
+        **(arrow.schema.metadata or {}),
+        b"versao_features": str(VERSAO_SCHEMA).encode(),
+    })
+    temporario = caminho + ".tmp"
+    pq.write_table(arrow, temporario, compression="zstd")
+    os.replace(temporario, caminho)
+
+
+def carregar_features(caminho: str, colunas: Optional[List[str]] = None) -> Optional[pd.DataFrame]:
+    """Lê a tabela de features (None se ausente ou de outra versão do schema)."""
+    try:
+        metadados = pq.read_schema(caminho).metadata or {}
+    except (OSError, pa.ArrowInvalid):
+        return None
+    if metadados.get(b"versao_features") != str(VERSAO_SCHEMA).encode():
+        return None
+    return pq.read_table(caminho, columns=colunas).to_pandas()
+
+
+def features_em_cache(
+    df: pd.DataFrame,
+    features: Sequence[str],
+    diretorio: str = FEATURES_PATH,
+) -> pd.DataFrame:
+    """
+    `df` com as features, calculadas uma única vez por conjunto de dados e
+    versão do schema (Parquet identificado por um hash das colunas de entrada).
+    """
+    entradas = [c for c in ("linha", "timestamp", "velocidade_media", "velocidade", *PADROES_CLIMA) if c in df.columns]
+    valores = pd.util.hash_pandas_object(df[entradas], index=False).to_numpy().tobytes()
+    chave = zlib.crc32(",".join(features).encode(), zlib.crc32(valores))
+    nome = f"features-v{VERSAO_SCHEMA}-{chave:08x}-{len(df)}.parquet"
+    caminho = os.path.join(diretorio, nome)
+
+    tabela = carregar_features(caminho, list(features))
+    if tabela is None or len(tabela) != len(df):
+        tabela = build_features(df, features).reset_index(drop=True)
+        salvar_features(tabela, caminho)
+        podar_cache(diretorio)
+    else:
+        os.utime(caminho)  # Marca como usada (a poda mantém as mais recentes)
+
+    resto = df.drop(columns=[f for f in features if f in df.columns]).reset_index(drop=True)
+    return pd.concat([resto, tabela], axis=1)
+
+
+def podar_cache(diretorio: str = FEATURES_PATH, manter: int = CACHE_MAXIMO) -> int:
+    """
+    Remove tabelas de outras versões do schema e, da versão atual, todas
+    menos as `manter` usadas mais recentemente. Retorna quantas removeu.
+    """
+    try:
+        nomes = [n for n in os.listdir(diretorio) if n.startswith("features-v") and n.endswith(".parquet")]
+    except OSError:
+        return 0
+    caminhos = [os.path.join(diretorio, n) for n in nomes]
+    atuais = sorted(
+        (c for c, n in zip(caminhos, nomes) if n.startswith(f"features-v{VERSAO_SCHEMA}-")),
+        key=os.path.getmtime, reverse=True,
+    )
+    remover = [c for c in caminhos if c not in atuais] + atuais[manter:]
+    for caminho in remover:
+        try:
+            os.remove(caminho)
+        except OSError:
+            pass
+    return len(remover)
+
+
+def features_compativeis(features: Optional[Sequence[str]]) -> bool:
+    """As features de um modelo salvo existem no schema atual?"""
+    return bool(features) and all(f in SCHEMA for f in features)
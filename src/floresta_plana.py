@@ -0,0 +1,248 @@
+"""
+Florestas de regressão em arrays planos, abertos com mmap.
+
+Um RandomForest do scikit-learn, ao ser carregado com joblib, copia os nós
+de cada árvore para memória própria do processo (mesmo com `mmap_mode`), e
+cada worker do dashboard acaba com sua cópia de todas as árvores. Aqui os
+nós de todas as árvores ficam concatenados em poucos arquivos `.npy`
+(feature, limiar, filhos e valor), abertos com `np.load(mmap_mode="r")`:
+as páginas vêm do page cache e são compartilhadas, somente leitura, entre
+todos os processos que abrem o mesmo artefato.
+
+As folhas apontam para si mesmas (limiar +inf), então a avaliação anda
+todas as árvores de uma vez, um nível por passo, até a profundidade
+máxima. Os limiares são guardados em float32 arredondados para baixo, o
+que dá as mesmas decisões do scikit-learn (que compara entradas float32),
+e a soma das árvores segue a ordem dele: as previsões são idênticas.
+
+Lotes grandes (a partir de `LINHAS_SKLEARN` linhas, como na materialização
+do cubo) são avaliados pelas árvores do scikit-learn, remontadas a partir
+dos mesmos arrays a cada chamada: a cópia dos nós existe só durante ela.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import shutil
+from typing import Dict
+
+import numpy as np
+import pandas as pd
+
+try:
+    from sklearn.tree._tree import NODE_DTYPE, Tree
+    SKLEARN_DISPONIVEL = True
+except ImportError:
+    SKLEARN_DISPONIVEL = False
+
+
+METADADOS = "floresta.json"
+ARRAYS = ("feature", "limiar", "filhos", "valor", "raizes")
+EXTENSAO = ".floresta"
+FORMATO = 1  # Versão do layout dos arrays, gravada nos metadados
+
+# Nós visitados por passo da avaliação (linhas x árvores): limita os arrays temporários
+NOS_POR_BLOCO = 1 << 16
+
+# A partir de quantas linhas o scikit-learn, somado o custo de remontar as
+# árvores, vence a avaliação em NumPy (`benchmarks.py arvores`, 50 árvores)
+LINHAS_SKLEARN = 500
+
+
+def exportavel(modelo) -> bool:
+    """Regressor de árvores (floresta ou árvore única) com uma saída?"""
+    arvores = getattr(modelo, "estimators_", None)
+    if arvores is None and hasattr(modelo, "tree_"):
+        arvores = [modelo]
+    if not arvores or getattr(modelo, "n_outputs_", 1) != 1:
+        return False
+    return all(hasattr(a, "tree_") and a.tree_.value.shape[1:] == (1, 1) for a in arvores)
+
+
+def _limiar_float32(limiar: np.ndarray) -> np.ndarray:
+    """
+    Maior float32 <= cada limiar: para entradas float32 (como o scikit-learn
+    as converte), `x <= limiar32` dá exatamente o mesmo que `x <= limiar`.
+    """
+    limiar32 = limiar.astype(np.float32)
+    acima = limiar32.astype(np.float64) > limiar
+    limiar32[acima] = np.nextafter(limiar32[acima], np.float32(-np.inf))
+    return limiar32
+
+
+def _arrays_do_modelo(modelo):
+    arvores = getattr(modelo, "estimators_", None) or [modelo]
+    feature, limiar, filhos, valor, raizes = [], [], [], [], []
+    deslocamento = 0
+    for arvore in arvores:
+        no = arvore.tree_
+        indices = np.arange(no.node_count) + deslocamento
+        folha = no.children_left == -1
+        feature.append(np.where(folha, 0, no.feature).astype(np.int32))
+        limiar.append(np.where(folha, np.inf, no.threshold))
+        filhos.append(np.stack([
+            np.where(folha, indices, no.children_left + deslocamento),
+            np.where(folha, indices, no.children_right + deslocamento),
+        ], axis=1).astype(np.int32))
+        valor.append(no.value[:, 0, 0].astype(np.float64))
+        raizes.append(deslocamento)
+        deslocamento += no.node_count
+
+    arrays = {
+        "feature": np.concatenate(feature),
+        "limiar": _limiar_float32(np.concatenate(limiar)),
+        "filhos": np.concatenate(filhos),
+        "valor": np.concatenate(valor),
+        "raizes": np.asarray(raizes, dtype=np.int32),
+    }
+    nomes = getattr(modelo, "feature_names_in_", None)
+    metadados = {
+        "formato": FORMATO,
+        "n_arvores": len(arvores),
+        "n_nos": deslocamento,
+        "n_features": int(modelo.n_features_in_),
+        "features": [str(n) for n in nomes] if nomes is not None else None,
+        "profundidade": int(max(a.tree_.max_depth for a in arvores)),
+        "origem": type(modelo).__name__,
+    }
+    return arrays, metadados
+
+
+def exportar_floresta(modelo, destino: str) -> int:
+    """
+    Grava o modelo no formato plano (diretório com um `.npy` por array),
+    substituindo o anterior de forma atômica. Retorna o tamanho em bytes.
+    """
+    arrays, metadados = _arrays_do_modelo(modelo)
+
+    temporario = f"{destino}.tmp-{os.getpid()}"
+    shutil.rmtree(temporario, ignore_errors=True)
+    os.makedirs(temporario)
+    for nome, array in arrays.items():
+        np.save(os.path.join(temporario, f"{nome}.npy"), array)
+    with open(os.path.join(temporario, METADADOS), "w", encoding="utf-8") as arquivo:
+        json.dump(metadados, arquivo, ensure_ascii=False, indent=2)
+
+    # Troca de diretórios: leitores com o artefato antigo aberto seguem com seus mapeamentos
+    antigo = f"{destino}.antigo-{os.getpid()}"
+    if os.path.exists(destino):
+        os.replace(destino, antigo)
+    os.replace(temporario, destino)
+    shutil.rmtree(antigo, ignore_errors=True)
+    return tamanho_em_disco(destino)
+
+
+def tamanho_em_disco(caminho: str) -> int:
+    return sum(os.path.getsize(os.path.join(caminho, nome)) for nome in os.listdir(caminho))
+
+
+class FlorestaPlana:
+    """Floresta plana com `predict` idêntico ao do regressor original."""
+
+    def __init__(self, arrays: Dict[str, np.ndarray], metadados: Dict):
+        self.feature = arrays["feature"]
+        self.limiar = arrays["limiar"]
+        self.filhos = arrays["filhos"].reshape(-1)  # [esquerdo, direito] de cada nó
+        self.valor = arrays["valor"]
+        self.raizes = np.asarray(arrays["raizes"], dtype=np.intp)
+        self.metadados = metadados
+        self.n_features_in_ = int(metadados["n_features"])
+        self.profundidade = int(metadados["profundidade"])
+        features = metadados.get("features")
+        self.feature_names_in_ = np.asarray(features, dtype=object) if features else None
+
+    @classmethod
+    def do_modelo(cls, modelo) -> "FlorestaPlana":
+        """Conversão em memória (sem arquivo) de um regressor de árvores já carregado."""
+        return cls(*_arrays_do_modelo(modelo))
+
+    @classmethod
+    def carregar(cls, caminho: str, mmap: bool = True) -> "FlorestaPlana":
+        with open(os.path.join(caminho, METADADOS), "r", encoding="utf-8") as arquivo:
+            metadados = json.load(arquivo)
+        if metadados.get("formato") != FORMATO:
+            raise ValueError(f"Formato de floresta desconhecido ({metadados.get('formato')}): {caminho}")
+        modo = "r" if mmap else None
+        arrays = {nome: np.load(os.path.join(caminho, f"{nome}.npy"), mmap_mode=modo) for nome in ARRAYS}
+        if len(arrays["raizes"]) != metadados["n_arvores"] or len(arrays["valor"]) != metadados["n_nos"]:
+            raise ValueError(f"Artefato de floresta inconsistente: {caminho}")
+        return cls(arrays, metadados)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(getattr(self, nome).nbytes for nome in ARRAYS)
+
+    def _matriz(self, X) -> np.ndarray:
+        """Entradas como o scikit-learn as vê: colunas na ordem do treino, em float32."""
+        if isinstance(X, pd.DataFrame) and self.feature_names_in_ is not None:
+            X = X[list(self.feature_names_in_)]
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        if X.ndim != 2 or X.shape[1] != self.n_features_in_:
+            raise ValueError(f"Esperadas {self.n_features_in_} features, recebido {X.shape}")
+        return X
+
+    def predict(self, X) -> np.ndarray:
+        return self.prever_matriz(self._matriz(X))
+
+    def prever_matriz(self, X: np.ndarray) -> np.ndarray:
+        """
+        Previsão sobre uma matriz já na ordem das features (sem a validação
+        do DataFrame). Lotes pequenos andam todas as árvores de uma vez em
+        NumPy (5x mais rápido que o scikit-learn com uma linha); a partir de
+        `LINHAS_SKLEARN` linhas, onde o laço em C dele vence, usa as árvores
+        do scikit-learn.
+        """
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        if len(X) >= LINHAS_SKLEARN and SKLEARN_DISPONIVEL:
+            return self._prever_sklearn(X)
+        n_arvores = len(self.raizes)
+        saida = np.empty(len(X))
+        bloco = max(1, NOS_POR_BLOCO // n_arvores)
+        for inicio in range(0, len(X), bloco):
+            parte = X[inicio:inicio + bloco]
+            plano = parte.reshape(-1)
+            base = (np.arange(len(parte)) * self.n_features_in_)[:, None]
+            no = np.broadcast_to(self.raizes, (len(parte), n_arvores))
+            for _ in range(self.profundidade):
+                # ~(x <= limiar) manda NaN para a direita, como o scikit-learn
+                direita = ~(plano[base + self.feature[no]] <= self.limiar[no])
+                no = self.filhos[2 * no + direita]
+            # Soma sequencial por árvore (mesma ordem de arredondamento do scikit-learn)
+            saida[inicio:inicio + bloco] = np.cumsum(self.valor[no], axis=1)[:, -1] / n_arvores
+        return saida
+
+    def _arvores_sklearn(self):
+        """Árvores do scikit-learn equivalentes (nós copiados dos arrays planos)."""
+        n_nos = len(self.valor)
+        fins = np.append(self.raizes[1:], n_nos)
+        # Filhos relativos à raiz de cada árvore; folhas apontam para si mesmas
+        inicio_arvore = np.repeat(self.raizes, fins - self.raizes)
+        filhos = np.asarray(self.filhos).reshape(-1, 2)
+        folha = filhos[:, 0] == np.arange(n_nos)
+        nos = np.zeros(n_nos, dtype=NODE_DTYPE)
+        nos["left_child"] = np.where(folha, -1, filhos[:, 0] - inicio_arvore)
+        nos["right_child"] = np.where(folha, -1, filhos[:, 1] - inicio_arvore)
+        nos["feature"] = np.where(folha, -2, self.feature)
+        nos["threshold"] = np.where(folha, -2.0, self.limiar)
+        valores = np.asarray(self.valor, dtype=np.float64).reshape(-1, 1, 1)
+
+        arvores = []
+        for inicio, fim in zip(self.raizes, fins):
+            arvore = Tree(self.n_features_in_, np.array([1], dtype=np.intp), 1)
+            arvore.__setstate__({
+                "max_depth": self.profundidade,
+                "node_count": int(fim - inicio),
+                "nodes": nos[inicio:fim],
+                "values": valores[inicio:fim],
+            })
+            arvores.append(arvore)
+        return arvores
+
+    def _prever_sklearn(self, X: np.ndarray) -> np.ndarray:
+        # Soma na ordem das árvores, como o RandomForestRegressor
+        saida = np.zeros(len(X))
+        arvores = self._arvores_sklearn()
+        for arvore in arvores:
+            saida += arvore.predict(X)[:, 0]
+        return saida / len(arvores)
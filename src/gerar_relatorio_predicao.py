@@ -1,116 +1,124 @@
 import pandas as pd
-import joblib
 from datetime import datetime
 import os
 
+from backtest import carregar_artefato
+
+LINHAS_NO_RANKING = 10  # Melhores e piores linhas listadas no relatório
+
+def classificar_mape(mape):
+    return "🏆 Excelente" if mape < 10 else "👍 Bom" if mape < 15 else "📊 Regular" if mape < 20 else "📉 Melhorável"
+
 def gerar_relatorio_predicao():
-    """Gera relatório de predição automaticamente"""
-    
+    """Gera o relatório de predição a partir do artefato do backtest walk-forward"""
+
     # Criar pasta relatorios se não existir
     os.makedirs('relatorios', exist_ok=True)
-    
+
     print("📊 Gerando relatório de predição...")
-    
+
+    metricas, resumo = carregar_artefato()
+    if metricas is None or len(metricas) == 0:
+        print("❌ Nenhum backtest encontrado. Execute: python src/backtest.py")
+        return
+
     try:
-        # Carregar modelo treinado
-        try:
-            features = joblib.load('dados/features.pkl')
-        except FileNotFoundError:
-            features = ['demanda', 'clima', 'dia_semana', 'hora']
-        
-        # Dados das previsões (usando os resultados do ARIMA + RF)
-        dados_linhas = {
-            '175T-10': {'previsao': 61, 'rmse': 6.15, 'mae': 4.95, 'mape': 9.74, 'real': 64},
-            '702U-10': {'previsao': 57, 'rmse': 5.79, 'mae': 5.08, 'mape': 12.50, 'real': 51},
-            '877T-10': {'previsao': 35, 'rmse': 6.43, 'mae': 5.49, 'mape': 14.75, 'real': 25},
-            '701U-10': {'previsao': 38, 'rmse': 8.08, 'mae': 6.92, 'mape': 20.64, 'real': 21}
-        }
-        
+        combinada = metricas[metricas['modelo'] == 'combinada']
+        # Uma linha por linha de ônibus: média entre os horizontes
+        por_linha = combinada.groupby('linha').agg(
+            rmse=('rmse', 'mean'), mae=('mae', 'mean'), mape=('mape', 'mean'),
+            dobras=('dobras', 'max'), tempo_treino_s=('tempo_treino_s', 'first'),
+        ).sort_values('mape')
+        por_horizonte = metricas.pivot_table(index='horizonte', columns='modelo', values='mape', aggfunc='mean')
+        por_modelo = metricas.groupby('modelo')[['rmse', 'mae', 'mape']].mean()
+
+        # A API não informa ocupação: com alvo simulado as métricas não medem demanda real
+        alvo = resumo.get('alvo', 'simulado')
+        aviso_alvo = (
+            "\n> ⚠️ **Alvo simulado:** a API SPTrans não informa ocupação, então a demanda avaliada é gerada "
+            "por um perfil de horário e linha. Os erros abaixo medem o quanto os modelos recuperam esse perfil, "
+            "não a precisão sobre a demanda real de passageiros.\n"
+            if alvo == 'simulado' else ""
+        )
+
         # Gerar relatório Markdown
         relatorio = f"""# 📊 RELATÓRIO DE PREDIÇÃO - ARIMA + RANDOM FOREST
 
 ## 📅 Data de Geração
-{datetime.now().strftime('%d/%m/%Y %H:%M')}
+{datetime.now().strftime('%d/%m/%Y %H:%M')} (backtest de {resumo['gerado_em']})
 
 ## 🎯 Objetivo
-Relatório das previsões de demanda de passageiros por linha de ônibus utilizando modelo híbrido ARIMA + Random Forest.
-
+Relatório da precisão fora da amostra das previsões de demanda de passageiros por linha de ônibus, medida por backtest walk-forward do modelo híbrido ARIMA + Random Forest.
+{aviso_alvo}
 ## 🤖 Modelo Utilizado
 - **Algoritmo:** ARIMA (1,1,1) + Random Forest Regressor
 - **Combinação:** 70% Random Forest + 30% ARIMA
-- **Features:** {features}
-- **Período de Treinamento:** 100 registros temporais
-- **Horizonte de Previsão:** 3 períodos à frente
+- **Features:** {resumo['features']}
+- **Validação:** {len(resumo['dobras'])} cortes walk-forward ({resumo['dobras'][0]} a {resumo['dobras'][-1]})
+- **Horizonte de Previsão:** {resumo['horizonte']} períodos à frente
+- **Linhas avaliadas:** {resumo['linhas']}
+- **Alvo (demanda):** {alvo}
 
-## 📈 Resultados por Linha
-
-"""
-        
-        # Adicionar dados de cada linha
-        for linha, dados in dados_linhas.items():
-            status = "🏆 Excelente" if dados['mape'] < 10 else "👍 Bom" if dados['mape'] < 15 else "📊 Regular" if dados['mape'] < 20 else "📉 Melhorável"
-            
-            relatorio += f"""### 🚌 Linha {linha}
-
-| Métrica | Valor | Status |
-|---------|-------|--------|
-| **Previsão** | {dados['previsao']} passageiros | 🎯 |
-| **RMSE** | {dados['rmse']} | 📐 |
-| **MAE** | {dados['mae']} | 📏 |
-| **MAPE** | {dados['mape']}% | {status} |
-| **Demanda Real** | {dados['real']} passageiros | 📊 |
+## 📈 Erro Médio da Rede
 
+| Modelo | RMSE | MAE | MAPE |
+|--------|------|-----|------|
 """
-        
-        # Análise de performance
-        relatorio += """## 📊 Análise de Performance
-
-### Ranking por Precisão (MAPE)
-1. **175T-10** - 9.74% 🏆
-2. **702U-10** - 12.50% 👍  
-3. **877T-10** - 14.75% 📊
-4. **701U-10** - 20.64% 📉
-
-### Erro Médio por Linha
-- **MAE Médio:** 5.61 passageiros
-- **RMSE Médio:** 6.61 passageiros
-- **MAPE Médio:** 14.41%
-
-## 🎯 Conclusões
-
-1. **Alta Precisão:** Linha 175T-10 com MAPE de 9.74% (excelente)
-2. **Performance Consistente:** 3 das 4 linhas com MAPE < 15%
-3. **Oportunidade de Melhoria:** Linha 701U-10 precisa de ajustes
-4. **Validação do Modelo:** Combinação ARIMA + RF mostrou-se eficaz
-
-## 💡 Recomendações
-
-1. **Implementar em Produção:** Modelo pronto para uso real
-2. **Monitorar Continuamente:** Acompanhar performance ao longo do tempo
-3. **Expandir para Mais Linhas:** Aplicar modelo para outras rotas
-4. **Coletar Mais Dados:** Melhorar precisão com mais histórico
+        for modelo, linha_modelo in por_modelo.iterrows():
+            relatorio += f"| {modelo} | {linha_modelo['rmse']:.2f} | {linha_modelo['mae']:.2f} | {linha_modelo['mape']:.2f}% |\n"
+
+        relatorio += "\n### MAPE por Horizonte\n\n| Horizonte | " + " | ".join(por_horizonte.columns) + " |\n"
+        relatorio += "|---" * (len(por_horizonte.columns) + 1) + "|\n"
+        for horizonte, valores in por_horizonte.iterrows():
+            relatorio += f"| {horizonte}h | " + " | ".join(f"{v:.2f}%" for v in valores) + " |\n"
+
+        # Ranking das linhas (modelo combinado)
+        def _tabela(linhas):
+            texto = "| Linha | RMSE | MAE | MAPE | Status | Dobras |\n|-------|------|-----|------|--------|--------|\n"
+            for linha, dados in linhas.iterrows():
+                texto += (f"| 🚌 {linha} | {dados['rmse']:.2f} | {dados['mae']:.2f} | {dados['mape']:.2f}% "
+                          f"| {classificar_mape(dados['mape'])} | {int(dados['dobras'])} |\n")
+            return texto
+
+        relatorio += f"\n## 🏆 Linhas Mais Precisas (MAPE)\n\n{_tabela(por_linha.head(LINHAS_NO_RANKING))}"
+        if len(por_linha) > LINHAS_NO_RANKING:
+            relatorio += f"\n## 📉 Linhas Menos Precisas (MAPE)\n\n{_tabela(por_linha.tail(LINHAS_NO_RANKING))}"
+
+        distribuicao = por_linha['mape'].apply(classificar_mape).value_counts()
+        relatorio += "\n## 📊 Distribuição da Precisão\n\n"
+        for status, quantidade in distribuicao.items():
+            relatorio += f"- **{status}:** {quantidade} linhas ({quantidade / len(por_linha):.0%})\n"
+
+        relatorio += f"""
+## ⏱️ Custo de Treino
+- **Tempo total do backtest:** {resumo['tempo_total_s']:.1f} s ({resumo['workers']} processos)
+- **Treino somado (todas as linhas e dobras):** {resumo['tempo_treino_total_s']:.1f} s
+- **Treino médio por linha (todas as dobras):** {resumo['tempo_treino_medio_linha_s']:.3f} s
+- **Linha mais cara:** {por_linha['tempo_treino_s'].idxmax()} ({por_linha['tempo_treino_s'].max():.3f} s)
 
 ---
 *Relatório gerado automaticamente pelo Sistema Inteligente de Transporte Público*
 """
-        
+
         # Salvar relatório
         with open('relatorios/relatorio_predicao.md', 'w', encoding='utf-8') as f:
             f.write(relatorio)
-        
+
         print("✅ Relatório gerado: relatorios/relatorio_predicao.md")
-        
+
         # Resumo simplificado
         with open('relatorios/resumo_predicao.txt', 'w', encoding='utf-8') as f:
-            f.write("RESUMO PREDIÇÃO ARIMA+RF\n")
-            f.write("MAPE: 9.74%-20.64%\n")
-            f.write("Linhas: 4 otimizadas\n")
-            f.write("Status: ✅ Pronto para produção\n")
-        
+            f.write("RESUMO PREDIÇÃO ARIMA+RF (backtest walk-forward)\n")
+            f.write(f"MAPE: {por_linha['mape'].min():.2f}%-{por_linha['mape'].max():.2f}% "
+                    f"(média {por_linha['mape'].mean():.2f}%)\n")
+            f.write(f"Linhas: {len(por_linha)} avaliadas\n")
+            f.write(f"Alvo: {alvo}" + (" (demanda gerada, não observada)" if alvo == 'simulado' else "") + "\n")
+            f.write(f"Treino: {resumo['tempo_treino_total_s']:.1f}s somados\n")
+
         print("✅ Resumo gerado: relatorios/resumo_predicao.txt")
-        
+
     except Exception as e:
         print(f"❌ Erro ao gerar relatório: {e}")
 
 if __name__ == "__main__":
-    gerar_relatorio_predicao()
\ No newline at end of file
+    gerar_relatorio_predicao()
@@ -0,0 +1,323 @@
+"""
+Histórico colunar das posições coletadas.
+
+Cada snapshot do coletor é anexado (nunca sobrescrito) como um arquivo
+Parquet comprimido dentro de uma partição `data=AAAA-MM-DD/hora=HH`.
+As colunas têm tipos fixos, o que permite aos leitores carregar apenas as
+colunas, o intervalo de tempo e as linhas de que precisam.
+
+A compactação de uma partição grava um `compactado-<ns>.parquet` com todas
+as partes anteriores a ele; os leitores passam a ignorar essas partes (sem
+ler registros duplicados) e elas só são apagadas numa compactação
+posterior, após `CARENCIA_REMOCAO`.
+"""
+
+from __future__ import annotations
+
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Iterable, Iterator, List, Optional, Sequence
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+
+BASE_PATH = os.path.dirname(os.path.dirname(__file__))
+HISTORICO_PATH = os.path.join(BASE_PATH, "dados", "historico")
+
+COMPRESSAO = "zstd"
+
+# Lotes de exemplo do coletor (API indisponível): nunca gravados nem lidos como observação
+FONTE_SIMULADA = "simulado"
+
+# Só partições mais antigas que isto são compactadas: os leitores do snapshot
+# recente e das últimas horas nunca disputam arquivos com a compactação
+IDADE_MINIMA_COMPACTACAO = timedelta(hours=2)
+
+# Partes já contidas em um arquivo compactado só são apagadas depois desta
+# carência, para que leitores que listaram a partição antes terminem de lê-las
+CARENCIA_REMOCAO = timedelta(hours=6)
+
+SCHEMA = pa.schema([
+    ("timestamp", pa.timestamp("us")),
+    ("timestamp_api", pa.timestamp("us")),
+    ("linha", pa.string()),
+    ("prefixo", pa.string()),
+    ("lat", pa.float64()),
+    ("lon", pa.float64()),
+    ("velocidade", pa.float32()),
+    ("fonte_dados", pa.string()),
+    ("periodo_pico", pa.string()),
+    ("descricao_pico", pa.string()),
+    ("em_periodo_pico", pa.int8()),
+    ("rodizio_ativo", pa.int8()),
+    ("feriado_nome", pa.string()),
+    ("feriado_tipo", pa.string()),
+    ("feriado_categoria", pa.string()),
+    ("tem_evento_relevante", pa.int8()),
+    ("eventos", pa.string()),
+    ("temperatura", pa.float32()),
+    ("umidade", pa.float32()),
+    ("precipitacao", pa.float32()),
+    ("velocidade_vento", pa.float32()),
+    ("codigo_clima", pa.int16()),
+    ("tem_chuva", pa.int8()),
+    ("temperatura_categoria_codigo", pa.int8()),
+    ("umidade_alta", pa.int8()),
+])
+
+
+def _nome_particao(momento: datetime) -> str:
+    return os.path.join(f"data={momento:%Y-%m-%d}", f"hora={momento:%H}")
+
+
+def _para_tabela(df: pd.DataFrame) -> pa.Table:
+    """Converte o DataFrame para o schema fixo (colunas ausentes viram nulas)."""
+    colunas = []
+    for campo in SCHEMA:
+        if campo.name not in df.columns:
+            colunas.append(pa.nulls(len(df), type=campo.type))
+            continue
+
+        serie = df[campo.name]
+        if pa.types.is_timestamp(campo.type):
+            serie = pd.to_datetime(serie).dt.floor("us")
+        elif pa.types.is_string(campo.type):
+            serie = serie.astype("string")
+        elif serie.dtype == bool:
+            serie = serie.astype(int)
+        colunas.append(pa.array(serie, type=campo.type, from_pandas=True))
+    return pa.Table.from_arrays(colunas, schema=SCHEMA)
+
+
+def _tabela_vazia(colunas: Optional[Sequence[str]] = None) -> pd.DataFrame:
+    tabela = SCHEMA.empty_table()
+    return (tabela.select(list(colunas)) if colunas else tabela).to_pandas()
+
+
+def _numero_arquivo(nome: str) -> int:
+    """Instante (ns) no nome de `parte-<ns>-<pid>` ou `compactado-<ns>`."""
+    try:
+        return int(nome.split("-")[1].split(".")[0])
+    except (IndexError, ValueError):
+        return -1
+
+
+class HistoricoPosicoes:
+    """Leitura e escrita do histórico particionado por data e hora."""
+
+    def __init__(self, caminho: str = HISTORICO_PATH):
+        self.caminho = caminho
+
+    # ------------------------------------------------------------------
+    # Escrita
+    # ------------------------------------------------------------------
+    def anexar(self, df: pd.DataFrame) -> int:
+        """Anexa um snapshot ao histórico e retorna o número de linhas gravadas."""
+        if df is not None and "fonte_dados" in df.columns:
+            df = df[df["fonte_dados"] != FONTE_SIMULADA]
+        if df is None or len(df) == 0 or "timestamp" not in df.columns:
+            return 0
+
+        tabela = _para_tabela(df)
+        momentos = pd.to_datetime(df["timestamp"]).dt.floor("h")
+        sufixo = f"{time.time_ns()}-{os.getpid()}"
+
+        for hora, indices in momentos.groupby(momentos).indices.items():
+            destino = os.path.join(self.caminho, _nome_particao(hora.to_pydatetime()))
+            os.makedirs(destino, exist_ok=True)
+            arquivo = os.path.join(destino, f"parte-{sufixo}.parquet")
+            # Escreve com prefixo "_" (ignorado pelos leitores) e renomeia ao final
+            temporario = os.path.join(destino, f"_parte-{sufixo}.parquet")
+            pq.write_table(tabela.take(indices), temporario, compression=COMPRESSAO)
+            os.replace(temporario, arquivo)
+
+        return len(df)
+
+    def compactar(
+        self,
+        antes_de: Optional[datetime] = None,
+        desde: Optional[datetime] = None,
+        carencia: timedelta = CARENCIA_REMOCAO,
+    ) -> int:
+        """
+        Junta os arquivos ativos de cada partição fechada (hora anterior a
+        `antes_de`, por padrão agora - `IDADE_MINIMA_COMPACTACAO`;
+        opcionalmente a partir de `desde`) em um único arquivo e
+        apaga os arquivos substituídos há mais de `carencia`.
+        Retorna a quantidade de partições compactadas.
+        """
+        limite = (antes_de or datetime.now() - IDADE_MINIMA_COMPACTACAO).replace(minute=0, second=0, microsecond=0)
+        compactadas = 0
+
+        for particao in self._particoes(desde, limite - timedelta(microseconds=1)):
+            partes = self._arquivos(particao)
+            if len(partes) > 1:
+                tabela = ds.dataset(partes, schema=SCHEMA, format="parquet").to_table()
+                temporario = os.path.join(particao, "_compactado.parquet")
+                pq.write_table(tabela, temporario, compression=COMPRESSAO)
+                # Nome maior que o de todas as partes lidas: elas passam a ser ignoradas
+                os.replace(temporario, os.path.join(particao, f"compactado-{time.time_ns()}.parquet"))
+                compactadas += 1
+            self._remover_substituidos(particao, carencia)
+
+        return compactadas
+
+    @staticmethod
+    def _remover_substituidos(particao: str, carencia: timedelta) -> None:
+        nomes = [n for n in os.listdir(particao) if n.endswith(".parquet") and not n.startswith(("_", "."))]
+        compactados = [_numero_arquivo(n) for n in nomes if n.startswith("compactado-")]
+        if not compactados:
+            return
+        ultimo = max(compactados)
+        if time.time_ns() - ultimo < carencia.total_seconds() * 1e9:
+            return
+        for nome in nomes:
+            if _numero_arquivo(nome) < ultimo:
+                try:
+                    os.remove(os.path.join(particao, nome))
+                except FileNotFoundError:
+                    pass
+
+    # ------------------------------------------------------------------
+    # Leitura
+    # ------------------------------------------------------------------
+    def _particoes(self, inicio: Optional[datetime], fim: Optional[datetime]) -> List[str]:
+        """Lista os diretórios de partição que intersectam o intervalo."""
+        if not os.path.isdir(self.caminho):
+            return []
+
+        primeira = _nome_particao(inicio.replace(minute=0, second=0, microsecond=0)) if inicio else None
+        ultima = _nome_particao(fim) if fim else None
+
+        particoes = []
+        for dia in sorted(os.listdir(self.caminho)):
+            if not dia.startswith("data="):
+                continue
+            for hora in sorted(os.listdir(os.path.join(self.caminho, dia))):
+                nome = os.path.join(dia, hora)
+                if primeira and nome < primeira:
+                    continue
+                if ultima and nome > ultima:
+                    continue
+                particoes.append(os.path.join(self.caminho, nome))
+        return particoes
+
+    @staticmethod
+    def _arquivos(particao: str) -> List[str]:
+        """Arquivos ativos: o compactado mais novo e as partes gravadas depois dele."""
+        try:
+            nomes = [n for n in os.listdir(particao) if n.endswith(".parquet") and not n.startswith(("_", "."))]
+        except FileNotFoundError:
+            return []
+        compactados = [_numero_arquivo(n) for n in nomes if n.startswith("compactado-")]
+        ultimo = max(compactados, default=-1)
+        return sorted(os.path.join(particao, n) for n in nomes if _numero_arquivo(n) >= ultimo)
+
+    @staticmethod
+    def _filtro(inicio: Optional[datetime], fim: Optional[datetime], linhas: Optional[Iterable[str]]):
+        filtro = None
+        if inicio is not None:
+            filtro = ds.field("timestamp") >= pa.scalar(inicio, type=pa.timestamp("us"))
+        if fim is not None:
+            condicao = ds.field("timestamp") <= pa.scalar(fim, type=pa.timestamp("us"))
+            filtro = condicao if filtro is None else filtro & condicao
+        if linhas is not None:
+            condicao = ds.field("linha").isin([str(l) for l in linhas])
+            filtro = condicao if filtro is None else filtro & condicao
+        # Lotes simulados gravados por versões antigas do coletor
+        condicao = ds.field("fonte_dados").is_null() | (ds.field("fonte_dados") != FONTE_SIMULADA)
+        return condicao if filtro is None else filtro & condicao
+
+    def ler(
+        self,
+        colunas: Optional[Sequence[str]] = None,
+        inicio: Optional[datetime] = None,
+        fim: Optional[datetime] = None,
+        linhas: Optional[Iterable[str]] = None,
+    ) -> pd.DataFrame:
+        """
+        Lê o histórico aplicando poda de colunas e filtros de tempo e linha.
+
+        Args:
+            colunas: Colunas desejadas (None = todas)
+            inicio, fim: Intervalo de tempo (inclusivo) sobre `timestamp`
+            linhas: Códigos de linha a manter
+        """
+        colunas = list(colunas) if colunas else SCHEMA.names
+        for tentativa in range(3):
+            arquivos = [a for p in self._particoes(inicio, fim) for a in self._arquivos(p)]
+            if not arquivos:
+                return _tabela_vazia(colunas)
+            try:
+                dataset = ds.dataset(arquivos, schema=SCHEMA, format="parquet")
+                return dataset.to_table(columns=colunas, filter=self._filtro(inicio, fim, linhas)).to_pandas()
+            except FileNotFoundError:
+                # Parte removida por uma compactação entre a listagem e a leitura: lista de novo
+                if tentativa == 2:
+                    raise
+
+    def ler_em_lotes(
+        self,
+        colunas: Optional[Sequence[str]] = None,
+        inicio: Optional[datetime] = None,
+        fim: Optional[datetime] = None,
+        linhas: Optional[Iterable[str]] = None,
+        tamanho_lote: int = 100_000,
+    ) -> Iterator[pd.DataFrame]:
+        """
+        Mesmos filtros de `ler`, mas em lotes de até `tamanho_lote` registros
+        na ordem das partições, sem materializar o intervalo inteiro.
+        """
+        arquivos = [a for p in self._particoes(inicio, fim) for a in self._arquivos(p)]
+        colunas = list(colunas) if colunas else SCHEMA.names
+        if not arquivos:
+            return
+
+        dataset = ds.dataset(arquivos, schema=SCHEMA, format="parquet")
+        # Sem leitura antecipada de vários arquivos: a memória fica limitada ao lote
+        lotes = dataset.to_batches(
+            columns=colunas, filter=self._filtro(inicio, fim, linhas),
+            batch_size=tamanho_lote, batch_readahead=1, fragment_readahead=1,
+        )
+        pendentes: List[pa.RecordBatch] = []
+        acumulado = 0
+        for lote in lotes:
+            while lote.num_rows:
+                parte = lote.slice(0, tamanho_lote - acumulado)
+                lote = lote.slice(parte.num_rows)
+                pendentes.append(parte)
+                acumulado += parte.num_rows
+                if acumulado == tamanho_lote:
+                    yield pa.Table.from_batches(pendentes).to_pandas()
+                    pendentes, acumulado = [], 0
+        if acumulado:
+            yield pa.Table.from_batches(pendentes).to_pandas()
+
+    def ultimo_snapshot(self, colunas: Optional[Sequence[str]] = None) -> pd.DataFrame:
+        """Lê apenas o snapshot mais recente gravado pelo coletor."""
+        particoes = self._particoes(None, None)
+        if not particoes:
+            return _tabela_vazia(colunas)
+
+        recentes = particoes[-24:]
+        partes = [a for a in self._arquivos(recentes[-1]) if os.path.basename(a).startswith("parte-")]
+        if not partes:
+            # Partição já compactada: filtra pelo maior timestamp gravado
+            df = ds.dataset(self._arquivos(recentes[-1]), schema=SCHEMA, format="parquet").to_table(
+                filter=self._filtro(None, None, None)).to_pandas()
+            df = df[df["timestamp"] == df["timestamp"].max()].reset_index(drop=True)
+            return df[list(colunas)] if colunas else df
+
+        # Um snapshot pode ter sido dividido entre partições (virada de hora)
+        nome = max((os.path.basename(a) for a in partes), key=lambda n: int(n.split("-")[1]))
+        arquivos = [os.path.join(p, nome) for p in recentes if os.path.exists(os.path.join(p, nome))]
+        tabela = ds.dataset(arquivos, schema=SCHEMA, format="parquet").to_table(
+            columns=colunas, filter=self._filtro(None, None, None))
+        return tabela.to_pandas()
+
+    def vazio(self) -> bool:
+        return not any(self._arquivos(p) for p in self._particoes(None, None))
@@ -1,7 +1,23 @@
 import webbrowser
 import os
+import sys
+import threading
 
-def executar_sistema():
+def iniciar_coleta_continua():
+    """Inicia o coletor contínuo (daemon asyncio) em uma thread de fundo"""
+    import asyncio
+    from daemon_coleta import DaemonColeta
+    
+    daemon = DaemonColeta()
+    thread = threading.Thread(
+        target=lambda: asyncio.run(daemon.executar()),
+        name='daemon-coleta',
+        daemon=True
+    )
+    thread.start()
+    return daemon
+
+def executar_sistema(modo_daemon=False):
     """Executa todo o sistema"""
     print("=" * 60)
     print("🚇 SISTEMA INTELIGENTE DE TRANSPORTE PÚBLICO")
@@ -14,6 +30,10 @@ def executar_sistema():
         import coleta_sptrans
         coleta_sptrans.main()
         
+        if modo_daemon:
+            print("🔁 Coleta contínua ativada (modo daemon)")
+            iniciar_coleta_continua()
+        
         
         print("\n2️⃣  TREINANDO MODELO DE IA...")
         import ml_simples
@@ -29,6 +49,10 @@ def executar_sistema():
         
         # Importar e executar dashboard
         from dashboard import app
+        from contexto_planejamento import provedor_contexto
+        provedor_contexto().iniciar()
+        from clima_openmeteo import ClimaOpenMeteo
+        ClimaOpenMeteo.obter().iniciar_atualizacao_periodica()
         app.run(debug=False, port=8050)
         
     except Exception as e:
@@ -38,4 +62,4 @@ def executar_sistema():
         input("Pressione Enter para sair...")
 
 if __name__ == "__main__":
-    executar_sistema()
\ No newline at end of file
+    executar_sistema(modo_daemon='--daemon' in sys.argv)
\ No newline at end of file
@@ -1,7 +1,24 @@
-def main():
+import argparse
+
+DIAS_TREINO = 7  # Janela de histórico usada no treino
+
+def main(out_of_core=False, modelo="sgd", memoria_mb=None, epocas=None, dias=None):
     """Função principal chamada pelo main.py"""
     print("🤖 Iniciando treinamento do modelo de ML...")
     
+    if out_of_core:
+        # Histórico lido em lotes, com memória limitada (meses de posições)
+        from treino_out_of_core import (
+            DIAS_TREINO as DIAS_OUT_OF_CORE, EPOCAS_PADRAO, MEMORIA_MB_PADRAO, treinar_out_of_core,
+        )
+        treinar_out_of_core(
+            modelo=modelo,
+            memoria_mb=memoria_mb or MEMORIA_MB_PADRAO,
+            epocas=epocas or EPOCAS_PADRAO,
+            dias=dias or DIAS_OUT_OF_CORE,
+        )
+        return
+    
     try:
         from modelo_arima_rf import main as arima_main
         print("🚀 Usando modelo ARIMA + Random Forest...")
@@ -10,92 +27,38 @@ def main():
         print("📢 Instale: pip install statsmodels")
         print("🔄 Usando modelo Random Forest básico...")
         
-        import pandas as pd
         from sklearn.ensemble import RandomForestRegressor
         import numpy as np
         import joblib
         import os
+        from datetime import datetime, timedelta
+        from backfill_clima import preencher_clima_historico
+        from feature_store import FEATURES_GERAL, build_features
+        from historico_posicoes import HistoricoPosicoes
 
-        # Carregar dados
-        df = pd.read_csv('dados/dados_onibus.csv')
-        
-        # Criar features
-        df['timestamp'] = pd.to_datetime(df['timestamp'])
-        df['hora'] = df['timestamp'].dt.hour
-        df['dia_semana'] = df['timestamp'].dt.dayofweek
-        df['fim_de_semana'] = (df['dia_semana'] >= 5).astype(int)
-
-        # Garantir colunas adicionais do contexto
-        contexto_defaults = {
-            'em_periodo_pico': 0,
-            'rodizio_ativo': 0,
-            'tem_evento_relevante': 0,
-        }
-        for coluna, default in contexto_defaults.items():
-            if coluna not in df.columns:
-                df[coluna] = default
+        # Carregar apenas as colunas e a janela de tempo usadas no treino
+        colunas = ['timestamp', 'velocidade', 'temperatura', 'umidade', 'precipitacao']
+        df = HistoricoPosicoes().ler(
+            colunas=colunas,
+            inicio=datetime.now() - timedelta(days=DIAS_TREINO)
+        )
+        if len(df) == 0:
+            print("❌ Histórico vazio. Execute coleta_sptrans.py primeiro.")
+            return
 
-        if 'feriado_nome' in df.columns:
-            df['feriado_flag'] = df['feriado_nome'].notna().astype(int)
-        else:
-            df['feriado_flag'] = 0
-
-        mapa_periodos = {'morning': 1, 'midday': 2, 'afternoon': 3}
-        if 'periodo_pico' in df.columns:
-            df['periodo_pico_codigo'] = df['periodo_pico'].map(mapa_periodos).fillna(0)
-        else:
-            df['periodo_pico_codigo'] = 0
+        # Clima observado (backfill local) para snapshots gravados sem clima
+        df = preencher_clima_historico(df)
+        
+        # Features do feature store (as mesmas montadas na hora de servir)
+        features = FEATURES_GERAL
+        X = build_features(df, features)
         
         # Simular lotação
         np.random.seed(42)
-        df['lotacao'] = np.random.randint(20, 100, len(df))
-        df.loc[df['hora'].between(7, 9), 'lotacao'] += 20
-        df.loc[df['hora'].between(17, 19), 'lotacao'] += 15
-        df['lotacao'] = df['lotacao'].clip(0, 100)
-        
-        # Features para ML
-        features = [
-            'hora',
-            'dia_semana',
-            'velocidade',
-            'fim_de_semana',
-            'em_periodo_pico',
-            'rodizio_ativo',
-            'feriado_flag',
-            'tem_evento_relevante',
-            'periodo_pico_codigo',
-        ]
-        
-        # Adicionar features climáticas se disponíveis
-        features_climaticas = [
-            'temperatura',
-            'umidade',
-            'precipitacao',
-            'tem_chuva',
-            'temperatura_categoria_codigo',
-            'umidade_alta',
-        ]
-        
-        for feat in features_climaticas:
-            if feat in df.columns:
-                features.append(feat)
-            else:
-                # Criar valores padrão se não existir
-                if feat == 'temperatura':
-                    df['temperatura'] = 22.0  # Temperatura média SP
-                elif feat == 'umidade':
-                    df['umidade'] = 65.0  # Umidade média SP
-                elif feat == 'precipitacao':
-                    df['precipitacao'] = 0.0
-                elif feat == 'tem_chuva':
-                    df['tem_chuva'] = 0
-                elif feat == 'temperatura_categoria_codigo':
-                    df['temperatura_categoria_codigo'] = 2  # Moderado
-                elif feat == 'umidade_alta':
-                    df['umidade_alta'] = 0
-                features.append(feat)
-        X = df[features]
-        y = df['lotacao']
+        lotacao = np.random.randint(20, 100, len(df))
+        lotacao[X['hora'].between(7, 9).to_numpy()] += 20
+        lotacao[X['hora'].between(17, 19).to_numpy()] += 15
+        y = np.clip(lotacao, 0, 100)
         
         # Treinar modelo
         modelo = RandomForestRegressor(n_estimators=100, random_state=42, max_depth=10)
@@ -113,4 +76,14 @@ def main():
         print(f"🎯 Features: {features}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Treino do modelo geral de lotação")
+    parser.add_argument("--out-of-core", action="store_true",
+                        help="Ler o histórico em lotes com memória limitada")
+    parser.add_argument("--modelo", choices=["sgd", "rf"], default="sgd",
+                        help="sgd: partial_fit por lote; rf: floresta sobre amostra estratificada")
+    parser.add_argument("--memoria-mb", type=float, default=None, help="Orçamento de memória do treino")
+    parser.add_argument("--epocas", type=int, default=None, help="Passadas sobre o histórico (sgd)")
+    parser.add_argument("--dias", type=int, default=None, help="Dias de histórico usados no treino")
+    args = parser.parse_args()
+    main(out_of_core=args.out_of_core, modelo=args.modelo, memoria_mb=args.memoria_mb,
+         epocas=args.epocas, dias=args.dias)
\ No newline at end of file
@@ -1,14 +1,34 @@
+import argparse
+import json
+import os
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
 import pandas as pd
 import numpy as np
-import joblib
 from sklearn.ensemble import RandomForestRegressor
-from sklearn.metrics import mean_squared_error, mean_absolute_error
 from statsmodels.tsa.arima.model import ARIMA
 import warnings
-from contexto_planejamento import ContextoPlanejamento
+from datetime import datetime, timedelta
+from arima_incremental import EstadosArima
+from backtest import carregar_artefato
+from cubo_lotacao import construir_cubo
+from feature_store import FEATURES_CALENDARIO, FEATURES_LINHA, build_features, features_em_cache
+from historico_posicoes import HistoricoPosicoes
+from registro_modelos import RegistroModelos
 
 warnings.filterwarnings('ignore')
 
+DIAS_HISTORICO = 7  # Janela do histórico usada para montar as séries
+RELATORIO_TREINO_PATH = 'dados/relatorio_treino_linhas.json'
+
+FEATURES_RF = FEATURES_LINHA
+
+# A API não informa ocupação: demanda_passageiros é gerada por um perfil de
+# horário/linha (ver carregar_dados_demanda), inclusive sobre o histórico real
+ALVO_DEMANDA = 'simulado'
+
 def criar_dados_demanda():
     """Cria dados de demanda realistas para demonstração"""
     np.random.seed(42)
@@ -23,21 +43,7 @@ def criar_dados_demanda():
         hora = date.hour
         
         # Demanda base + variação por horário
-        demanda_base = np.random.randint(20, 60)
-        
-        # Aumentar demanda nos horários de pico
-        if 7 <= hora <= 9:   
-            demanda_base += 30
-        elif 17 <= hora <= 19:  
-            demanda_base += 25
-        elif 12 <= hora <= 14:  
-            demanda_base += 15
-            
-        # Variação por linha
-        if linha == '175T-10':  
-            demanda_base += 10
-        elif linha == '877T-10':  
-            demanda_base -= 5
+        demanda_base = ajustar_demanda(np.random.randint(20, 60), hora, linha)
             
         dados.append({
             'timestamp': date,
@@ -45,14 +51,69 @@ def criar_dados_demanda():
             'hora': hora,
             'dia_semana': date.weekday(),
             'fim_de_semana': 1 if date.weekday() >= 5 else 0,
-            'demanda_passageiros': max(10, min(100, demanda_base)),
+            'demanda_passageiros': demanda_base,
             'velocidade_media': np.random.randint(15, 40)
         })
     
     return pd.DataFrame(dados)
 
+def ajustar_demanda(demanda_base, hora, linha):
+    """Aplica o perfil de horário e de linha sobre a demanda base (limitada a 10-100)"""
+    # Aumentar demanda nos horários de pico
+    if 7 <= hora <= 9:   
+        demanda_base += 30
+    elif 17 <= hora <= 19:  
+        demanda_base += 25
+    elif 12 <= hora <= 14:  
+        demanda_base += 15
+        
+    # Variação por linha
+    if linha == '175T-10':  
+        demanda_base += 10
+    elif linha == '877T-10':  
+        demanda_base -= 5
+    
+    return max(10, min(100, demanda_base))
+
+def carregar_dados_demanda(dias=DIAS_HISTORICO, linhas=None):
+    """
+    Monta a série horária por linha a partir do histórico colunar
+    
+    Lê apenas timestamp/linha/velocidade da janela pedida. Como a API não
+    informa ocupação, a demanda segue o mesmo perfil de criar_dados_demanda.
+    """
+    df = HistoricoPosicoes().ler(
+        colunas=['timestamp', 'linha', 'velocidade'],
+        inicio=datetime.now() - timedelta(days=dias),
+        linhas=linhas
+    )
+    if len(df) == 0:
+        return None
+    
+    df['timestamp'] = df['timestamp'].dt.floor('h')
+    df = (df.groupby(['linha', 'timestamp'], observed=True)['velocidade']
+            .mean().rename('velocidade_media').reset_index())
+    
+    base = demanda_base_simulada(df)
+    df[FEATURES_CALENDARIO] = build_features(df, FEATURES_CALENDARIO)
+    df['demanda_passageiros'] = [
+        ajustar_demanda(b, h, l) for b, h, l in zip(base, df['hora'], df['linha'])
+    ]
+    return df
+
+def demanda_base_simulada(df):
+    """
+    Demanda base (20-59) sorteada de forma determinística por (linha, hora)
+    
+    Cada registro depende só da própria linha e timestamp: uma linha que
+    ganha ou perde horas não altera o alvo das demais (e a impressão delas
+    no modo incremental continua a mesma).
+    """
+    chaves = pd.util.hash_pandas_object(df[['linha', 'timestamp']].astype({'linha': str}), index=False)
+    return 20 + (chaves.to_numpy() % np.uint64(40)).astype(np.int64)
+
 def modelo_arima_previsao(serie_temporal, steps=1):
-    """Modelo ARIMA para previsão de séries temporais"""
+    """ARIMA de uma única série via statsmodels (referência do ajuste em lote)"""
     try:
         model = ARIMA(serie_temporal, order=(1, 1, 1))
         fitted_model = model.fit()
@@ -63,91 +124,221 @@ def modelo_arima_previsao(serie_temporal, steps=1):
         # Fallback: média móvel
         return [np.mean(serie_temporal[-5:])] * steps
 
-def calcular_mape(y_true, y_pred):
-    """Calcula Mean Absolute Percentage Error"""
-    return np.mean(np.abs((y_true - y_pred) / np.maximum(np.abs(y_true), 1))) * 100
+def semente_linha(linha):
+    """Semente fixa por linha (não depende da ordem nem do número de workers)"""
+    return zlib.crc32(str(linha).encode()) & 0x7FFFFFFF
 
-def main():
-    print("🤖 MODELO ARIMA + RANDOM FOREST")
-    print("=" * 50)
+def impressao_dados(df_linha, features):
+    """Hash dos dados de treino de uma linha, usado no modo incremental"""
+    colunas = ['timestamp'] + list(features) + ['demanda_passageiros']
+    valores = pd.util.hash_pandas_object(df_linha[colunas], index=False).to_numpy()
+    return f"{zlib.crc32(valores.tobytes()):08x}-{len(df_linha)}"
+
+def treinar_linha(linha, df_linha, features_rf):
+    """
+    Treina o RF de uma linha (executado nos processos do pool)
     
-    # Criar dados de demanda
-    df = criar_dados_demanda()
-    print(f"📊 Dados criados: {len(df)} registros")
-    print(f"📅 Período: {df['timestamp'].min()} até {df['timestamp'].max()}")
+    Returns:
+        (linha, métricas, modelo RF)
+    """
+    inicio = time.perf_counter()
+    df_linha = df_linha.sort_values('timestamp')
     
-    contexto = ContextoPlanejamento.obter()
-    df['contexto_periodo'] = df['timestamp'].apply(
-        lambda ts: contexto.periodo_pico(ts) or {}
-    )
-    df['em_periodo_pico'] = df['contexto_periodo'].apply(lambda ctx: 1 if ctx else 0)
-    mapa_periodos = {'morning': 1, 'midday': 2, 'afternoon': 3}
-    df['periodo_pico_codigo'] = df['contexto_periodo'].apply(
-        lambda ctx: mapa_periodos.get(ctx.get('period'), 0) if ctx else 0
-    )
-    df['rodizio_ativo'] = df['timestamp'].apply(lambda ts: int(contexto.rodizio_ativo(ts)))
-    df['feriado_flag'] = df['timestamp'].apply(lambda ts: 1 if contexto.feriado_no_dia(ts) else 0)
-    df['tem_evento_relevante'] = df['timestamp'].apply(lambda ts: int(bool(contexto.eventos_do_dia(ts))))
-    df = df.drop(columns=['contexto_periodo'])
-
-    # Features para Random Forest
-    features_rf = [
-        'hora',
-        'dia_semana',
-        'fim_de_semana',
-        'velocidade_media',
-        'em_periodo_pico',
-        'periodo_pico_codigo',
-        'rodizio_ativo',
-        'feriado_flag',
-        'tem_evento_relevante',
-    ]
+    # 1. MODELO RANDOM FOREST
+    X = df_linha[features_rf]
+    y = df_linha['demanda_passageiros']
     
-    # Preparar dados por linha para ARIMA
-    linhas = df['linha'].unique()
-    resultados = {}
+    rf_model = RandomForestRegressor(n_estimators=50, random_state=semente_linha(linha))
+    rf_model.fit(X, y)
     
-    for linha in linhas:
-        print(f"\n📈 Processando linha {linha}...")
-        
-        # Dados da linha específica
-        df_linha = df[df['linha'] == linha].copy()
-        df_linha = df_linha.sort_values('timestamp')
-        
+    # 2. ARIMA é ajustado depois, em lote para todas as linhas (arima_lote)
+    # Erro sobre as próprias linhas de treino não mede acurácia: ver backtest.py
+    serie_demanda = df_linha['demanda_passageiros'].values
+    metricas = {
+        'rf_previsao': float(rf_model.predict(X.iloc[[-1]])[0]),
+        'ultima_demanda': float(serie_demanda[-1]),
+        'registros': int(len(df_linha)),
+        'semente': semente_linha(linha),
+        'tempo_s': time.perf_counter() - inicio,
+    }
+    return linha, metricas, rf_model
+
+def carregar_relatorio(caminho=RELATORIO_TREINO_PATH):
+    if not os.path.exists(caminho):
+        return {}
+    try:
+        with open(caminho, 'r', encoding='utf-8') as arquivo:
+            return json.load(arquivo).get('linhas', {})
+    except (OSError, ValueError):
+        return {}
+
+def salvar_relatorio(linhas, resumo, caminho=RELATORIO_TREINO_PATH):
+    os.makedirs(os.path.dirname(caminho), exist_ok=True)
+    temporario = caminho + '.tmp'
+    with open(temporario, 'w', encoding='utf-8') as arquivo:
+        json.dump({'resumo': resumo, 'linhas': linhas}, arquivo, ensure_ascii=False, indent=2)
+    os.replace(temporario, caminho)
+
+def atualizar_arima(relatorio, df, estados, forcar_reajuste=False):
+    """
+    Atualiza o ARIMA(1,1,1) das linhas do relatório a partir do estado salvo
+    
+    Horas novas passam só pelo filtro; o ajuste completo (em lote) é refeito
+    apenas para linhas novas, com ajuste vencido ou com erro em deriva.
+    """
+    linhas = [l for l, m in relatorio.items() if m.get('status') != 'falha']
+    dados = df[df['linha'].isin(linhas)]
+    if len(dados) == 0:
+        return relatorio
+    
+    arima = estados.atualizar(dados, passos=3, forcar_reajuste=forcar_reajuste)  # Prever 3 períodos
+    for linha, previsao in arima.iterrows():
+        metricas = relatorio[linha]
+        metricas['arima_previsao'] = float(previsao['previsao_1'])
+        metricas['arima_status'] = previsao['status']
+        metricas['arima_acao'] = previsao['acao']
+        metricas.pop('arima_motivo', None)
+        if pd.notna(previsao['motivo']):
+            metricas['arima_motivo'] = previsao['motivo']
+        # 3. COMBINAÇÃO DOS MODELOS: peso maior para RF (70%), ARIMA (30%)
+        metricas['combinada'] = metricas['rf_previsao'] * 0.7 + metricas['arima_previsao'] * 0.3
+    
+    acoes = arima['acao'].value_counts()
+    print(f"📊 ARIMA: {acoes.get('filtro', 0)} linhas atualizadas pelo filtro, "
+          f"{acoes.get('reajuste', 0)} reajustadas, {acoes.get('sem_novidade', 0)} sem horas novas")
+    falhas = arima[arima['status'] == 'falha']
+    if len(falhas):
+        print(f"⚠️ ARIMA falhou em {len(falhas)} linhas (média das últimas 5 horas usada):")
+        for linha, motivo in falhas['motivo'].head(10).items():
+            print(f"   • {linha}: {motivo}")
+    return relatorio
+
+def treinar_linhas(df, features_rf, workers=None, incremental=False, anterior=None, estados=None,
+                   reajustar_arima=False):
+    """
+    Treina todas as linhas com dados suficientes em um pool de processos
+    
+    Args:
+        df: Séries horárias de todas as linhas
+        features_rf: Features do Random Forest
+        workers: Processos do pool (None = número de CPUs; 1 = sem pool)
+        incremental: Treina apenas linhas cujos dados mudaram desde o último relatório
+        anterior: Relatório anterior por linha (para o modo incremental)
+        estados: Estado do ARIMA por linha (None = ajuste completo, só em memória)
+        reajustar_arima: Refaz o ajuste ARIMA de todas as linhas, ignorando o estado
+    
+    Returns:
+        (relatório por linha, modelos RF treinados nesta execução)
+    """
+    anterior = anterior or {}
+    relatorio = {}
+    pendentes = []
+    
+    for linha, df_linha in df.groupby('linha', sort=True):
         if len(df_linha) < 10:
             continue
-            
-        # 1. MODELO RANDOM FOREST
-        X = df_linha[features_rf]
-        y = df_linha['demanda_passageiros']
-        
-        # Treinar RF
-        rf_model = RandomForestRegressor(n_estimators=50, random_state=42)
-        rf_model.fit(X, y)
-        y_pred_rf = rf_model.predict(X)
-        
-        # 2. MODELO ARIMA (série temporal)
-        serie_demanda = df_linha['demanda_passageiros'].values
-        previsao_arima = modelo_arima_previsao(serie_demanda, steps=3)  # Prever 3 períodos
-        
-        # 3. COMBINAÇÃO DOS MODELOS
-        # Peso maior para RF (70%), ARIMA (30%)
-        previsao_combinada = (y_pred_rf[-1] * 0.7 + previsao_arima[0] * 0.3)
-        
-        # Métricas
-        rmse = np.sqrt(mean_squared_error(y, y_pred_rf))
-        mae = mean_absolute_error(y, y_pred_rf)
-        mape = calcular_mape(y, y_pred_rf)
-        
-        resultados[linha] = {
-            'rf_previsao': y_pred_rf[-1],
-            'arima_previsao': previsao_arima[0],
-            'combinada': previsao_combinada,
-            'rmse': rmse,
-            'mae': mae,
-            'mape': mape,
-            'ultima_demanda': serie_demanda[-1]
-        }
+        impressao = impressao_dados(df_linha, features_rf)
+        registro = anterior.get(linha)
+        if incremental and registro and registro.get('impressao') == impressao:
+            relatorio[linha] = {**registro, 'status': 'inalterada'}
+            continue
+        pendentes.append((linha, df_linha, impressao))
+    
+    modelos = {}
+    
+    def _registrar(linha, metricas, modelo, impressao):
+        relatorio[linha] = {**metricas, 'impressao': impressao, 'status': 'treinada'}
+        modelos[linha] = modelo
+    
+    def _falha(linha, erro):
+        print(f"❌ Falha ao treinar linha {linha}: {erro}")
+        relatorio[linha] = {'status': 'falha', 'erro': str(erro), 'impressao': None}
+    
+    if workers == 1 or len(pendentes) <= 1:
+        for linha, df_linha, impressao in pendentes:
+            try:
+                _registrar(*treinar_linha(linha, df_linha, features_rf), impressao)
+            except Exception as e:
+                _falha(linha, e)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futuros = {
+                executor.submit(treinar_linha, linha, df_linha, features_rf): (linha, impressao)
+                for linha, df_linha, impressao in pendentes
+            }
+            for futuro in as_completed(futuros):
+                linha, impressao = futuros[futuro]
+                try:
+                    _registrar(*futuro.result(), impressao)
+                except Exception as e:
+                    _falha(linha, e)
+    
+    # 2. ARIMA(1,1,1) de todas as linhas, incremental a partir do estado salvo
+    if estados is None:
+        estados = EstadosArima(caminho=None)
+    atualizar_arima(relatorio, df, estados, forcar_reajuste=reajustar_arima)
+    
+    return dict(sorted(relatorio.items())), modelos
+
+def carregar_series():
+    """Séries horárias a partir do histórico coletado (ou dados de demonstração)"""
+    df = carregar_dados_demanda()
+    if df is None or df.groupby('linha').size().max() < 10:
+        df = criar_dados_demanda()
+        print(f"📊 Dados criados: {len(df)} registros (demanda simulada)")
+    else:
+        print(f"📊 Dados do histórico: {len(df)} registros "
+              f"(velocidades observadas, demanda simulada: a API não informa ocupação)")
+    print(f"📅 Período: {df['timestamp'].min()} até {df['timestamp'].max()}")
+    return df
+
+def atualizar_previsoes_arima():
+    """
+    Atualiza só as previsões ARIMA do último relatório (sem treinar o RF)
+    
+    Pensado para rodar a cada hora fechada: as horas novas passam pelo
+    filtro e o relatório é regravado com as previsões atualizadas.
+    """
+    relatorio = carregar_relatorio()
+    if not relatorio:
+        print("⚠️ Nenhum relatório de treino; execute o treino completo primeiro")
+        return {}
+    
+    inicio = time.perf_counter()
+    estados = EstadosArima()
+    atualizar_arima(relatorio, carregar_series(), estados)
+    estados.salvar()
+    
+    with open(RELATORIO_TREINO_PATH, 'r', encoding='utf-8') as arquivo:
+        resumo = json.load(arquivo).get('resumo', {})
+    resumo['arima_atualizado_em'] = datetime.now().isoformat(timespec='seconds')
+    salvar_relatorio(relatorio, resumo)
+    print(f"✅ Previsões ARIMA atualizadas em {time.perf_counter() - inicio:.2f}s")
+    return relatorio
+
+def main(workers=None, incremental=False, reajustar_arima=False):
+    print("🤖 MODELO ARIMA + RANDOM FOREST")
+    print("=" * 50)
+    
+    features_rf = FEATURES_RF
+    df = features_em_cache(carregar_series(), features_rf)
+    
+    # Treino por linha em paralelo (sementes fixas por linha)
+    inicio = time.perf_counter()
+    anterior = carregar_relatorio() if incremental else {}
+    estados = EstadosArima()
+    relatorio, modelos = treinar_linhas(df, features_rf, workers=workers, incremental=incremental,
+                                        anterior=anterior, estados=estados, reajustar_arima=reajustar_arima)
+    estados.salvar()
+    duracao = time.perf_counter() - inicio
+    resultados = {linha: m for linha, m in relatorio.items() if m.get('status') != 'falha'}
+    
+    # Acurácia fora da amostra: MAPE do último backtest walk-forward (média dos horizontes)
+    metricas_backtest, _ = carregar_artefato()
+    mape_backtest = {}
+    if metricas_backtest is not None and len(metricas_backtest) > 0:
+        combinada = metricas_backtest[metricas_backtest['modelo'] == 'combinada']
+        mape_backtest = combinada.groupby('linha')['mape'].mean().to_dict()
     
     # RELATÓRIO FINAL
     print("\n" + "="*60)
@@ -155,21 +346,56 @@ def main():
     print("="*60)
     
     for linha, metrics in resultados.items():
-        print(f"\n🚌 LINHA {linha}:")
-        print(f"   📈 Última demanda real: {metrics['ultima_demanda']:.0f} passageiros")
+        sufixo = " (sem mudanças, resultado anterior)" if metrics['status'] == 'inalterada' else ""
+        print(f"\n🚌 LINHA {linha}{sufixo}:")
+        print(f"   📈 Última demanda (simulada): {metrics['ultima_demanda']:.0f} passageiros")
         print(f"   🤖 Random Forest: {metrics['rf_previsao']:.0f} passageiros")
         print(f"   📊 ARIMA: {metrics['arima_previsao']:.0f} passageiros")
         print(f"   🎯 Combinação: {metrics['combinada']:.0f} passageiros")
-        print(f"   📐 RMSE: {metrics['rmse']:.2f}")
-        print(f"   📏 MAE: {metrics['mae']:.2f}")
-        print(f"   📊 MAPE: {metrics['mape']:.2f}%")
+        if linha in mape_backtest:
+            print(f"   📊 MAPE (backtest): {mape_backtest[linha]:.2f}%")
+    
+    if not mape_backtest:
+        print("\n💡 Acurácia fora da amostra: execute python src/backtest.py")
     
-    # Salvar modelo
-    joblib.dump(rf_model, 'dados/modelo_final.pkl')
-    joblib.dump(features_rf, 'dados/features_finais.pkl')
+    resumo = {
+        'gerado_em': datetime.now().isoformat(timespec='seconds'),
+        'workers': workers or os.cpu_count(),
+        'incremental': incremental,
+        'alvo': ALVO_DEMANDA,
+        'treinadas': sum(m['status'] == 'treinada' for m in relatorio.values()),
+        'inalteradas': sum(m['status'] == 'inalterada' for m in relatorio.values()),
+        'falhas': sum(m['status'] == 'falha' for m in relatorio.values()),
+        'tempo_s': duracao,
+    }
+    salvar_relatorio(relatorio, resumo)
     
-    print(f"\n✅ Modelo treinado para {len(resultados)} linhas!")
-    print("💾 Salvo em: dados/modelo_final.pkl")
+    print(f"\n✅ Modelo treinado para {resumo['treinadas']} linhas "
+          f"({resumo['inalteradas']} sem mudanças, {resumo['falhas']} falhas) em {duracao:.1f}s!")
+    
+    # Um artefato por linha + manifesto (linhas inalteradas mantêm o artefato anterior)
+    if modelos:
+        registro = RegistroModelos()
+        for linha, modelo in modelos.items():
+            registro.salvar(linha, modelo, impressao=relatorio[linha]['impressao'],
+                            registros=relatorio[linha]['registros'])
+        registro.salvar_manifesto(features_rf)
+        print(f"💾 Registro de modelos: {registro.caminho} (versão {registro.versao})")
+        
+        # Previsões de toda a grade discreta (consultas sem rodar o RF)
+        construir_cubo(registro, modelos)
+    print(f"📄 Relatório: {RELATORIO_TREINO_PATH}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Treino ARIMA + Random Forest por linha")
+    parser.add_argument("--workers", type=int, default=None, help="Processos em paralelo (padrão: CPUs)")
+    parser.add_argument("--incremental", action="store_true", help="Treinar apenas linhas com dados novos")
+    parser.add_argument("--apenas-arima", action="store_true",
+                        help="Só atualizar as previsões ARIMA com as horas novas (sem treinar o RF)")
+    parser.add_argument("--reajustar-arima", action="store_true",
+                        help="Descartar o estado salvo e refazer o ajuste ARIMA de todas as linhas")
+    args = parser.parse_args()
+    if args.apenas_arima:
+        atualizar_previsoes_arima()
+    else:
+        main(workers=args.workers, incremental=args.incremental, reajustar_arima=args.reajustar_arima)
\ No newline at end of file
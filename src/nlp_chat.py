@@ -4,6 +4,10 @@ from datetime import datetime
 import pandas as pd
 from pln_processor import ProcessadorPLN
 from contexto_planejamento import obter_resumo_contexto
+from cubo_lotacao import ajustar_a_grade
+from feature_store import entradas_por_horario, features_compativeis
+from floresta_plana import FlorestaPlana, exportavel
+from previsao_lotacao import PrevisorLotacao
 
 # Carregar modelo de português do spaCy
 try:
@@ -15,10 +19,13 @@ except:
 class ChatbotNLP:
     """Chatbot com NLP avançado para sistema de transporte"""
     
-    def __init__(self, modelo_ml=None, features=None, df_onibus=None):
-        self.modelo_ml = modelo_ml
+    def __init__(self, modelo_ml=None, features=None, df_onibus=None, registro=None):
+        # Florestas viram arrays planos: previsões de uma linha sem o custo de validação do scikit-learn
+        self.modelo_ml = FlorestaPlana.do_modelo(modelo_ml) if modelo_ml is not None and exportavel(modelo_ml) else modelo_ml
         self.features = features
         self.df_onibus = df_onibus
+        self.registro = registro  # RegistroModelos: um modelo por linha
+        self.previsor = PrevisorLotacao(registro) if registro is not None else None
         
         # Integrar processador PLN
         self.processador_pln = ProcessadorPLN()
@@ -87,26 +94,33 @@ class ChatbotNLP:
             return max(scores, key=scores.get)
         return 'ajuda'
     
-    def prever_lotacao(self, hora=None, dia_semana=None):
-        """Previsão de lotação usando ML"""
-        if self.modelo_ml is None:
-            return None
+    def prever_lotacao(self, hora=None, dia_semana=None, linha=None):
+        """Previsão de lotação usando o modelo da linha (ou a média das linhas conhecidas)"""
+        if hora is None:
+            agora = datetime.now()
+            hora = agora.hour
+            dia_semana = agora.weekday()
         
-        try:
-            import joblib
-            if hora is None:
-                agora = datetime.now()
-                hora = agora.hour
-                dia_semana = agora.weekday()
-            
-            # Criar DataFrame para previsão
-            previsao_df = pd.DataFrame([[hora, dia_semana, 30]], columns=self.features)
-            previsao = self.modelo_ml.predict(previsao_df)[0]
-            
-            return previsao
-        except Exception as e:
-            print(f"Erro na previsão: {e}")
+        if self.registro is not None:
+            linhas = [linha] if linha else [l for l in self.linhas_conhecidas if l in self.registro]
+            if not linhas:
+                return None
+            velocidades = 30.0
+            if self.df_onibus is not None and 'velocidade' in self.df_onibus.columns:
+                velocidades = ajustar_a_grade(pd.Series(linhas, dtype=object).map(
+                    self.df_onibus.groupby('linha')['velocidade'].mean()).fillna(30).to_numpy())
+            previsao = self.previsor.prever(hora, dia_semana, linhas, velocidades, ruido=False)
+            do_modelo = previsao.lotacao[~previsao.heuristica]
+            return float(do_modelo.mean()) if len(do_modelo) else None
+        
+        if self.modelo_ml is None or not features_compativeis(self.features):
             return None
+        
+        # Mesmas features do treino, via feature store
+        if dia_semana is None:
+            dia_semana = datetime.now().weekday()
+        previsao_df = entradas_por_horario(self.features, [hora], dia_semana)
+        return float(self.modelo_ml.predict(previsao_df)[0])
     
     def gerar_resposta(self, pergunta):
         """Gera resposta inteligente usando NLP"""
@@ -120,7 +134,8 @@ class ChatbotNLP:
         resposta = ""
 
         if intencao == 'lotacao':
-            previsao = self.prever_lotacao()
+            linha = entidades['linhas'][0] if entidades['linhas'] else None
+            previsao = self.prever_lotacao(linha=linha)
             if previsao:
                 if previsao > 85:
                     status = "⛔ LOTADO"
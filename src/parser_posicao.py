@@ -0,0 +1,179 @@
+"""
+Leitura do payload /Posicao da API Olho Vivo direto para arrays colunares.
+
+O JSON é percorrido em streaming (com `ijson`, quando instalado), uma linha
+de ônibus por vez, e os veículos de cada linha são copiados para arrays
+pré-alocados, sem consultar o relógio por veículo. O filtro geográfico de
+São Paulo é aplicado depois, como máscara vetorizada, e todo o lote recebe
+um único timestamp de coleta.
+
+O ganho do streaming é de memória (só os dicts de uma linha existem por
+vez, não o payload inteiro): em tempo, o parser incremental do `ijson` é
+mais lento que um `json.loads` do corpo completo, e `ler_posicoes_dict`
+continua sendo o caminho mais rápido quando o payload já está carregado.
+"""
+
+from __future__ import annotations
+
+import json
+from dataclasses import dataclass
+from datetime import datetime
+from typing import IO, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+try:
+    import ijson
+    IJSON_DISPONIVEL = True
+except ImportError:
+    IJSON_DISPONIVEL = False
+
+
+# Região metropolitana de São Paulo (mesmos limites de validar_coordenadas_sp)
+LAT_MIN, LAT_MAX = -23.8, -23.3
+LON_MIN, LON_MAX = -46.9, -46.3
+
+CAPACIDADE_INICIAL = 16384
+
+# Erros de um corpo JSON truncado ou malformado (os do ijson não são ValueError)
+ERROS_JSON = (ValueError, ijson.JSONError) if IJSON_DISPONIVEL else (ValueError,)
+
+
+@dataclass
+class ColunasPosicao:
+    """Arrays colunares de um payload /Posicao (antes do filtro geográfico)."""
+
+    codigos_linha: List[str]
+    linha_idx: np.ndarray
+    prefixo: np.ndarray
+    lat: np.ndarray
+    lon: np.ndarray
+    ta: np.ndarray
+    total_linhas: int = 0
+
+    def __len__(self) -> int:
+        return len(self.lat)
+
+
+def _ou(valor, padrao):
+    return padrao if valor is None else valor
+
+
+class _Buffer:
+    """Arrays pré-alocados que dobram de tamanho quando enchem."""
+
+    def __init__(self, capacidade: int):
+        self.n = 0
+        self.linha_idx = np.empty(capacidade, dtype=np.int32)
+        self.prefixo = np.empty(capacidade, dtype=np.int64)
+        self.lat = np.empty(capacidade, dtype=np.float64)
+        self.lon = np.empty(capacidade, dtype=np.float64)
+        self.ta = np.empty(capacidade, dtype=object)
+
+    def _crescer(self) -> None:
+        for nome in ("linha_idx", "prefixo", "lat", "lon", "ta"):
+            antigo = getattr(self, nome)
+            novo = np.empty(len(antigo) * 2, dtype=antigo.dtype)
+            novo[: self.n] = antigo[: self.n]
+            setattr(self, nome, novo)
+
+    def estender(self, linha_idx: int, veiculos: List[Dict]) -> None:
+        """Copia os veículos de uma linha para os arrays (uma fatia por coluna)."""
+        veiculos = [v for v in veiculos if v]
+        n = len(veiculos)
+        while self.n + n > len(self.lat):
+            self._crescer()
+
+        fatia = slice(self.n, self.n + n)
+        self.linha_idx[fatia] = linha_idx
+        # Campos ausentes ou null: prefixo -1 e coordenadas NaN (descartadas pelo filtro)
+        self.prefixo[fatia] = [_ou(v.get("p"), -1) for v in veiculos]
+        self.lat[fatia] = [_ou(v.get("py"), np.nan) for v in veiculos]
+        self.lon[fatia] = [_ou(v.get("px"), np.nan) for v in veiculos]
+        self.ta[fatia] = [v.get("ta") for v in veiculos]
+        self.n += n
+
+    def finalizar(self, codigos: List[str]) -> ColunasPosicao:
+        n = self.n
+        return ColunasPosicao(
+            codigos_linha=codigos,
+            linha_idx=self.linha_idx[:n],
+            prefixo=self.prefixo[:n],
+            lat=self.lat[:n],
+            lon=self.lon[:n],
+            ta=self.ta[:n],
+            total_linhas=len(codigos),
+        )
+
+
+def ler_posicoes_stream(fonte: IO[bytes]) -> ColunasPosicao:
+    """
+    Percorre o JSON em streaming a partir de um arquivo/resposta binária.
+
+    Apenas uma linha (`l[i]`) fica materializada por vez; seus veículos são
+    copiados para os arrays colunares antes de ler a próxima.
+    """
+    if not IJSON_DISPONIVEL:
+        return ler_posicoes_dict(json.load(fonte))
+
+    buffer = _Buffer(CAPACIDADE_INICIAL)
+    codigos: List[str] = []
+
+    for linha in ijson.items(fonte, "l.item", use_float=True):
+        _copiar_linha(linha, buffer, codigos)
+
+    return buffer.finalizar(codigos)
+
+
+def ler_posicoes_dict(dados: Optional[Dict]) -> ColunasPosicao:
+    """Mesma conversão para um payload já carregado como dict."""
+    linhas_api = (dados or {}).get("l") or []
+    total = sum(len(linha.get("vs") or []) for linha in linhas_api if linha)
+    buffer = _Buffer(max(total, 1))
+    codigos: List[str] = []
+
+    for linha in linhas_api:
+        _copiar_linha(linha, buffer, codigos)
+
+    return buffer.finalizar(codigos)
+
+
+def _copiar_linha(linha: Optional[Dict], buffer: _Buffer, codigos: List[str]) -> None:
+    if not linha:
+        return
+    codigos.append(str(linha.get("c", "")))
+    buffer.estender(len(codigos) - 1, linha.get("vs") or [])
+
+
+def para_dataframe(colunas: ColunasPosicao, momento: Optional[datetime] = None) -> pd.DataFrame:
+    """
+    Aplica o filtro geográfico e monta o DataFrame no formato do coletor.
+
+    Todas as linhas recebem o mesmo `timestamp` (momento da coleta); o horário
+    de cada posição informado pela API vai para `timestamp_api`.
+    """
+    momento = momento or datetime.now()
+    mascara = ((colunas.lat >= LAT_MIN) & (colunas.lat <= LAT_MAX)
+               & (colunas.lon >= LON_MIN) & (colunas.lon <= LON_MAX))
+
+    codigos = np.asarray(colunas.codigos_linha, dtype=object)
+    prefixos = colunas.prefixo[mascara]
+    df = pd.DataFrame({
+        "linha": codigos[colunas.linha_idx[mascara]] if len(codigos) else np.empty(0, dtype=object),
+        "prefixo": np.where(prefixos >= 0, prefixos.astype(str), ""),
+        "velocidade": np.zeros(int(mascara.sum()), dtype=np.float64),
+        "lat": colunas.lat[mascara],
+        "lon": colunas.lon[mascara],
+        "timestamp": pd.Timestamp(momento),
+    })
+
+    # Horário da posição informado pela API (UTC) convertido para horário local
+    df["timestamp_api"] = (
+        pd.to_datetime(pd.Series(colunas.ta[mascara]), utc=True, errors="coerce", format="ISO8601")
+        .dt.tz_convert("America/Sao_Paulo")
+        .dt.tz_localize(None)
+        .fillna(df["timestamp"])
+    )
+    df["fonte_dados"] = "real"  # Flag indicando dados reais da API
+    return df
@@ -0,0 +1,183 @@
+"""
+Previsão de lotação em lote para o dashboard e o chat.
+
+Recebe arrays de hora, dia da semana, linha e velocidade e devolve todas as
+previsões de uma vez: as entradas saem do feature store em lote (um único
+cálculo de contexto). Linhas presentes no cubo materializado da versão atual do
+registro, com velocidade sobre a grade dele, são respondidas por indexação
+(as mesmas previsões do modelo, em float16); as demais linhas com modelo
+recebem uma única chamada a `predict` com as combinações distintas, e o
+restante sai da heurística de horários de SP, calculada de forma vetorizada.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from cubo_lotacao import CuboLotacao
+from feature_store import entradas_por_horario
+from floresta_plana import FlorestaPlana
+from registro_modelos import RegistroModelos
+
+
+RUIDO_MODELO = 3.0  # Desvio da variação somada às previsões do modelo
+LIMITES_MODELO = (10, 100)
+
+
+@dataclass
+class PrevisaoLotacao:
+    """Lotação prevista por linha de entrada e quais vieram da heurística."""
+
+    lotacao: np.ndarray
+    heuristica: np.ndarray  # True onde não havia modelo (ou ele falhou)
+
+    def __len__(self) -> int:
+        return len(self.lotacao)
+
+    @property
+    def total_heuristica(self) -> int:
+        return int(self.heuristica.sum())
+
+
+def lotacao_heuristica(horas, dias_semana) -> np.ndarray:
+    """
+    Predição baseada em padrões conhecidos de SP (fallback sem modelo).
+    NOTA: API SPTrans não fornece dados de ocupação em tempo real
+    """
+    horas = np.asarray(horas)
+    # Fim de semana tem menos lotação
+    fator_fds = np.where(np.asarray(dias_semana) >= 5, 0.7, 1.0)
+
+    # Horários de pico (a primeira faixa que casa vale, como na versão escalar)
+    base = np.select(
+        [(7 <= horas) & (horas <= 9),
+         (17 <= horas) & (horas <= 19),
+         (12 <= horas) & (horas <= 14),
+         (5 <= horas) & (horas <= 7),
+         (20 <= horas) & (horas <= 22)],
+        [85, 80, 65, 60, 55],
+        default=40,
+    )
+    return np.floor(base * fator_fds).astype(np.float64)
+
+
+class PrevisorLotacao:
+    """Previsões de lotação em lote a partir do registro de modelos por linha."""
+
+    def __init__(self, registro: Optional[RegistroModelos] = None, usar_cubo: bool = True):
+        self.registro = registro
+        self.usar_cubo = usar_cubo
+        self._cubo: Optional[CuboLotacao] = None
+
+    def cubo(self) -> Optional[CuboLotacao]:
+        """Cubo da versão atual do registro (None se ausente ou desatualizado)."""
+        if not self.usar_cubo or self.registro is None:
+            return None
+        versao = self.registro.versao
+        if self._cubo is None or self._cubo.versao != versao:
+            cubo = CuboLotacao.carregar(self.registro.caminho)
+            self._cubo = cubo if cubo is not None and cubo.versao == versao else None
+        return self._cubo
+
+    def prever(
+        self,
+        horas,
+        dias_semana=None,
+        linhas=None,
+        velocidades=30.0,
+        ruido: bool = True,
+        rng: Optional[np.random.Generator] = None,
+    ) -> PrevisaoLotacao:
+        """
+        Prevê a lotação de cada posição dos arrays (escalares são repetidos).
+
+        Args:
+            horas: Hora do dia de cada previsão
+            dias_semana: Dia da semana (None = hoje)
+            linhas: Código da linha (None = sem modelo, apenas heurística)
+            velocidades: Velocidade média da linha (km/h)
+            ruido: Soma uma pequena variação aleatória às previsões do modelo
+        """
+        if dias_semana is None:
+            dias_semana = datetime.now().weekday()
+        horas, dias, velocidades, linhas = np.broadcast_arrays(
+            np.asarray(horas, dtype=np.int64).reshape(-1),
+            np.asarray(dias_semana, dtype=np.int64),
+            np.asarray(velocidades, dtype=np.float64),
+            np.asarray(linhas, dtype=object),
+        )
+
+        lotacao = lotacao_heuristica(horas, dias)
+        heuristica = np.ones(len(horas), dtype=bool)
+        if self.registro is None or len(horas) == 0:
+            return PrevisaoLotacao(lotacao, heuristica)
+
+        # Posições cujas linhas têm modelo no registro
+        codigos, unicas = pd.factorize(pd.Series(linhas, dtype=object), use_na_sentinel=True)
+        registradas = [i for i, l in enumerate(unicas) if l in self.registro]
+        com_modelo = np.flatnonzero(np.isin(codigos, registradas))
+        if len(com_modelo) == 0:
+            return PrevisaoLotacao(lotacao, heuristica)
+
+        features = self.registro.features
+        entradas = entradas_por_horario(features, horas[com_modelo], dias[com_modelo], velocidades[com_modelo])
+
+        # Consulta ao cubo: linhas materializadas com a mesma tabela semanal de contexto
+        cubo = self.cubo()
+        if cubo is not None:
+            no_cubo = np.isin(linhas[com_modelo], list(cubo.indice)) & cubo.contexto_valido(
+                dias[com_modelo], horas[com_modelo], entradas)
+            if no_cubo.any():
+                destino = com_modelo[no_cubo]
+                consulta = cubo.consultar(
+                    linhas[destino], dias[destino], horas[destino],
+                    entradas["feriado_flag"].to_numpy()[no_cubo] if "feriado_flag" in entradas else 0,
+                    entradas["tem_evento_relevante"].to_numpy()[no_cubo] if "tem_evento_relevante" in entradas else 0,
+                    velocidades[destino],
+                )
+                # NaN (linha sem artefato ao gerar o cubo, velocidade fora da grade): inferência ao vivo
+                respondidas = ~np.isnan(consulta)
+                lotacao[destino[respondidas]] = consulta[respondidas]
+                heuristica[destino[respondidas]] = False
+                no_cubo[no_cubo] = respondidas
+                com_modelo, entradas = com_modelo[~no_cubo], entradas[~no_cubo]
+
+        # Inferência ao vivo para as demais linhas com modelo (carregadas sob demanda)
+        modelos = {i: self.registro.obter(unicas[i]) for i in np.unique(codigos[com_modelo])}
+        matriz = entradas.to_numpy(np.float64)
+        ordem = np.argsort(codigos[com_modelo], kind="stable")
+        grupos = np.split(ordem, np.flatnonzero(np.diff(codigos[com_modelo][ordem])) + 1) if len(ordem) else []
+
+        for grupo in grupos:
+            linha = unicas[codigos[com_modelo[grupo[0]]]]
+            # Posições com a mesma entrada compartilham a previsão
+            distintas, inversa = np.unique(matriz[grupo], axis=0, return_inverse=True)
+            modelo = modelos[codigos[com_modelo[grupo[0]]]]
+            if modelo is None:
+                continue
+            try:
+                if isinstance(modelo, FlorestaPlana):
+                    # Matriz já na ordem das features: sem validação de DataFrame por chamada.
+                    # As entradas distintas de uma linha são poucas (mesma hora, dia e
+                    # velocidade para todos os veículos), a faixa em que a floresta plana é rápida
+                    previsto = modelo.prever_matriz(distintas)
+                else:
+                    previsto = modelo.predict(pd.DataFrame(distintas, columns=features))
+            except Exception as e:
+                print(f"⚠️ Falha na previsão da linha {linha}: {e}")
+                continue
+            destino = com_modelo[grupo]
+            lotacao[destino] = previsto[inversa.reshape(-1)]
+            heuristica[destino] = False
+
+        modelo = ~heuristica
+        if ruido and modelo.any():
+            rng = rng or np.random.default_rng()
+            lotacao[modelo] += rng.normal(0, RUIDO_MODELO, int(modelo.sum()))
+        lotacao[modelo] = np.clip(lotacao[modelo], *LIMITES_MODELO)
+        return PrevisaoLotacao(lotacao, heuristica)
@@ -0,0 +1,252 @@
+"""
+Registro dos modelos de lotação treinados por linha.
+
+Cada linha tem seu próprio artefato e um manifesto JSON lista as linhas
+disponíveis, o arquivo, o formato, o tamanho e a impressão dos dados de
+treino. Florestas são gravadas em arrays planos (`floresta_plana`) abertos
+com mmap, compartilhados entre os processos pelo page cache; outros
+modelos ficam em joblib. Na hora de servir, os modelos são carregados sob
+demanda e mantidos em um cache LRU limitado por um orçamento de memória,
+então o dashboard e o chat não precisam carregar todos os modelos na
+inicialização.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import re
+import shutil
+import threading
+import zlib
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import joblib
+import pandas as pd
+
+from feature_store import VERSAO_SCHEMA, entradas_por_horario
+from floresta_plana import EXTENSAO, FlorestaPlana, exportar_floresta, exportavel
+
+
+BASE_PATH = os.path.dirname(os.path.dirname(__file__))
+REGISTRO_PATH = os.path.join(BASE_PATH, "dados", "modelos_linhas")
+MANIFESTO = "manifesto.json"
+
+ORCAMENTO_MB_PADRAO = 256
+
+
+def _nome_arquivo(linha: str, extensao: str = ".joblib") -> str:
+    """Nome de arquivo seguro e único para o código da linha."""
+    seguro = re.sub(r"[^A-Za-z0-9_-]", "_", str(linha))
+    return f"linha_{seguro}_{zlib.crc32(str(linha).encode()):08x}{extensao}"
+
+
+class RegistroModelos:
+    """Artefatos por linha + manifesto, com carga preguiçosa e LRU por memória."""
+
+    def __init__(self, caminho: str = REGISTRO_PATH, orcamento_mb: float = ORCAMENTO_MB_PADRAO):
+        self.caminho = caminho
+        self.orcamento_bytes = int(orcamento_mb * 1024 ** 2)
+        self._manifesto: Dict = {"versao": 0, "features": [], "linhas": {}}
+        self._mtime_manifesto: Optional[int] = None
+        self._cache: "OrderedDict[str, object]" = OrderedDict()
+        self._bytes_cache = 0
+        self._lock = threading.Lock()
+        self._recarregar_manifesto()
+
+    # ------------------------------------------------------------------
+    # Manifesto
+    # ------------------------------------------------------------------
+    @property
+    def _caminho_manifesto(self) -> str:
+        return os.path.join(self.caminho, MANIFESTO)
+
+    def _recarregar_manifesto(self) -> None:
+        """Relê o manifesto se ele mudou em disco (novo treino)."""
+        try:
+            mtime = os.stat(self._caminho_manifesto).st_mtime_ns
+        except OSError:
+            return
+        if mtime == self._mtime_manifesto:
+            return
+
+        try:
+            with open(self._caminho_manifesto, "r", encoding="utf-8") as arquivo:
+                manifesto = json.load(arquivo)
+        except (OSError, ValueError):
+            return
+
+        with self._lock:
+            # Descarta do cache as linhas cujo artefato mudou
+            for linha in list(self._cache):
+                novo = manifesto.get("linhas", {}).get(linha)
+                antigo = self._manifesto["linhas"].get(linha)
+                if novo is None or antigo is None or novo.get("impressao") != antigo.get("impressao"):
+                    self._descartar(linha)
+            self._manifesto = manifesto
+            self._mtime_manifesto = mtime
+
+    def salvar_manifesto(self, features: List[str]) -> None:
+        """Grava o manifesto (atômico) incrementando a versão do registro."""
+        self._manifesto["features"] = list(features)
+        self._manifesto["versao_features"] = VERSAO_SCHEMA
+        self._manifesto["versao"] = int(self._manifesto.get("versao", 0)) + 1
+        self._manifesto["atualizado_em"] = datetime.now().isoformat(timespec="seconds")
+
+        os.makedirs(self.caminho, exist_ok=True)
+        temporario = self._caminho_manifesto + ".tmp"
+        with open(temporario, "w", encoding="utf-8") as arquivo:
+            json.dump(self._manifesto, arquivo, ensure_ascii=False, indent=2)
+        os.replace(temporario, self._caminho_manifesto)
+        self._mtime_manifesto = os.stat(self._caminho_manifesto).st_mtime_ns
+
+    @property
+    def versao(self) -> int:
+        self._recarregar_manifesto()
+        return int(self._manifesto.get("versao", 0))
+
+    @property
+    def features(self) -> List[str]:
+        self._recarregar_manifesto()
+        return list(self._manifesto.get("features", []))
+
+    @property
+    def versao_features(self) -> int:
+        """Versão do schema do feature store com que os modelos foram treinados."""
+        self._recarregar_manifesto()
+        return int(self._manifesto.get("versao_features", 1))
+
+    def linhas(self) -> List[str]:
+        self._recarregar_manifesto()
+        return sorted(self._manifesto["linhas"])
+
+    def __len__(self) -> int:
+        return len(self.linhas())
+
+    def __contains__(self, linha: str) -> bool:
+        self._recarregar_manifesto()
+        return str(linha) in self._manifesto["linhas"]
+
+    def metadados(self, linha: str) -> Optional[Dict]:
+        self._recarregar_manifesto()
+        return self._manifesto["linhas"].get(str(linha))
+
+    # ------------------------------------------------------------------
+    # Escrita
+    # ------------------------------------------------------------------
+    def salvar(self, linha: str, modelo, formato: str = "auto", **metadados) -> None:
+        """
+        Grava o artefato de uma linha e registra no manifesto em memória
+        (chame `salvar_manifesto` ao final do treino).
+
+        Florestas de regressão vão para o formato plano aberto com mmap
+        (`floresta_plana`); os demais modelos, ou `formato="joblib"`, em joblib.
+        """
+        os.makedirs(self.caminho, exist_ok=True)
+        if formato == "auto" and exportavel(modelo):
+            formato = "floresta"
+            nome = _nome_arquivo(linha, EXTENSAO)
+            tamanho = exportar_floresta(modelo, os.path.join(self.caminho, nome))
+        else:
+            formato = "joblib"
+            nome = _nome_arquivo(linha)
+            destino = os.path.join(self.caminho, nome)
+            temporario = destino + ".tmp"
+            joblib.dump(modelo, temporario)
+            os.replace(temporario, destino)
+            tamanho = os.path.getsize(destino)
+
+        with self._lock:
+            self._descartar(str(linha))
+        anterior = self._manifesto["linhas"].get(str(linha))
+        if anterior and anterior["arquivo"] != nome:
+            # Troca de formato: remove o artefato antigo da linha
+            antigo = os.path.join(self.caminho, anterior["arquivo"])
+            if os.path.isdir(antigo):
+                shutil.rmtree(antigo, ignore_errors=True)
+            elif os.path.exists(antigo):
+                os.remove(antigo)
+        self._manifesto["linhas"][str(linha)] = {
+            "arquivo": nome,
+            "formato": formato,
+            "bytes": tamanho,
+            "treinado_em": datetime.now().isoformat(timespec="seconds"),
+            **metadados,
+        }
+
+    # ------------------------------------------------------------------
+    # Leitura (LRU)
+    # ------------------------------------------------------------------
+    def _descartar(self, linha: str) -> None:
+        if linha in self._cache:
+            del self._cache[linha]
+            self._bytes_cache -= self._manifesto["linhas"].get(linha, {}).get("bytes", 0)
+
+    def _liberar_espaco(self, necessario: int) -> None:
+        while self._cache and self._bytes_cache + necessario > self.orcamento_bytes:
+            linha, _ = self._cache.popitem(last=False)
+            self._bytes_cache -= self._manifesto["linhas"].get(linha, {}).get("bytes", 0)
+
+    def obter(self, linha: str):
+        """Retorna o modelo da linha (carregado sob demanda) ou None."""
+        self._recarregar_manifesto()
+        linha = str(linha)
+
+        with self._lock:
+            if linha in self._cache:
+                self._cache.move_to_end(linha)
+                return self._cache[linha]
+            registro = self._manifesto["linhas"].get(linha)
+
+        if registro is None:
+            return None
+
+        caminho = os.path.join(self.caminho, registro["arquivo"])
+        try:
+            if registro.get("formato") == "floresta":
+                modelo = FlorestaPlana.carregar(caminho)
+            else:
+                modelo = joblib.load(caminho, mmap_mode="r")
+        except (OSError, ValueError, EOFError, KeyError) as e:
+            print(f"⚠️ Falha ao carregar modelo da linha {linha}: {e}")
+            return None
+
+        with self._lock:
+            self._liberar_espaco(registro.get("bytes", 0))
+            self._cache[linha] = modelo
+            self._bytes_cache += registro.get("bytes", 0)
+        return modelo
+
+    def uso_memoria(self) -> Dict:
+        """Linhas em cache e bytes estimados (tamanho dos artefatos)."""
+        with self._lock:
+            return {"linhas": len(self._cache), "bytes": self._bytes_cache,
+                    "orcamento": self.orcamento_bytes}
+
+
+def montar_entradas(
+    features: List[str],
+    horas,
+    dias_semana=None,
+    velocidades=30.0,
+) -> pd.DataFrame:
+    """
+    Monta as entradas do modelo por linha para vários pares hora/dia da semana
+    (o contexto de planejamento é o da próxima data com cada dia da semana;
+    ver `feature_store.entradas_por_horario`).
+    """
+    if dias_semana is None:
+        dias_semana = datetime.now().weekday()
+    return entradas_por_horario(features, horas, dias_semana, velocidades)
+
+
+def montar_entrada(
+    features: List[str],
+    hora: int,
+    dia_semana: Optional[int] = None,
+    velocidade_media: float = 30.0,
+) -> pd.DataFrame:
+    """Entrada de uma única hora/dia da semana (ver `montar_entradas`)."""
+    return montar_entradas(features, [hora], dia_semana, velocidade_media)
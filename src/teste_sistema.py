@@ -57,8 +57,8 @@ def test_ml():
         modelo = joblib.load('dados/modelo_lotacao.pkl')
         features = joblib.load('dados/features.pkl')
         
-        import pandas as pd
-        teste_df = pd.DataFrame([[14, 2, 30]], columns=features)
+        from feature_store import entradas_por_horario
+        teste_df = entradas_por_horario(features, [14], 2)
         previsao = modelo.predict(teste_df)[0]
         
         if 0 <= previsao <= 100:
@@ -74,8 +74,8 @@ def test_ml():
 def test_data():
     """Testa os dados"""
     try:
-        import pandas as pd
-        df = pd.read_csv('dados/dados_onibus.csv')
+        from historico_posicoes import HistoricoPosicoes
+        df = HistoricoPosicoes().ultimo_snapshot()
         
         if len(df) > 0:
             print(f"✅ Dados carregados - {len(df)} registros")
@@ -89,6 +89,94 @@ def test_data():
         print(f"❌ Erro ao carregar dados: {e}")
         return False
 
+def _servidor_clima_local(falhar_a_partir=None):
+    """
+    Servidor HTTP local que imita o endpoint de arquivo do Open-Meteo.
+    Blocos que começam em `falhar_a_partir` ou depois respondem 503
+    (simula uma execução interrompida no meio).
+    """
+    import json
+    import threading
+    from datetime import date
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from urllib.parse import parse_qs, urlparse
+
+    import pandas as pd
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            params = {k: v[0] for k, v in parse_qs(urlparse(self.path).query).items()}
+            inicio = date.fromisoformat(params['start_date'])
+            self.server.requisicoes.append(inicio)
+            if falhar_a_partir is not None and inicio >= falhar_a_partir:
+                self.send_response(503)
+                self.end_headers()
+                return
+            horas = pd.date_range(params['start_date'], f"{params['end_date']} 23:00", freq='h')
+            n = len(horas)
+            corpo = json.dumps({'hourly': {
+                'time': horas.strftime('%Y-%m-%dT%H:%M').tolist(),
+                'temperature_2m': [20.0 + h.hour / 2 for h in horas],
+                'relative_humidity_2m': [70.0] * n,
+                'precipitation': [0.0] * n,
+                'weather_code': [1] * n,
+                'wind_speed_10m': [8.0] * n,
+            }}).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(corpo)))
+            self.end_headers()
+            self.wfile.write(corpo)
+
+        def log_message(self, *args):
+            pass
+
+    servidor = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    servidor.requisicoes = []
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor
+
+def test_backfill_clima():
+    """Testa o backfill climático contra um servidor local (com retomada)"""
+    import tempfile
+    from datetime import date
+
+    try:
+        from backfill_clima import carregar_clima_historico, dividir_intervalo, executar_backfill
+
+        inicio, fim = date(2024, 1, 1), date(2024, 3, 31)
+        ultimo_bloco = dividir_intervalo(inicio, fim, 31)[-1][0]
+        with tempfile.TemporaryDirectory() as pasta:
+            kwargs = dict(workers=2, requisicoes_por_s=0, dias_por_bloco=31, tentativas=1,
+                          partes=os.path.join(pasta, 'partes'), destino=os.path.join(pasta, 'clima.parquet'))
+
+            # 1ª execução "interrompida": o último bloco falha
+            servidor = _servidor_clima_local(falhar_a_partir=ultimo_bloco)
+            url = f"http://127.0.0.1:{servidor.server_port}/v1/archive"
+            parcial = executar_backfill(inicio, fim, url=url, **kwargs)
+            servidor.shutdown()
+
+            # 2ª execução: só o bloco que faltou é consultado
+            servidor = _servidor_clima_local()
+            url = f"http://127.0.0.1:{servidor.server_port}/v1/archive"
+            final = executar_backfill(inicio, fim, url=url, **kwargs)
+            servidor.shutdown()
+
+            clima = carregar_clima_historico(caminho=kwargs['destino'])
+            esperado = ((fim - inicio).days + 1) * 24
+            ok = (parcial['falhas'] == 1 and final['existentes'] == 2 and final['baixados'] == 1
+                  and servidor.requisicoes == [ultimo_bloco]
+                  and len(clima) == esperado and clima['hora'].is_monotonic_increasing)
+
+        if ok:
+            print(f"✅ Backfill climático funcionando - {esperado} horas, retomada só do bloco pendente")
+            return True
+        print(f"⚠️ Backfill climático inconsistente: {parcial} → {final}, {len(clima)} horas")
+        return False
+    except Exception as e:
+        print(f"❌ Erro no backfill climático: {e}")
+        return False
+
 def main():
     """Função principal de teste"""
     print("\n" + "🔍"*30)
@@ -136,7 +224,7 @@ def main():
         print("✅ Pasta 'dados/' existe")
         
         data_files = [
-            'dados/dados_onibus.csv',
+            'dados/historico',
             'dados/modelo_lotacao.pkl',
             'dados/features.pkl'
         ]
@@ -159,6 +247,9 @@ def main():
     print("\n🧪 Testando NLP...")
     nlp_test = test_nlp()
     
+    print("\n🧪 Testando Backfill Climático (servidor local)...")
+    backfill_test = test_backfill_clima()
+    
     # 5. Verificar spaCy
     print_section("5️⃣ VERIFICANDO MODELO SPACY")
     
@@ -175,18 +266,19 @@ def main():
     # 6. Resumo Final
     print_section("📊 RESUMO FINAL")
     
-    total_checks = 5
+    total_checks = 6
     passed_checks = sum([
         modules_ok >= 8,  # Pelo menos 8 de 9 módulos
         files_ok >= 6,    # Pelo menos 6 de 7 arquivos
         data_ok >= 2,     # Pelo menos 2 de 3 arquivos de dados
         ml_test or data_test,  # ML ou Dados funcionando
-        nlp_test or not spacy_ok  # NLP funcionando ou spaCy não instalado (esperado)
+        nlp_test or not spacy_ok,  # NLP funcionando ou spaCy não instalado (esperado)
+        backfill_test
     ])
     
     print(f"\n✅ Checks passados: {passed_checks}/{total_checks}")
     
-    if passed_checks >= 4:
+    if passed_checks >= 5:
         print("\n" + "🎉"*20)
         print("  ✅ SISTEMA PRONTO PARA USO!")
         print("  Execute: python main.py")
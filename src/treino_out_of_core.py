@@ -0,0 +1,292 @@
+"""
+Treino do modelo geral de lotação sem carregar o histórico na memória.
+
+O histórico colunar é lido em lotes (`HistoricoPosicoes.ler_em_lotes`) e
+cada lote passa pelo feature store. Dois modos:
+
+- `sgd`: modelos com `partial_fit` (SGDRegressor padronizado) aprendem lote
+  a lote, em quantas épocas forem pedidas;
+- `rf`: uma única passada mantém uma amostra de reservatório estratificada
+  por (dia da semana, hora) e a floresta é treinada só com a amostra.
+
+O tamanho do lote e da amostra sai de um orçamento de memória configurável,
+e cada época registra tempo e dois picos de memória: o das alocações
+Python/NumPy (tracemalloc) e o RSS do processo, que inclui os buffers do
+Arrow e das bibliotecas nativas.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Optional, Tuple
+
+try:
+    import resource
+    RESOURCE_DISPONIVEL = True
+except ImportError:  # Windows
+    RESOURCE_DISPONIVEL = False
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.linear_model import SGDRegressor
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import StandardScaler
+
+from backfill_clima import preencher_clima_historico
+from feature_store import FEATURES_GERAL, build_features
+from historico_posicoes import HistoricoPosicoes
+
+
+BASE_PATH = os.path.dirname(os.path.dirname(__file__))
+MODELO_PATH = os.path.join(BASE_PATH, "dados", "modelo_lotacao.pkl")
+FEATURES_PKL_PATH = os.path.join(BASE_PATH, "dados", "features.pkl")
+RELATORIO_PATH = os.path.join(BASE_PATH, "dados", "relatorio_treino_out_of_core.json")
+
+COLUNAS_HISTORICO = ["timestamp", "velocidade", "temperatura", "umidade", "precipitacao"]
+DIAS_TREINO = 90
+MEMORIA_MB_PADRAO = 256
+EPOCAS_PADRAO = 3
+SEMENTE = 42
+
+# Divisão do orçamento: lote lido do disco (colunas brutas, features e cópias
+# intermediárias) e amostra das árvores (float32 por feature + alvo)
+FRACAO_LOTE = 0.25
+FRACAO_AMOSTRA = 0.5
+BYTES_POR_REGISTRO_LOTE = 512
+N_ESTRATOS = 7 * 24
+
+
+def simular_lotacao(horas: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+    """Lotação simulada (a API não informa ocupação), como em ml_simples."""
+    lotacao = rng.integers(20, 100, len(horas))
+    lotacao[(7 <= horas) & (horas <= 9)] += 20
+    lotacao[(17 <= horas) & (horas <= 19)] += 15
+    return np.clip(lotacao, 0, 100).astype(np.float32)
+
+
+def dimensionar(memoria_mb: float, n_features: int) -> Tuple[int, int]:
+    """(registros por lote, capacidade da amostra) para o orçamento em MB."""
+    orcamento = memoria_mb * 1024 ** 2
+    tamanho_lote = max(1_000, int(orcamento * FRACAO_LOTE / BYTES_POR_REGISTRO_LOTE))
+    capacidade = max(N_ESTRATOS, int(orcamento * FRACAO_AMOSTRA / (4 * (n_features + 1))))
+    return tamanho_lote, capacidade
+
+
+class AmostraEstratificada:
+    """
+    Reservatório (algoritmo R) com `capacidade // n_estratos` vagas por
+    estrato, atualizado de forma vetorizada lote a lote: cada estrato fica
+    com uma amostra uniforme dos seus registros, independente do volume
+    dos demais (madrugadas não são engolidas pelos horários de pico).
+    """
+
+    def __init__(self, capacidade: int, n_features: int, n_estratos: int = N_ESTRATOS,
+                 rng: Optional[np.random.Generator] = None):
+        self.vagas = max(1, capacidade // n_estratos)
+        self.n_estratos = n_estratos
+        self.X = np.empty((self.vagas * n_estratos, n_features), dtype=np.float32)
+        self.y = np.empty(self.vagas * n_estratos, dtype=np.float32)
+        self.vistos = np.zeros(n_estratos, dtype=np.int64)
+        self.rng = rng or np.random.default_rng(SEMENTE)
+
+    @property
+    def nbytes(self) -> int:
+        return self.X.nbytes + self.y.nbytes
+
+    def adicionar(self, X: np.ndarray, y: np.ndarray, estratos: np.ndarray) -> None:
+        ordem = np.argsort(estratos, kind="stable")
+        estratos = estratos[ordem]
+        inicio_grupo = np.searchsorted(estratos, estratos, side="left")
+        # Posição (1-based) de cada registro entre todos já vistos do seu estrato
+        posicao = self.vistos[estratos] + np.arange(len(estratos)) - inicio_grupo + 1
+
+        vaga = posicao - 1
+        cheio = posicao > self.vagas
+        aceito = ~cheio | (self.rng.random(len(posicao)) * posicao < self.vagas)
+        vaga[cheio] = self.rng.integers(0, self.vagas, int(cheio.sum()))
+
+        destino = estratos[aceito] * self.vagas + vaga[aceito]
+        origem = ordem[aceito]
+        # Se dois registros do lote caem na mesma vaga, vale o último (como no algoritmo sequencial)
+        destino_rev, primeiro = np.unique(destino[::-1], return_index=True)
+        origem = origem[::-1][primeiro]
+        self.X[destino_rev] = X[origem]
+        self.y[destino_rev] = y[origem]
+        self.vistos += np.bincount(estratos, minlength=self.n_estratos)
+
+    def dados(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Registros preenchidos da amostra (estratos com poucos dados têm vagas livres)."""
+        ocupadas = np.minimum(self.vistos, self.vagas)
+        indices = (np.arange(self.n_estratos)[:, None] * self.vagas + np.arange(self.vagas)[None, :])
+        indices = indices[np.arange(self.vagas)[None, :] < ocupadas[:, None]]
+        return self.X[indices], self.y[indices]
+
+
+def lotes_treino(
+    historico: HistoricoPosicoes,
+    features: List[str],
+    inicio: datetime,
+    tamanho_lote: int,
+) -> Iterator[Tuple[pd.DataFrame, np.ndarray]]:
+    """(features, lotação) de cada lote do histórico; o alvo é o mesmo em toda época."""
+    for indice, lote in enumerate(historico.ler_em_lotes(COLUNAS_HISTORICO, inicio=inicio, tamanho_lote=tamanho_lote)):
+        lote = preencher_clima_historico(lote)
+        X = build_features(lote, features)
+        rng = np.random.default_rng([SEMENTE, indice])
+        yield X, simular_lotacao(X["hora"].to_numpy(), rng)
+
+
+def _zerar_pico_rss() -> None:
+    """Reinicia o pico de RSS do processo (Linux); sem suporte, o pico é o acumulado."""
+    try:
+        with open("/proc/self/clear_refs", "w") as arquivo:
+            arquivo.write("5")
+    except OSError:
+        pass
+
+
+def _pico_rss_mb() -> float:
+    """Maior RSS do processo desde o último `_zerar_pico_rss` (ou desde o início)."""
+    try:
+        with open("/proc/self/status", "r") as arquivo:
+            for linha in arquivo:
+                if linha.startswith("VmHWM:"):
+                    return int(linha.split()[1]) / 1024
+    except OSError:
+        pass
+    if not RESOURCE_DISPONIVEL:
+        return float("nan")
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return pico / 1024 ** 2 if os.uname().sysname == "Darwin" else pico / 1024  # bytes no macOS, KB no Linux
+
+
+def _epoca(numero: int, etapa: str, funcao) -> Dict:
+    """Roda uma época medindo tempo, pico das alocações Python/NumPy e pico de RSS."""
+    tracemalloc.reset_peak()
+    _zerar_pico_rss()
+    rss_inicio = _pico_rss_mb()  # Logo após zerar, o pico é o RSS atual
+    inicio = time.perf_counter()
+    metricas = funcao()
+    _, pico = tracemalloc.get_traced_memory()
+    metricas.update({"epoca": numero, "etapa": etapa, "tempo_s": time.perf_counter() - inicio,
+                     "pico_python_mb": pico / 1024 ** 2, "pico_rss_mb": _pico_rss_mb(), "rss_inicio_mb": rss_inicio})
+    erro = next((f", {nome.replace('_', ' ')} {metricas[nome]:.2f}"
+                 for nome in ("mae_progressivo", "mae_treino") if nome in metricas), "")
+    print(f"   ⏱️ Época {numero} ({etapa}): {metricas['registros']:,} registros em {metricas['tempo_s']:.1f}s, "
+          f"pico de {metricas['pico_python_mb']:.1f} MB (Python/NumPy), RSS {metricas['pico_rss_mb']:.0f} MB "
+          f"(+{metricas['pico_rss_mb'] - rss_inicio:.0f} MB na época)" + erro)
+    return metricas
+
+
+def treinar_out_of_core(
+    modelo: str = "sgd",
+    memoria_mb: float = MEMORIA_MB_PADRAO,
+    epocas: int = EPOCAS_PADRAO,
+    dias: int = DIAS_TREINO,
+    historico: Optional[HistoricoPosicoes] = None,
+    salvar: bool = True,
+):
+    """
+    Treina o modelo geral de lotação lendo o histórico em lotes.
+
+    Args:
+        modelo: 'sgd' (partial_fit por lote) ou 'rf' (floresta sobre a amostra estratificada)
+        memoria_mb: Orçamento de memória que define lote e amostra
+        epocas: Passadas sobre o histórico (apenas 'sgd'; 'rf' faz uma)
+        dias: Janela de histórico usada no treino
+
+    Returns:
+        (modelo treinado, métricas por época), ou (None, []) se não houver histórico
+    """
+    if modelo not in ("sgd", "rf"):
+        raise ValueError(f"Modelo desconhecido: {modelo} (opções: sgd, rf)")
+    historico = historico or HistoricoPosicoes()
+    features = list(FEATURES_GERAL)
+    tamanho_lote, capacidade = dimensionar(memoria_mb, len(features))
+    inicio = datetime.now() - timedelta(days=dias)
+    print(f"🌊 Treino out-of-core ({modelo}): lotes de {tamanho_lote:,} registros, "
+          f"orçamento de {memoria_mb:.0f} MB, {dias} dias de histórico")
+
+    registros_epocas: List[Dict] = []
+    rastreando = tracemalloc.is_tracing()
+    if not rastreando:
+        tracemalloc.start()
+    try:
+        if modelo == "sgd":
+            escalador = StandardScaler()
+            regressor = SGDRegressor(random_state=SEMENTE)
+
+            def passada():
+                primeira = not registros_epocas
+                total, avaliados, erro = 0, 0, 0.0
+                for X, y in lotes_treino(historico, features, inicio, tamanho_lote):
+                    if total or not primeira:
+                        # Erro antes de aprender o lote: validação progressiva só na 1ª época
+                        # (nas seguintes o modelo já viu o lote, é erro de treino)
+                        erro += float(np.abs(regressor.predict(escalador.transform(X)) - y).sum())
+                        avaliados += len(y)
+                    if primeira:
+                        escalador.partial_fit(X)
+                    regressor.partial_fit(escalador.transform(X), y)
+                    total += len(y)
+                mae = erro / avaliados if avaliados else float("nan")
+                return {"registros": total, "mae_progressivo" if primeira else "mae_treino": mae}
+
+            for numero in range(1, epocas + 1):
+                registros_epocas.append(_epoca(numero, "partial_fit", passada))
+                if registros_epocas[-1]["registros"] == 0:
+                    break
+            treinado = Pipeline([("escala", escalador), ("sgd", regressor)])
+        else:
+            amostra = AmostraEstratificada(capacidade, len(features))
+            print(f"   🎲 Amostra estratificada: {amostra.vagas * amostra.n_estratos:,} registros "
+                  f"({amostra.nbytes / 1024 ** 2:.1f} MB)")
+
+            def passada():
+                total = 0
+                for X, y in lotes_treino(historico, features, inicio, tamanho_lote):
+                    estratos = X["dia_semana"].to_numpy() * 24 + X["hora"].to_numpy()
+                    amostra.adicionar(X.to_numpy(np.float32), y, estratos)
+                    total += len(y)
+                return {"registros": total}
+
+            registros_epocas.append(_epoca(1, "amostragem", passada))
+            treinado = RandomForestRegressor(n_estimators=100, random_state=SEMENTE, max_depth=10)
+
+            def ajuste():
+                X, y = amostra.dados()
+                if len(y):
+                    treinado.fit(pd.DataFrame(X, columns=features), y)
+                return {"registros": len(y)}
+
+            registros_epocas.append(_epoca(2, "ajuste da floresta", ajuste))
+    finally:
+        if not rastreando:
+            tracemalloc.stop()
+
+    if registros_epocas[0]["registros"] == 0:
+        print("❌ Histórico vazio. Execute coleta_sptrans.py primeiro.")
+        return None, []
+
+    if salvar:
+        os.makedirs(os.path.dirname(MODELO_PATH), exist_ok=True)
+        joblib.dump(treinado, MODELO_PATH)
+        joblib.dump(features, FEATURES_PKL_PATH)
+        relatorio = {
+            "gerado_em": datetime.now().isoformat(timespec="seconds"),
+            "modelo": modelo,
+            "memoria_mb": memoria_mb,
+            "tamanho_lote": tamanho_lote,
+            "epocas": registros_epocas,
+        }
+        with open(RELATORIO_PATH + ".tmp", "w", encoding="utf-8") as arquivo:
+            json.dump(relatorio, arquivo, ensure_ascii=False, indent=2)
+        os.replace(RELATORIO_PATH + ".tmp", RELATORIO_PATH)
+        print(f"💾 Modelo salvo em {MODELO_PATH}")
+    return treinado, registros_epocas